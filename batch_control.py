@@ -0,0 +1,171 @@
+"""Cancel and pause for running conversion batches.
+
+A BatchControl holds one JobControl per dispatched job. run_ffmpeg registers
+each FFmpeg process with its job's control: pausing sends SIGSTOP (and
+resuming SIGCONT) to the processes, cancelling terminates them. Pausing the
+batch also stops new jobs from being dispatched. Qt-free; methods are safe to
+call from any thread. Each JobControl also collects the resource usage of its
+job's processes (see job_metrics.py).
+"""
+import signal
+import subprocess
+import threading
+
+from job_metrics import JobUsage
+
+# SIGSTOP/SIGCONT do not exist on Windows; there only cancel is available
+PAUSE_SUPPORTED = hasattr(signal, "SIGSTOP")
+
+
+class JobCancelled(subprocess.CalledProcessError):
+    """Raised by run_ffmpeg when its job was cancelled.
+
+    A CalledProcessError, so the per-format error handling in convert_video
+    also cleans up after a cancelled process.
+    """
+
+    def __str__(self):
+        return "Cancelled"
+
+
+def _send_signal(process, signal_number):
+    try:
+        process.send_signal(signal_number)
+    except (ProcessLookupError, OSError):
+        pass # Already exited
+
+
+class JobControl:
+    """Cancel/pause state of one job, the FFmpeg processes it is running and their resource usage."""
+
+    def __init__(self, paused=False, cancelled=False):
+        self.paused = paused
+        self.cancelled = cancelled
+        self.usage = JobUsage()
+        self._processes = set()
+        self._lock = threading.Lock()
+
+    def attach(self, process):
+        """Register a started process; it is stopped or terminated at once if the job already is."""
+        with self._lock:
+            self._processes.add(process)
+            if self.cancelled:
+                _send_signal(process, signal.SIGTERM)
+            elif self.paused and PAUSE_SUPPORTED:
+                _send_signal(process, signal.SIGSTOP)
+
+    def detach(self, process, usage=None):
+        """Forget a finished process, adding its job_metrics.wait_with_usage usage to the job's."""
+        with self._lock:
+            self._processes.discard(process)
+        self.usage.add(usage)
+
+    def pause(self):
+        """Stop the job's processes. Returns False if pausing is not supported here."""
+        if not PAUSE_SUPPORTED:
+            return False
+        with self._lock:
+            if not self.cancelled:
+                self.paused = True
+                for process in self._processes:
+                    _send_signal(process, signal.SIGSTOP)
+        return True
+
+    def resume(self):
+        with self._lock:
+            self.paused = False
+            if PAUSE_SUPPORTED:
+                for process in self._processes:
+                    _send_signal(process, signal.SIGCONT)
+
+    def cancel(self):
+        """Terminate the job's processes; later processes of the job are terminated as they start."""
+        with self._lock:
+            self.cancelled = True
+            for process in self._processes:
+                _send_signal(process, signal.SIGTERM)
+                if self.paused and PAUSE_SUPPORTED:
+                    _send_signal(process, signal.SIGCONT) # A stopped process only handles SIGTERM once continued
+            self.paused = False
+
+
+class BatchControl:
+    """Cancel/pause for a whole batch and for its jobs, addressed by scheduler.task_key."""
+
+    def __init__(self):
+        self.cancelled = False
+        self._running = threading.Event() # Cleared while the batch is paused
+        self._running.set()
+        self._jobs = {} # Key -> JobControl of a dispatched job
+        self._cancelled_keys = set() # Jobs cancelled before or while they ran
+        self._lock = threading.Lock()
+
+    @property
+    def paused(self):
+        return not self._running.is_set()
+
+    def job(self, key):
+        """Control for a job about to be dispatched."""
+        with self._lock:
+            control = JobControl(paused=self.paused, cancelled=self.cancelled or key in self._cancelled_keys)
+            self._jobs[key] = control
+            return control
+
+    def release(self, key):
+        """Forget a finished job's control."""
+        with self._lock:
+            self._jobs.pop(key, None)
+
+    def is_cancelled(self, key):
+        with self._lock:
+            return self.cancelled or key in self._cancelled_keys
+
+    def pause(self):
+        """Stop running jobs and hold back queued ones. Returns False if pausing is not supported here."""
+        if not PAUSE_SUPPORTED:
+            return False
+        with self._lock:
+            self._running.clear()
+            for control in self._jobs.values():
+                control.pause()
+        return True
+
+    def resume(self):
+        with self._lock:
+            self._running.set()
+            for control in self._jobs.values():
+                control.resume()
+
+    def cancel(self):
+        """Terminate running jobs; queued jobs are reported as cancelled instead of being started."""
+        with self._lock:
+            self.cancelled = True
+            for control in self._jobs.values():
+                control.cancel()
+        self._running.set() # Wake a dispatcher waiting on a paused batch
+
+    def pause_job(self, key):
+        """Stop one running job. Returns False if it is not running (or pausing is not supported)."""
+        with self._lock:
+            control = self._jobs.get(key)
+        return control.pause() if control is not None else False
+
+    def resume_job(self, key):
+        with self._lock:
+            control = self._jobs.get(key)
+        if control is None:
+            return False
+        control.resume()
+        return True
+
+    def cancel_job(self, key):
+        """Cancel one job: terminated if running, never started if still queued."""
+        with self._lock:
+            self._cancelled_keys.add(key)
+            control = self._jobs.get(key)
+        if control is not None:
+            control.cancel()
+
+    def wait_while_paused(self):
+        """Block until the batch is resumed or cancelled."""
+        self._running.wait()
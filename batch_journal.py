@@ -0,0 +1,170 @@
+"""Crash-safe journal of a running conversion batch.
+
+When a batch starts, its tasks and options are written to an append-only
+JSON-lines file, and each finished file is appended as it completes (flushed
+and fsynced). The journal is removed when the batch ends, so a journal left
+behind means the converter crashed or was killed; resuming it converts only
+the files without finished output.
+
+Every batch has its own journal file, locked (flock) while the batch runs, so
+overlapping batches (two CLI runs, say) neither overwrite nor delete each
+other's journals and a running batch's journal is never offered for resume.
+Without fcntl (Windows) journals are not locked. Qt-free.
+"""
+import glob
+import itertools
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+JOURNAL_DIR = os.path.join(os.path.expanduser("~"), ".cache", "mp4-converter")
+
+# Result statuses that count as finished work. Failed and cancelled files have no
+# finished output and are converted again on resume (a batch cancelled as a whole
+# removes its journal, so there is nothing to resume then).
+JOURNAL_DONE_STATUSES = ("success", "up_to_date", "skipped", "noop")
+
+_journal_numbers = itertools.count(1) # Keeps the journal names of one process's batches apart
+
+
+def journal_in_use(path):
+    """True if a running batch holds the journal at path."""
+    if fcntl is None:
+        return False
+    try:
+        with open(path, 'r') as f:
+            fcntl.flock(f, fcntl.LOCK_SH | fcntl.LOCK_NB) # Released when f is closed
+    except BlockingIOError:
+        return True
+    except OSError:
+        return False
+    return False
+
+
+def interrupted_journals(name="gui", journal_dir=None):
+    """Journals of a front end's batches that are not running (crashed or killed), newest first."""
+    paths = glob.glob(os.path.join(glob.escape(journal_dir or JOURNAL_DIR), f"{name}-batch*.jsonl"))
+    journals = []
+    for path in paths:
+        try:
+            modified = os.path.getmtime(path)
+        except OSError:
+            continue
+        if not journal_in_use(path):
+            journals.append((modified, path))
+    return [BatchJournal(name, path=path) for _, path in sorted(journals, reverse=True)]
+
+
+class BatchJournal:
+    """Journal file of one batch of a front end ("gui" or "cli"). Methods are safe to call from worker threads.
+
+    A new journal gets a file named after the front end, the time and the
+    process; pass path to reopen an interrupted one (see interrupted_journals),
+    whose file is then reused by the batch that resumes it.
+    """
+
+    def __init__(self, name="gui", journal_dir=None, path=None):
+        self.path = path or os.path.join(
+            journal_dir or JOURNAL_DIR, f"{name}-batch-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_journal_numbers)}.jsonl"
+        )
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _append(self, record):
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def start(self, tasks, options):
+        """Begin journaling a batch, replacing what the journal held; the file stays locked until finish() or close()."""
+        with self._lock:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                # Opened without truncating: a journal another batch holds must be left as it is
+                self._file = open(self.path, 'a')
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        self._file.close()
+                        self._file = None
+                        print(f"Batch journal {self.path} is in use by another batch. This batch cannot be resumed.")
+                        return
+                self._file.truncate(0)
+                self._append({"event": "batch", "tasks": tasks, "options": options})
+            except (OSError, TypeError, ValueError) as e:
+                print(f"Could not write batch journal {self.path}: {e}. This batch cannot be resumed.")
+                if self._file is not None:
+                    self._file.close()
+                self._file = None
+
+    def record(self, result):
+        """Append one finished file."""
+        with self._lock:
+            if self._file is None:
+                return
+            try:
+                self._append({"event": "file", "path": result['path'], "status": result['status']})
+            except OSError as e:
+                print(f"Could not write batch journal {self.path}: {e}")
+
+    def close(self):
+        """Stop journaling (the batch was aborted) and unlock the journal, which is kept for resume."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def finish(self):
+        """The batch ended (completed or was cancelled): nothing is left to resume."""
+        with self._lock:
+            if self._file is None and journal_in_use(self.path):
+                return # Another batch resumed this journal meanwhile
+            if fcntl is None and self._file is not None:
+                self._file.close() # Windows cannot remove an open file
+                self._file = None
+            try:
+                # Removed while still locked, so no other batch picks it up in between
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Could not remove batch journal {self.path}: {e}")
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def load(self):
+        """The interrupted batch, as {'tasks': unfinished task dicts, 'options', 'finished': count}, or None.
+
+        A torn last line (crash mid-write) is ignored.
+        """
+        try:
+            with open(self.path, 'r') as f:
+                lines = f.readlines()
+        except OSError:
+            return None
+        batch = None
+        finished = set()
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("event") == "batch":
+                batch = record
+                finished = set()
+            elif record.get("event") == "file" and record.get("status") in JOURNAL_DONE_STATUSES:
+                finished.add(record.get("path"))
+        if batch is None:
+            return None
+        # Job IDs belong to the queue of the process that crashed
+        tasks = [{key: value for key, value in task.items() if key != 'job_id'}
+                 for task in batch.get("tasks", []) if task.get('path') not in finished]
+        return {"tasks": tasks, "options": batch.get("options", {}), "finished": len(finished)}
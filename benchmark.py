@@ -0,0 +1,287 @@
+"""Benchmark encoder settings and worker/thread configurations on this machine.
+
+    python -m benchmark --resolutions 480p 720p --workers 1 2 4 --threads 1 2 auto --profiles fast balanced
+
+Synthetic clips (testsrc2 video, sine audio) are generated locally with FFmpeg's
+lavfi sources. Every combination of resolution x workers x threads x speed
+profile is then converted through the regular pipeline (BatchRunner and
+convert_video), each in its own Python process so the CPU time and peak RSS of
+its FFmpeg children are measured in isolation. Results go to JSON and CSV;
+--compare reports configurations that got slower than in an earlier results file.
+"""
+import argparse
+import contextlib
+import csv
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource # Unix only; without it CPU time and peak RSS are not recorded
+except ImportError:
+    resource = None
+
+from conversion_engine import SPEED_PROFILES, BatchRunner, options_from_settings, parse_count_or_auto
+
+BENCHMARK_SIZES = {"480p": (854, 480), "720p": (1280, 720), "1080p": (1920, 1080)}
+BENCHMARK_CLIP_SECONDS = 10
+REGRESSION_TOLERANCE = 0.10 # A configuration more than 10% slower than the baseline is a regression
+
+# Columns of the CSV file, in order; the JSON file holds the same fields per result
+RESULT_FIELDS = [
+    "resolution", "formats", "speed_profile", "workers", "threads", "jobs", "clip_seconds",
+    "wall_seconds", "cpu_seconds", "peak_rss_kb", "speed_factor", "output_bytes", "errors",
+]
+
+
+def generate_clip(path, resolution, seconds=BENCHMARK_CLIP_SECONDS):
+    """Write a synthetic H.264/AAC test clip at one of BENCHMARK_SIZES, unless it already exists."""
+    if os.path.exists(path):
+        return path
+    width, height = BENCHMARK_SIZES[resolution]
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = path + ".tmp.mp4"
+    subprocess.run(
+        ["ffmpeg", "-v", "error", "-y",
+         "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate=30",
+         "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=48000",
+         "-t", str(seconds), "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+         "-c:a", "aac", "-shortest", temp_path],
+        check=True, capture_output=True
+    )
+    os.replace(temp_path, path)
+    return path
+
+
+def benchmark_matrix(resolutions, workers_list, threads_list, profiles, formats, seconds=BENCHMARK_CLIP_SECONDS, jobs=None):
+    """Configurations to run: every resolution x workers x threads x profile combination.
+
+    Each configuration converts `jobs` copies of the clip (by default the largest
+    worker count), so different worker counts do the same amount of work.
+    """
+    jobs = jobs or max((os.cpu_count() or 1) if workers == "auto" else workers for workers in workers_list)
+    return [
+        {
+            "resolution": resolution, "formats": list(formats), "speed_profile": profile,
+            "workers": workers, "threads": threads, "jobs": jobs, "clip_seconds": seconds,
+        }
+        for resolution, workers, threads, profile in itertools.product(resolutions, workers_list, threads_list, profiles)
+    ]
+
+
+def _children_usage():
+    """(CPU seconds, peak RSS in KB) of the finished child processes of this process."""
+    if resource is None:
+        return None, None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    peak_rss = usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss # Bytes on macOS
+    return usage.ru_utime + usage.ru_stime, peak_rss
+
+
+def run_config(config, clip_path, work_dir):
+    """Convert config['jobs'] copies of clip_path with one configuration and measure it.
+
+    Meant to run in a fresh process (see run_benchmark): peak RSS is the largest
+    FFmpeg process this process has waited for.
+    """
+    run_dir = tempfile.mkdtemp(prefix="run-", dir=work_dir)
+    try:
+        tasks = []
+        for i in range(config["jobs"]):
+            copy_path = os.path.join(run_dir, f"clip_{i}.mp4")
+            try:
+                os.link(clip_path, copy_path)
+            except OSError:
+                shutil.copyfile(clip_path, copy_path)
+            tasks.append({'path': copy_path, 'convert_ogg': "ogg" in config["formats"], 'convert_webm': "webm" in config["formats"]})
+        options = options_from_settings({
+            "resolution": "Original", # The clip is already at the benchmarked size
+            "speed_profile": config["speed_profile"],
+            "workers": config["workers"],
+            "threads": config["threads"],
+            "preflight": False,
+        })
+
+        cpu_before, _ = _children_usage()
+        started = time.monotonic()
+        summary = BatchRunner(tasks, options).run()
+        wall_seconds = time.monotonic() - started
+        cpu_after, peak_rss = _children_usage()
+
+        output_bytes = 0
+        for result in summary["results"]:
+            for output_path in (result.get("outputs") or {}).values():
+                output_bytes += os.path.getsize(output_path)
+        return dict(
+            config,
+            wall_seconds=round(wall_seconds, 3),
+            cpu_seconds=round(cpu_after - cpu_before, 3) if cpu_before is not None else None,
+            peak_rss_kb=peak_rss,
+            speed_factor=round(config["clip_seconds"] * config["jobs"] / wall_seconds, 3) if wall_seconds > 0 else None,
+            output_bytes=output_bytes,
+            errors=summary["files_with_errors"],
+        )
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+
+def run_benchmark(configs, clip_dir, work_dir=None, progress=print):
+    """Run configs, each in a separate Python process, generating clips as needed. Returns the results."""
+    work_dir = work_dir or clip_dir
+    os.makedirs(work_dir, exist_ok=True)
+    results = []
+    for number, config in enumerate(configs, 1):
+        clip_path = generate_clip(
+            os.path.join(clip_dir, f"bench_{config['resolution']}_{config['clip_seconds']}s.mp4"),
+            config["resolution"], config["clip_seconds"]
+        )
+        progress(f"[{number}/{len(configs)}] {config['resolution']} {'+'.join(config['formats'])} "
+                 f"profile={config['speed_profile']} workers={config['workers']} threads={config['threads']}")
+        process = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--run-one", json.dumps(config), clip_path, work_dir],
+            capture_output=True, text=True
+        )
+        try:
+            result = json.loads(process.stdout.strip().splitlines()[-1])
+        except (IndexError, ValueError):
+            progress(f"  Failed: {process.stderr.strip()[-500:]}")
+            result = dict(config, errors=config["jobs"])
+        else:
+            progress(f"  {result['wall_seconds']:.2f}s wall, {result['speed_factor']}x realtime")
+        results.append(result)
+    return results
+
+
+def best_configs(results):
+    """Fastest error-free result (highest speed_factor) per resolution and format set."""
+    best = {}
+    for result in results:
+        if result.get("errors") or not result.get("speed_factor"):
+            continue
+        key = f"{result['resolution']} {'+'.join(result['formats'])}"
+        if key not in best or result["speed_factor"] > best[key]["speed_factor"]:
+            best[key] = result
+    return best
+
+
+def _config_key(result):
+    return tuple(str(result.get(field)) for field in RESULT_FIELDS[:RESULT_FIELDS.index("clip_seconds") + 1])
+
+
+def find_regressions(results, baseline_results, tolerance=REGRESSION_TOLERANCE):
+    """Configurations whose speed factor dropped by more than tolerance compared with baseline_results.
+
+    Returns a list of (result, baseline speed factor) pairs.
+    """
+    baseline = {_config_key(result): result for result in baseline_results if result.get("speed_factor")}
+    regressions = []
+    for result in results:
+        previous = baseline.get(_config_key(result))
+        if previous and result.get("speed_factor") is not None and \
+           result["speed_factor"] < previous["speed_factor"] * (1 - tolerance):
+            regressions.append((result, previous["speed_factor"]))
+    return regressions
+
+
+def machine_info():
+    """Description of the machine the benchmark ran on, stored with the results."""
+    try:
+        ffmpeg_version = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True).stdout.splitlines()[0]
+    except (OSError, IndexError):
+        ffmpeg_version = None
+    return {
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "ffmpeg": ffmpeg_version,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def write_results(results, output_dir, machine=None):
+    """Write benchmark.json (machine info, results, best configs) and benchmark.csv. Returns both paths."""
+    os.makedirs(output_dir, exist_ok=True)
+    json_path = os.path.join(output_dir, "benchmark.json")
+    csv_path = os.path.join(output_dir, "benchmark.csv")
+    with open(json_path, "w") as f:
+        json.dump({"machine": machine or machine_info(), "results": results, "best": best_configs(results)}, f, indent=2)
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        for result in results:
+            writer.writerow(dict(result, formats="+".join(result.get("formats", []))))
+    return json_path, csv_path
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmark",
+        description="Benchmark worker/thread counts and speed profiles on synthetic clips."
+    )
+    parser.add_argument("--resolutions", nargs="+", choices=list(BENCHMARK_SIZES), default=["480p", "720p", "1080p"])
+    parser.add_argument("--workers", nargs="+", default=["1", "2", "4"], help='Concurrent jobs to try (numbers or "auto")')
+    parser.add_argument("--threads", nargs="+", default=["1", "2", "4"], help='FFmpeg -threads values to try (numbers or "auto")')
+    parser.add_argument("--profiles", nargs="+", choices=list(SPEED_PROFILES), default=["realtime", "fast", "balanced"])
+    parser.add_argument("--formats", nargs="+", choices=["ogg", "webm"], default=["ogg", "webm"])
+    parser.add_argument("--seconds", type=int, default=BENCHMARK_CLIP_SECONDS, help="Length of each synthetic clip")
+    parser.add_argument("--jobs", type=int, help="Clips converted per configuration (default: the largest worker count)")
+    parser.add_argument("--clip-dir", default=os.path.join(tempfile.gettempdir(), "mp4-converter-benchmark"),
+                        help="Where synthetic clips are generated and kept between runs")
+    parser.add_argument("--output-dir", default="benchmark-results", help="Where benchmark.json and benchmark.csv are written")
+    parser.add_argument("--compare", help="Earlier benchmark.json; configurations that got slower are reported")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE,
+                        help="Allowed slowdown before a configuration counts as a regression (default: 0.10)")
+    parser.add_argument("--run-one", nargs=3, metavar=("CONFIG", "CLIP", "WORK_DIR"), help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.run_one:
+        # Child process of run_benchmark: pipeline log lines go to stderr, the result to stdout
+        config_json, clip_path, work_dir = args.run_one
+        with contextlib.redirect_stdout(sys.stderr):
+            result = run_config(json.loads(config_json), clip_path, work_dir)
+        print(json.dumps(result))
+        return 0
+
+    if not shutil.which("ffmpeg"):
+        print("FFmpeg was not found on PATH.", file=sys.stderr)
+        return 2
+    workers_list = [parse_count_or_auto(value) for value in args.workers]
+    threads_list = [parse_count_or_auto(value) for value in args.threads]
+    configs = benchmark_matrix(args.resolutions, workers_list, threads_list, args.profiles, args.formats, args.seconds, args.jobs)
+    results = run_benchmark(configs, args.clip_dir)
+    json_path, csv_path = write_results(results, args.output_dir)
+    print(f"Results written to {json_path} and {csv_path}")
+
+    for key, result in sorted(best_configs(results).items()):
+        print(f"Best for {key}: profile={result['speed_profile']} workers={result['workers']} "
+              f"threads={result['threads']} ({result['speed_factor']}x realtime)")
+
+    if args.compare:
+        try:
+            with open(args.compare, "r") as f:
+                baseline = json.load(f)["results"]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Could not read baseline {args.compare}: {e}", file=sys.stderr)
+            return 2
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for result, previous_speed in regressions:
+            print(f"Regression: {result['resolution']} {'+'.join(result['formats'])} profile={result['speed_profile']} "
+                  f"workers={result['workers']} threads={result['threads']}: "
+                  f"{previous_speed}x -> {result['speed_factor']}x realtime")
+        if regressions:
+            return 1
+        print("No regressions.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
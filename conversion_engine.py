@@ -0,0 +1,1407 @@
+"""Qt-free MP4 to OGG/WebM conversion pipeline.
+
+Shared by the PyQt5 GUI (multiple_videos_convert.py) and the headless CLI
+(convert_cli.py). Nothing here may import PyQt5.
+"""
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+import json
+import hashlib
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from batch_control import BatchControl, JobCancelled
+from device_io import DeviceLimiter, device_name, device_of, parse_device_concurrency, parse_device_limits, prefetch
+from encode_cache import EncodeCache, PASSLOG_PLACEHOLDER, parse_size
+from firstpass_cache import FirstPassCache
+from job_metrics import wait_with_usage
+from media_probe import plan_stream_copy, preflight, target_height
+from output_placement import DEFAULT_MOVE_WORKERS, OutputMover, output_folder, ship_outputs, staging_folder
+from scheduler import JobScheduler, estimate_cost, makespan_lower_bound, task_key
+from source_dedupe import dedupe_tasks, link_duplicates
+
+PRESET_FILE = "presets.json"
+
+# Resolution choices (as shown in the GUI and stored in presets) -> FFmpeg scale filter
+RESOLUTION_FILTERS = {
+    "480p": "scale=-2:480",
+    "720p": "scale=-2:720",
+    "1080p": "scale=-2:1080",
+    "Original": None,
+}
+
+# Settings used when neither the GUI nor a preset provides a value
+DEFAULT_SETTINGS = {
+    "resolution": "480p",
+    "audio_bitrate": "64k",
+    "ogg_quality": "5",
+    "webm_quality": "30",
+    "speed_profile": "balanced",
+    "webm_two_pass": False,
+    "webm_bitrate": "", # Two-pass target such as "2M"; empty for two-pass constant quality
+    "workers": "auto",
+    "threads": "auto",
+    "single_decode": True,
+    "incremental": False,
+    "incremental_hash": False,
+    "segmented": False,
+    "preflight": True,
+    "ladder": [], # Resolution ladder rungs such as ["480p", "720p", "1080p"]; empty for one output per format
+    "stream_copy": False, # Copy source streams already in an output's codec instead of re-encoding them
+    "ogg_audio_only": False, # OGG output holds only the audio; the video is never decoded
+    "dedupe": False, # Encode identical sources once and link the outputs of the others
+    "encode_cache": False, # Reuse outputs of identical sources encoded with identical settings (see encode_cache.py)
+    "encode_cache_dir": "", # Empty for ~/.cache/mp4-converter/encodes
+    "encode_cache_size": "20G", # Size limit of the encode cache; least recently used outputs are evicted
+    "output_root": "", # Empty for converted/ next to each source; else source folders are mirrored under it
+    "source_root": "", # Folder mirrored under output_root; sources outside it mirror their absolute path
+    "scratch_dir": "", # Local folder FFmpeg writes to; finished outputs are moved to their folder in the background
+    "move_workers": DEFAULT_MOVE_WORKERS, # Concurrent moves from the scratch folder
+    "device_concurrency": "off", # Jobs reading from one disk at once: "off", a number, or "auto" (one per rotational/USB disk)
+    "device_limits": {}, # {path on a volume: concurrent jobs} for single volumes
+    "prefetch": False, # Read each source ahead into the page cache when its job starts
+}
+
+
+def resolution_filter(resolution):
+    """Map a resolution choice ("480p", "720p", "1080p", "Original") to an FFmpeg scale filter."""
+    return RESOLUTION_FILTERS.get(resolution)
+
+
+def parse_audio_bitrate(bitrate):
+    """Audio bitrate such as "128k", or None to keep the original."""
+    return None if not bitrate or bitrate == "Original" else bitrate
+
+
+def parse_ogg_quality(value):
+    """OGG video quality clamped to 1-10 (default 5)."""
+    try:
+        return max(1, min(10, int(value)))
+    except (TypeError, ValueError):
+        return 5  # Default OGG quality
+
+
+def parse_webm_quality(value):
+    """WebM CRF value (default 30)."""
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return 30  # Default WebM quality
+
+
+def parse_video_bitrate(value):
+    """Video bitrate such as "2M" or "1500k", or None if empty or malformed."""
+    value = str(value or "").strip()
+    return value if re.fullmatch(r"\d+(\.\d+)?[kKmM]?", value) else None
+
+
+def parse_speed_profile(value):
+    """Name of a SPEED_PROFILES entry (default "balanced")."""
+    return value if value in SPEED_PROFILES else "balanced"
+
+
+def parse_ladder(value):
+    """Rung heights of a resolution ladder, lowest first ([] for no ladder).
+
+    Accepts a list or comma-separated string of resolution choices ("720p"), or
+    True for the default 480p/720p/1080p ladder; unknown names are dropped.
+    """
+    if value is True:
+        value = ["480p", "720p", "1080p"]
+    if isinstance(value, str):
+        value = value.split(",")
+    if not isinstance(value, (list, tuple)):
+        return []
+    heights = {target_height(resolution_filter(str(name).strip())) for name in value}
+    return sorted(height for height in heights if height)
+
+
+def parse_count_or_auto(value):
+    """A positive job/thread count, or "auto" to let the scheduler decide."""
+    try:
+        return max(1, int(value))
+    except (TypeError, ValueError):
+        return "auto"
+
+
+def parse_move_workers(value):
+    """Concurrent moves out of the scratch folder (default DEFAULT_MOVE_WORKERS)."""
+    try:
+        return max(1, int(value))
+    except (TypeError, ValueError):
+        return DEFAULT_MOVE_WORKERS
+
+
+def options_from_settings(settings):
+    """Turn a settings dict (GUI values or a preset) into conversion options for BatchRunner."""
+    merged = dict(DEFAULT_SETTINGS)
+    merged.update({key: value for key, value in settings.items() if value is not None})
+    return {
+        "resolution": resolution_filter(merged["resolution"]),
+        "audio_bitrate": parse_audio_bitrate(merged["audio_bitrate"]),
+        "ogg_quality": parse_ogg_quality(merged["ogg_quality"]),
+        "webm_quality": parse_webm_quality(merged["webm_quality"]),
+        "speed_profile": parse_speed_profile(merged["speed_profile"]),
+        "webm_two_pass": bool(merged["webm_two_pass"]),
+        "webm_bitrate": parse_video_bitrate(merged["webm_bitrate"]),
+        "workers": parse_count_or_auto(merged["workers"]), # Concurrent FFmpeg jobs (ThreadPoolExecutor size)
+        "threads": parse_count_or_auto(merged["threads"]), # This is the -threads for each ffmpeg command
+        "single_decode": bool(merged["single_decode"]),
+        "incremental": bool(merged["incremental"]),
+        "incremental_hash": bool(merged["incremental_hash"]),
+        "segmented": bool(merged["segmented"]), # Split long inputs into chunks encoded in parallel
+        "preflight": bool(merged["preflight"]), # Inspect sources before encoding (see media_probe.py)
+        "ladder": parse_ladder(merged["ladder"]), # Rung heights of a resolution ladder (see ladder.py)
+        "stream_copy": bool(merged["stream_copy"]), # Pass matching streams through (needs pre-flight codec info)
+        "ogg_audio_only": bool(merged["ogg_audio_only"]),
+        "dedupe": bool(merged["dedupe"]), # Content-hash duplicates share one encode (see source_dedupe.py)
+        "encode_cache": bool(merged["encode_cache"]),
+        "encode_cache_dir": merged["encode_cache_dir"] or None,
+        "encode_cache_size": parse_size(merged["encode_cache_size"]), # Bytes, None for the default limit
+        "output_root": merged["output_root"] or None, # See output_placement.py
+        "source_root": merged["source_root"] or None,
+        "scratch_dir": merged["scratch_dir"] or None,
+        "move_workers": parse_move_workers(merged["move_workers"]),
+        "device_concurrency": parse_device_concurrency(merged["device_concurrency"]), # None when off; see device_io.py
+        "device_limits": parse_device_limits(merged["device_limits"]),
+        "prefetch": bool(merged["prefetch"]),
+    }
+
+
+def load_presets(preset_file=PRESET_FILE):
+    """Load the presets dict from preset_file ({} if it does not exist).
+
+    Raises json.JSONDecodeError or ValueError if the file is corrupt.
+    """
+    if not os.path.exists(preset_file):
+        return {}
+    with open(preset_file, 'r') as f:
+        presets = json.load(f)
+    if not isinstance(presets, dict):
+        raise ValueError(f"{preset_file} does not contain a valid preset structure (expected a dictionary).")
+    return presets
+
+
+# Encoder threads per job for each output format: (efficient, max useful).
+# libtheora encodes on a single thread (extra threads only help decoding), while
+# libvpx-vp9 keeps gaining up to roughly 8 threads but is most efficient around 4.
+CODEC_THREAD_PROFILE = {
+    "OGG": (2, 4),
+    "WebM": (4, 8),
+}
+
+# Encoder speed/efficiency trade-offs, from fastest to smallest output at a given quality.
+# VP9: libvpx deadline and cpu-used, plus alt-ref frames and look-ahead for the slower
+# profiles. Theora: ffmpeg's libtheora wrapper has no speed control, so only the
+# keyframe interval changes (longer GOPs compress better, shorter ones seek faster).
+SPEED_PROFILES = {
+    "realtime": {"deadline": "realtime", "cpu_used": 8, "auto_alt_ref": 0, "lag_in_frames": 0, "ogg_keyint": 32},
+    "fast": {"deadline": "good", "cpu_used": 4, "auto_alt_ref": 1, "lag_in_frames": 16, "ogg_keyint": 64},
+    "balanced": {"deadline": "good", "cpu_used": 2, "auto_alt_ref": 1, "lag_in_frames": 25, "ogg_keyint": 128},
+    "archival": {"deadline": "good", "cpu_used": 0, "auto_alt_ref": 1, "lag_in_frames": 25, "ogg_keyint": 250},
+}
+
+# Highest cpu-used libvpx-vp9 accepts for each deadline
+VP9_MAX_CPU_USED = {"good": 5, "realtime": 9}
+
+
+def vp9_tile_columns(height):
+    """log2 of the VP9 tile columns for an output height (tiles must be at least 256 pixels wide)."""
+    if height is None:
+        return 2 # Unknown (original) size: libvpx lowers this if the frame is too narrow
+    if height >= 2160:
+        return 3
+    if height >= 720:
+        return 2
+    if height >= 360:
+        return 1
+    return 0
+
+
+def vp9_speed_args(speed_profile, height):
+    """libvpx-vp9 speed options for a SPEED_PROFILES name at an output height.
+
+    Row-based multithreading and tile columns let one encode use several threads;
+    at 1080p and above cpu-used is raised one step to keep throughput up.
+    """
+    profile = SPEED_PROFILES[parse_speed_profile(speed_profile)]
+    cpu_used = profile["cpu_used"]
+    if height is not None and height >= 1080:
+        cpu_used = min(cpu_used + 1, VP9_MAX_CPU_USED[profile["deadline"]])
+    return [
+        "-deadline", profile["deadline"],
+        "-cpu-used", str(cpu_used),
+        "-row-mt", "1",
+        "-tile-columns", str(vp9_tile_columns(height)),
+        "-auto-alt-ref", str(profile["auto_alt_ref"]),
+        "-lag-in-frames", str(profile["lag_in_frames"]),
+    ]
+
+
+# How many trailing stderr lines of each FFmpeg process are kept for error reports
+STDERR_TAIL_LINES = 200
+
+_DURATION_RE = re.compile(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)")
+
+
+def _parse_progress_number(value):
+    """Parse a numeric -progress field such as "29.97" or "1.5x"; None for "N/A"."""
+    try:
+        return float(value.rstrip("x"))
+    except (AttributeError, ValueError):
+        return None
+
+
+def run_ffmpeg(ffmpeg_command, progress_callback=None, control=None):
+    """Run an FFmpeg command, streaming its -progress output.
+
+    progress_callback (optional) is called from this thread with a dict holding
+    out_time and duration (seconds), fraction (0-1, None until the duration is
+    known), fps and speed. Only the last STDERR_TAIL_LINES stderr lines are kept;
+    on failure they are attached to the raised CalledProcessError as .stderr.
+    With a batch_control.JobControl the process can be paused and cancelled,
+    and its CPU time, peak RSS and I/O are added to the job's usage; a
+    cancelled process raises JobCancelled.
+    """
+    command = [ffmpeg_command[0], "-nostats", "-progress", "pipe:1"] + list(ffmpeg_command[1:])
+    process = subprocess.Popen(
+        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL,
+        text=True, errors="replace", bufsize=1
+    )
+    if control is not None:
+        control.attach(process)
+
+    stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+    media_info = {"duration": None}
+
+    def drain_stderr():
+        for line in process.stderr:
+            stderr_tail.append(line.rstrip("\n"))
+            if media_info["duration"] is None:
+                match = _DURATION_RE.search(line)
+                if match:
+                    hours, minutes, seconds = match.groups()
+                    media_info["duration"] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+    stderr_thread = threading.Thread(target=drain_stderr, daemon=True)
+    stderr_thread.start()
+
+    block = {}
+    out_time = 0.0
+    for line in process.stdout:
+        key, _, value = line.strip().partition("=")
+        if key != "progress":
+            block[key] = value
+            continue
+        if progress_callback:
+            # out_time_us is "N/A" while muxers flush; keep the last known position then
+            out_time_us = _parse_progress_number(block.get("out_time_us", block.get("out_time_ms")))
+            if out_time_us is not None:
+                out_time = max(out_time, out_time_us / 1000000)
+            duration = media_info["duration"]
+            fraction = 1.0 if value == "end" else (min(1.0, out_time / duration) if duration else None)
+            progress_callback({
+                "out_time": out_time,
+                "duration": duration,
+                "fraction": fraction,
+                "fps": _parse_progress_number(block.get("fps")),
+                "speed": _parse_progress_number(block.get("speed")),
+            })
+        block = {}
+
+    returncode, usage = wait_with_usage(process)
+    stderr_thread.join()
+    if control is not None:
+        control.detach(process, usage)
+        if returncode != 0 and control.cancelled:
+            raise JobCancelled(returncode, command, stderr="Cancelled")
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command, stderr="\n".join(stderr_tail))
+    return returncode
+
+
+class BatchProgress:
+    """Aggregates per-job progress into a batch fraction and ETA.
+
+    Jobs are weighted by source file size, so a long file counts for more than a
+    short one before its duration is known. Methods are safe to call from worker threads.
+    """
+
+    def __init__(self, paths):
+        self._weights = {}
+        for path in paths:
+            try:
+                self._weights[path] = max(1, os.path.getsize(path))
+            except OSError:
+                self._weights[path] = 1
+        self._total_weight = sum(self._weights.values()) or 1
+        self._fractions = dict.fromkeys(self._weights, 0.0)
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def update(self, path, fraction):
+        """Record a job's completed fraction (0-1) and return (batch fraction, ETA seconds or None)."""
+        with self._lock:
+            self._fractions[path] = max(0.0, min(1.0, fraction))
+            done = sum(self._weights[p] * f for p, f in self._fractions.items()) / self._total_weight
+        elapsed = time.monotonic() - self._started
+        eta = elapsed * (1 - done) / done if done > 0 else None
+        return done, eta
+
+
+def format_eta(seconds):
+    """Format seconds as H:MM:SS, or "--:--" when unknown."""
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+# Incremental mode: one manifest per source folder, stored next to its "converted" folder
+MANIFEST_FILE = "converted.manifest.json"
+MANIFEST_SAVE_INTERVAL = 30 # Seconds between manifest checkpoints during a batch
+
+# Conversion options that change the encoded output of each format. Threading and
+# single-decode only change how fast it is produced, so they do not invalidate outputs.
+ENCODING_SETTING_KEYS = {
+    "OGG": ("resolution", "audio_bitrate", "ogg_quality", "speed_profile"),
+    "WebM": ("resolution", "audio_bitrate", "webm_quality", "speed_profile", "webm_two_pass", "webm_bitrate"),
+}
+# Settings that also change an output but are only recorded when enabled, so
+# manifests written before they existed stay valid
+OPTIONAL_SETTING_KEYS = {
+    "OGG": ("stream_copy", "ogg_audio_only"),
+    "WebM": ("stream_copy",),
+}
+
+
+def file_content_hash(path, chunk_size=1024 * 1024):
+    """BLAKE2b hex digest of a file's contents."""
+    digest = hashlib.blake2b()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ConversionManifest:
+    """Records what has been converted in one source folder, for skip-if-up-to-date runs.
+
+    Each source file entry holds its size, mtime, an optional content hash and, per
+    output format, the output path (relative to the folder) and the encoding settings
+    it was produced with. Methods are safe to call from worker threads.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, MANIFEST_FILE)
+        self.entries = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if isinstance(data, dict) and isinstance(data.get("files"), dict):
+                self.entries = data["files"]
+            else:
+                print(f"Error: {self.path} is not a valid manifest. Ignoring it.")
+        except FileNotFoundError:
+            pass
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Could not read manifest {self.path}: {e}. All files will be converted.")
+
+    @staticmethod
+    def format_settings(options, format_name):
+        """The subset of conversion options that determines one format's output."""
+        settings = {key: options.get(key) for key in ENCODING_SETTING_KEYS[format_name]}
+        settings.update({key: options[key] for key in OPTIONAL_SETTING_KEYS[format_name] if options.get(key)})
+        if options.get("ladder"):
+            # The ladder replaces the single resolution; single-output entries keep their old shape
+            settings.update(resolution=None, ladder=list(options["ladder"]))
+        return settings
+
+    def formats_to_convert(self, file_path, formats, options, use_hash=False):
+        """Return the formats from `formats` whose output is missing or stale for file_path."""
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return list(formats) # Let the conversion itself report the problem
+
+        with self._lock:
+            entry = self.entries.get(os.path.basename(file_path))
+        if not entry or entry.get("size") != stat.st_size:
+            return list(formats)
+
+        if entry.get("mtime_ns") != stat.st_mtime_ns:
+            # Touched or copied: with hashing enabled, unchanged content is still up to date
+            if not (use_hash and entry.get("hash") and entry["hash"] == file_content_hash(file_path)):
+                return list(formats)
+            with self._lock:
+                entry["mtime_ns"] = stat.st_mtime_ns
+                self._dirty = True
+
+        stale = []
+        for format_name in formats:
+            output = entry.get("outputs", {}).get(format_name)
+            if not output or output.get("settings") != self.format_settings(options, format_name) or \
+               not os.path.exists(os.path.join(self.folder, output.get("path", ""))):
+                stale.append(format_name)
+        return stale
+
+    def record(self, file_path, output_files, options, use_hash=False):
+        """Record successful outputs ({format name: output path}) for file_path."""
+        try:
+            stat = os.stat(file_path)
+            content_hash = file_content_hash(file_path) if use_hash else None
+        except OSError as e:
+            print(f"Could not record {file_path} in manifest: {e}")
+            return
+
+        name = os.path.basename(file_path)
+        with self._lock:
+            entry = self.entries.get(name)
+            if not entry or entry.get("size") != stat.st_size or entry.get("mtime_ns") != stat.st_mtime_ns:
+                entry = {"outputs": {}} # Source changed: earlier outputs no longer describe it
+            entry.update({"size": stat.st_size, "mtime_ns": stat.st_mtime_ns})
+            if content_hash:
+                entry["hash"] = content_hash
+            for format_name, output_file in output_files.items():
+                entry["outputs"][format_name] = {
+                    "path": os.path.relpath(output_file, self.folder),
+                    "settings": self.format_settings(options, format_name),
+                }
+            self.entries[name] = entry
+            self._dirty = True
+
+    def save(self):
+        """Write the manifest atomically if it changed."""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {"version": 1, "files": self.entries}
+            tmp_path = self.path + ".tmp"
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump(data, f, indent=1)
+                os.replace(tmp_path, self.path)
+                self._dirty = False
+            except OSError as e:
+                print(f"Error saving manifest {self.path}: {e}")
+
+
+def job_formats(item_data):
+    """Output format names requested for one task dict."""
+    formats = []
+    if item_data.get('convert_ogg'):
+        formats.append("OGG")
+    if item_data.get('convert_webm'):
+        formats.append("WebM")
+    return formats
+
+
+def plan_concurrency(formats, jobs_remaining, workers_setting="auto", threads_setting="auto", cpu_count=None):
+    """Pick (concurrent jobs, FFmpeg threads per job) for the current batch state.
+
+    formats: output formats involved (e.g. ["OGG", "WebM"]); the thread profile of the
+        most demanding one decides how many threads a job can use.
+    jobs_remaining: queued plus running jobs; when fewer jobs than workers are left,
+        each job gets a larger share of the CPUs.
+    workers_setting / threads_setting: "auto" or a fixed positive int.
+    """
+    cpus = max(1, cpu_count or os.cpu_count() or 1)
+    jobs_remaining = max(1, jobs_remaining)
+    efficient_threads, max_threads = max(
+        (CODEC_THREAD_PROFILE[f] for f in formats if f in CODEC_THREAD_PROFILE),
+        default=(2, 4)
+    )
+
+    if workers_setting != "auto":
+        workers = workers_setting
+    elif threads_setting != "auto":
+        workers = max(1, cpus // threads_setting)
+    else:
+        workers = max(1, cpus // efficient_threads)
+    workers = min(workers, jobs_remaining)
+
+    if threads_setting != "auto":
+        threads = threads_setting
+    else:
+        threads = max(1, min(max_threads, cpus // workers))
+    return workers, threads
+
+
+def ogg_video_args(ogg_quality, threads, speed_profile="balanced"):
+    """FFmpeg video encoder options for the OGG (libtheora) target."""
+    keyint = SPEED_PROFILES[parse_speed_profile(speed_profile)]["ogg_keyint"]
+    return ["-c:v", "libtheora", "-q:v", str(ogg_quality), "-g", str(keyint), "-threads", str(threads)]
+
+
+def ogg_audio_args(audio_bitrate):
+    """FFmpeg audio encoder options for the OGG (libvorbis) target."""
+    args = ["-c:a", "libvorbis", "-q:a", "5"] # Audio quality for OGG (fixed at medium)
+    if audio_bitrate:
+        args += ["-b:a", audio_bitrate]
+    return args
+
+
+def stream_copy_args(stream):
+    """-c:v copy / -c:a copy for a stream ("v" or "a") planned as a passthrough (see media_probe.plan_stream_copy)."""
+    return [f"-c:{stream}", "copy"]
+
+
+def ogg_output_args(ogg_quality, audio_bitrate, threads, speed_profile="balanced", audio=True, copy_video=False, copy_audio=False):
+    """FFmpeg output options for the OGG (libtheora/libvorbis) target; audio=False writes no audio stream.
+
+    copy_video / copy_audio pass the source stream through instead of encoding it.
+    """
+    video_args = stream_copy_args("v") if copy_video else ogg_video_args(ogg_quality, threads, speed_profile)
+    if not audio:
+        return video_args + ["-an"]
+    return video_args + (stream_copy_args("a") if copy_audio else ogg_audio_args(audio_bitrate))
+
+
+def webm_video_args(webm_quality, threads, speed_profile="balanced", resolution=None, bitrate=None):
+    """FFmpeg video encoder options for the WebM (libvpx-vp9) target.
+
+    With a bitrate the encoder targets it (VBR, meant for two-pass); otherwise
+    -b:v 0 makes -crf constant quality rather than a cap on libvpx's default bitrate.
+    """
+    rate_control = ["-b:v", bitrate] if bitrate else ["-crf", str(webm_quality), "-b:v", "0"]
+    return ["-c:v", "libvpx-vp9"] + rate_control + ["-threads", str(threads)] + \
+        vp9_speed_args(speed_profile, target_height(resolution))
+
+
+def webm_audio_args(audio_bitrate):
+    """FFmpeg audio encoder options for the WebM (libopus) target."""
+    args = ["-c:a", "libopus"]
+    if audio_bitrate:
+        args += ["-b:a", audio_bitrate]
+    return args
+
+
+def webm_output_args(webm_quality, audio_bitrate, threads, speed_profile="balanced", resolution=None, bitrate=None, audio=True,
+                     copy_video=False, copy_audio=False):
+    """FFmpeg output options for the WebM (libvpx-vp9/libopus) target; audio=False writes no audio stream.
+
+    copy_video / copy_audio pass the source stream through instead of encoding it.
+    """
+    video_args = stream_copy_args("v") if copy_video else webm_video_args(webm_quality, threads, speed_profile, resolution, bitrate)
+    if not audio:
+        return video_args + ["-an"]
+    return video_args + (stream_copy_args("a") if copy_audio else webm_audio_args(audio_bitrate))
+
+
+def build_audio_only_command(file_path, output_file, audio_bitrate, copy_audio=False):
+    """Write only the first audio stream of file_path to an Ogg file; the video is never decoded."""
+    audio_args = stream_copy_args("a") if copy_audio else ogg_audio_args(audio_bitrate)
+    return ["ffmpeg", "-y", "-i", file_path, "-map", "0:a:0", "-vn", "-sn", "-dn"] + audio_args + [output_file]
+
+
+def webm_pass_args(pass_number, passlog_prefix):
+    """Two-pass options for the WebM video stream."""
+    return ["-pass", str(pass_number), "-passlogfile", passlog_prefix]
+
+
+def build_firstpass_command(file_path, resolution, webm_quality, threads, speed_profile, webm_bitrate, passlog_prefix):
+    """FFmpeg command for VP9 pass 1: analyse the scaled video and write only the pass log."""
+    ffmpeg_command = ["ffmpeg", "-y", "-i", file_path, "-map", "0:v:0", "-an"]
+    if resolution:
+        ffmpeg_command += ["-vf", resolution]
+    ffmpeg_command += webm_video_args(webm_quality, threads, speed_profile, resolution, webm_bitrate)
+    ffmpeg_command += webm_pass_args(1, passlog_prefix) + ["-f", "null", os.devnull]
+    return ffmpeg_command
+
+
+def build_single_decode_command(file_path, ogg_output_file, webm_output_file, resolution, audio_bitrate, ogg_quality, webm_quality, threads, speed_profile="balanced",
+                                webm_speed_profile=None, webm_bitrate=None, webm_extra_args=(), audio=True, copy_streams=None):
+    """Build one FFmpeg command that decodes the input once and writes both OGG and WebM.
+
+    The scale filter (if any) runs once and its output is split between the two encoders.
+    Without a scale filter both outputs map the same decoded video stream directly.
+    copy_streams ({format: {'video', 'audio'}}) passes planned streams through unencoded.
+    webm_extra_args (such as the pass-2 options) are added to the WebM output,
+    which is then written first: FFmpeg names pass logs after the global output
+    stream index, and the cached pass-1 log is for stream 0.
+    """
+    ffmpeg_command = ["ffmpeg", "-y", "-i", file_path]
+    if resolution:
+        ffmpeg_command += ["-filter_complex", f"[0:v:0]{resolution},split=2[ogg_v][webm_v]"]
+        ogg_video_map, webm_video_map = "[ogg_v]", "[webm_v]"
+    else:
+        ogg_video_map = webm_video_map = "0:v:0"
+
+    ogg_copy = (copy_streams or {}).get("OGG", {})
+    webm_copy = (copy_streams or {}).get("WebM", {})
+    audio_map = ["-map", "0:a:0?"] if audio else []
+    ogg_output = ["-map", ogg_video_map] + audio_map
+    ogg_output += ogg_output_args(ogg_quality, audio_bitrate, threads, speed_profile, audio,
+                                  ogg_copy.get("video", False), ogg_copy.get("audio", False))
+    ogg_output.append(ogg_output_file)
+
+    webm_output = ["-map", webm_video_map] + audio_map
+    webm_output += webm_output_args(webm_quality, audio_bitrate, threads, webm_speed_profile or speed_profile, resolution, webm_bitrate, audio,
+                                    webm_copy.get("video", False), webm_copy.get("audio", False))
+    webm_output += list(webm_extra_args)
+    webm_output.append(webm_output_file)
+
+    if webm_extra_args:
+        return ffmpeg_command + webm_output + ogg_output
+    return ffmpeg_command + ogg_output + webm_output
+
+
+def partial_output_path(output_file):
+    """Hidden file next to output_file that FFmpeg writes to until the encode succeeds.
+
+    The container extension is kept, since FFmpeg picks the muxer from it.
+    """
+    folder, name = os.path.split(output_file)
+    stem, extension = os.path.splitext(name)
+    return os.path.join(folder, f".{stem}.partial{extension}")
+
+
+def convert_video(file_path, convert_to_ogg, convert_to_webm, resolution, audio_bitrate, ogg_quality, webm_quality, threads, single_decode=True, progress_callback=None, segment_workers=None, speed_profile="balanced",
+                  two_pass=False, webm_bitrate=None, firstpass_cache=None, has_audio=True, control=None, ladder=None,
+                  copy_streams=None, ogg_audio_only=False, encode_cache=None, output_folder=None, scratch_dir=None,
+                  defer_moves=False):
+    """Convert a single MP4 video to OGG and/or WebM based on flags.
+
+    When both formats are requested and single_decode is set, one FFmpeg process
+    decodes and scales the input once and encodes both outputs.
+    speed_profile names the SPEED_PROFILES entry used for both encoders.
+    With segment_workers, long inputs are split at keyframes and encoded in that
+    many parallel chunks (see segmented.py), falling back to a single pass.
+    With two_pass, WebM is encoded in two passes (to webm_bitrate if given, else
+    constant quality); pass-1 logs are reused from firstpass_cache (a FirstPassCache).
+    has_audio=False (from the pre-flight probe) skips audio encoding.
+    progress_callback receives run_ffmpeg progress dicts, with fraction covering the whole file.
+    Outputs are encoded to hidden partial files and renamed into place on success.
+    control (a batch_control.JobControl) pauses or cancels the FFmpeg processes;
+    a cancelled job returns status "cancelled".
+    With ladder (rung heights), resolution is ignored and every rung is encoded
+    from one decode into converted/<stem>/ (see ladder.py); the result's outputs
+    hold the highest rung and its renditions list every file.
+    copy_streams ({format: {'video': bool, 'audio': bool}}, from
+    media_probe.plan_stream_copy) copies those source streams instead of
+    encoding them. With ogg_audio_only the OGG output holds only the audio, in
+    its own process that never decodes the video.
+    With encode_cache (an encode_cache.EncodeCache), outputs whose source and
+    FFmpeg command were encoded before are linked from the cache without
+    starting any process, pass 1 included; new outputs are added to it.
+    Segmented encodes and ladders are not cached.
+    Outputs go to output_folder (default: converted/ next to the source; see
+    output_placement.output_folder). With scratch_dir, FFmpeg writes to a
+    staging folder there and the finished files are shipped to output_folder
+    afterwards; with defer_moves that is left to the caller, which gets the
+    scratch paths in the result's 'staged' (see output_placement.ship_outputs).
+    Ladders are always written in place.
+    """
+    filename = os.path.basename(file_path)
+    if ladder and (convert_to_ogg or convert_to_webm):
+        from ladder import convert_ladder # Imported here: ladder builds on this module
+        if two_pass or segment_workers:
+            print(f"Resolution ladder: encoding {filename} in one constant-quality pass (two-pass and segmenting do not apply).")
+        if ogg_audio_only or copy_streams:
+            print(f"Resolution ladder: encoding every rendition of {filename} (audio-only OGG and stream copy do not apply).")
+        formats = [format_name for format_name, wanted in (("OGG", convert_to_ogg), ("WebM", convert_to_webm)) if wanted]
+        return convert_ladder(file_path, formats, ladder, audio_bitrate, ogg_quality, webm_quality, threads,
+                              progress_callback, speed_profile, has_audio, control, output_folder)
+    base_output_folder = output_folder or os.path.join(os.path.dirname(file_path), "converted")
+    staging_dir = None
+    if scratch_dir:
+        try:
+            staging_dir = staging_folder(scratch_dir, file_path)
+        except OSError as e:
+            print(f"Scratch directory {scratch_dir} is not usable ({e}); writing {filename} in place.")
+    if staging_dir is None:
+        os.makedirs(base_output_folder, exist_ok=True) # With scratch staging, the mover creates it
+
+    converted_formats = []
+    errors = []
+
+    ogg_output_file = os.path.join(base_output_folder, os.path.splitext(filename)[0] + ".ogg")
+    webm_output_file = os.path.join(base_output_folder, os.path.splitext(filename)[0] + ".webm")
+    output_files = {"OGG": ogg_output_file, "WebM": webm_output_file}
+    partial_files = {format_name: partial_output_path(output_file if staging_dir is None else
+                                                      os.path.join(staging_dir, os.path.basename(output_file)))
+                     for format_name, output_file in output_files.items()}
+
+    copy_streams = copy_streams or {}
+    audio_only_ogg = convert_to_ogg and ogg_audio_only
+    convert_to_ogg = convert_to_ogg and not ogg_audio_only # The audio-only OGG has its own process below
+    if audio_only_ogg:
+        copy_streams = dict(copy_streams, OGG={"video": False, "audio": copy_streams.get("OGG", {}).get("audio", False)})
+    copied = [f"{format_name} {stream}" for format_name, wanted in (("OGG", convert_to_ogg or audio_only_ogg), ("WebM", convert_to_webm))
+              if wanted for stream in ("video", "audio") if copy_streams.get(format_name, {}).get(stream)]
+    if copied:
+        print(f"Stream copy: passing {', '.join(copied)} of {filename} through without re-encoding.")
+    copy_video = any(plan.get("video") for plan in copy_streams.values())
+
+    two_pass = two_pass and convert_to_webm and not copy_streams.get("WebM", {}).get("video")
+    # libvpx's realtime deadline is one-pass only
+    webm_speed_profile = "fast" if two_pass and speed_profile == "realtime" else speed_profile
+
+    if segment_workers and two_pass:
+        print(f"Two-pass WebM: encoding {filename} without segmenting.")
+    elif segment_workers and copy_video:
+        print(f"Stream copy: converting {filename} without segmenting.")
+    elif segment_workers and (convert_to_ogg or convert_to_webm):
+        from segmented import convert_segmented # Imported here: segmented builds on this module
+        requested = {format_name: partial_files[format_name] for format_name, wanted in
+                     (("OGG", convert_to_ogg), ("WebM", convert_to_webm)) if wanted}
+        segmented_formats = convert_segmented(
+            file_path, requested, resolution, audio_bitrate, ogg_quality, webm_quality, segment_workers, progress_callback,
+            speed_profile=speed_profile, control=control
+        )
+        if segmented_formats:
+            print(f"Successfully converted {filename} to {' and '.join(segmented_formats)} (segmented).")
+            converted_formats += segmented_formats
+            convert_to_ogg = convert_to_webm = False # Done; only the outputs are left to move into place
+        elif control is not None and control.cancelled:
+            convert_to_ogg = convert_to_webm = False # No single-pass fallback for a cancelled job
+
+    def audio_only_command():
+        return build_audio_only_command(file_path, partial_files["OGG"], audio_bitrate, copy_streams["OGG"]["audio"])
+
+    def single_decode_command(webm_extra_args):
+        return build_single_decode_command(
+            file_path, partial_files["OGG"], partial_files["WebM"],
+            resolution, audio_bitrate, ogg_quality, webm_quality, threads, speed_profile,
+            webm_speed_profile, webm_bitrate, webm_extra_args, has_audio, copy_streams
+        )
+
+    def ogg_command():
+        ffmpeg_command = ["ffmpeg", "-y", "-i", file_path]
+        if resolution:
+            ffmpeg_command += ["-vf", resolution]
+        ffmpeg_command += ogg_output_args(ogg_quality, audio_bitrate, threads, speed_profile, has_audio,
+                                          copy_streams.get("OGG", {}).get("video", False), copy_streams.get("OGG", {}).get("audio", False))
+        return ffmpeg_command + [partial_files["OGG"]]
+
+    def webm_command(webm_extra_args):
+        ffmpeg_command = ["ffmpeg", "-y", "-i", file_path]
+        if resolution:
+            ffmpeg_command += ["-vf", resolution]
+        ffmpeg_command += webm_output_args(webm_quality, audio_bitrate, threads, webm_speed_profile, resolution, webm_bitrate, has_audio,
+                                           copy_streams.get("WebM", {}).get("video", False), copy_streams.get("WebM", {}).get("audio", False))
+        return ffmpeg_command + list(webm_extra_args) + [partial_files["WebM"]]
+
+    def run_encode(ffmpeg_command, formats):
+        run_ffmpeg(ffmpeg_command, report_progress, control)
+        if encode_cache is not None:
+            encode_cache.store_command(file_path, ffmpeg_command, [partial_files[format_name] for format_name in formats])
+
+    if encode_cache is not None:
+        # Look up whole commands before any process starts, so a cached two-pass WebM skips pass 1 too.
+        # The pass-log path is not part of the key, so a placeholder stands in for it.
+        webm_extra_args = webm_pass_args(2, PASSLOG_PLACEHOLDER) if two_pass else []
+        planned = []
+        if audio_only_ogg and has_audio:
+            planned.append((["OGG"], audio_only_command()))
+        if convert_to_ogg and convert_to_webm and single_decode:
+            planned.append((["OGG", "WebM"], single_decode_command(webm_extra_args)))
+        else:
+            if convert_to_ogg:
+                planned.append((["OGG"], ogg_command()))
+            if convert_to_webm:
+                planned.append((["WebM"], webm_command(webm_extra_args)))
+        for formats, ffmpeg_command in planned:
+            if encode_cache.fetch_command(file_path, ffmpeg_command, [partial_files[format_name] for format_name in formats]):
+                print(f"Encode cache: reused the {' and '.join(formats)} output of {filename}.")
+                converted_formats += formats
+        if "OGG" in converted_formats:
+            audio_only_ogg = convert_to_ogg = False
+        if "WebM" in converted_formats:
+            convert_to_webm = two_pass = False
+
+    passlog_prefix = None
+    firstpass_key = None
+    if two_pass:
+        firstpass_cache = firstpass_cache or FirstPassCache()
+        try:
+            firstpass_key = firstpass_cache.key(file_path, resolution)
+            passlog_prefix = firstpass_cache.lookup(firstpass_key)
+        except OSError as e:
+            error_message = f"Failed to convert {filename} to WebM: {e}"
+            print(error_message)
+            errors.append(error_message)
+            two_pass = convert_to_webm = False
+
+    # Scale each process's fraction so the file goes 0-100% once, even with separate processes
+    process_count = 1 if (convert_to_ogg and convert_to_webm and single_decode) else max(1, int(convert_to_ogg) + int(convert_to_webm))
+    process_count += int(two_pass and passlog_prefix is None) + int(audio_only_ogg)
+    finished_processes = [0]
+
+    def report_progress(info):
+        if progress_callback:
+            if info["fraction"] is not None:
+                info = dict(info, fraction=(finished_processes[0] + info["fraction"]) / process_count)
+            progress_callback(info)
+
+    if audio_only_ogg:
+        try:
+            if not has_audio:
+                raise ValueError("the source has no audio stream")
+            print(f"Extracting the audio of {filename} to OGG...")
+            run_encode(audio_only_command(), ["OGG"])
+            print(f"Successfully converted {filename} to audio-only OGG.")
+            converted_formats.append("OGG")
+        except subprocess.CalledProcessError as e:
+            error_message = f"Failed to convert {filename} to audio-only OGG: {e.stderr}"
+            print(error_message)
+            errors.append(error_message)
+        except Exception as e: # Catch other potential errors
+            error_message = f"An unexpected error occurred while converting {filename} to audio-only OGG: {str(e)}"
+            print(error_message)
+            errors.append(error_message)
+        finished_processes[0] += 1
+
+    uncached_passlog = None # Pass-1 log that could not be cached; used for this file only, removed after pass 2
+    if two_pass and passlog_prefix is None:
+        temp_prefix = firstpass_cache.temp_prefix(firstpass_key)
+        if not os.path.isdir(firstpass_cache.cache_dir):
+            # The cache folder could not be created: write the log next to the partial output instead
+            temp_prefix = uncached_passlog = os.path.join(
+                os.path.dirname(partial_files["WebM"]), f".{os.path.basename(temp_prefix)}"
+            )
+        try:
+            print(f"Analysing {filename} for two-pass WebM (pass 1)...")
+            run_ffmpeg(build_firstpass_command(
+                file_path, resolution, webm_quality, threads, webm_speed_profile, webm_bitrate, temp_prefix
+            ), report_progress, control)
+        except subprocess.CalledProcessError as e:
+            firstpass_cache.discard(temp_prefix)
+            error_message = f"Failed to convert {filename} to WebM (pass 1): {e.stderr}"
+            print(error_message)
+            errors.append(error_message)
+            convert_to_webm = False
+        except Exception as e: # Catch other potential errors
+            firstpass_cache.discard(temp_prefix)
+            error_message = f"An unexpected error occurred while converting {filename} to WebM (pass 1): {str(e)}"
+            print(error_message)
+            errors.append(error_message)
+            convert_to_webm = False
+        else:
+            passlog_prefix = temp_prefix
+            if uncached_passlog is None:
+                try:
+                    passlog_prefix = firstpass_cache.store(temp_prefix, firstpass_key)
+                except OSError as e:
+                    print(f"Could not cache the pass-1 log of {filename}: {e}")
+                    uncached_passlog = temp_prefix
+        finished_processes[0] += 1
+    webm_extra_args = webm_pass_args(2, passlog_prefix) if two_pass and passlog_prefix else []
+
+    if convert_to_ogg and convert_to_webm and single_decode:
+        try:
+            print(f"Converting {filename} to OGG and WebM (single decode)...")
+            run_encode(single_decode_command(webm_extra_args), ["OGG", "WebM"])
+            print(f"Successfully converted {filename} to OGG and WebM.")
+            converted_formats += ["OGG", "WebM"]
+        except subprocess.CalledProcessError as e:
+            # A shared process fails as a whole, so both formats report the failure
+            for format_name in ("OGG", "WebM"):
+                error_message = f"Failed to convert {filename} to {format_name}: {e.stderr}"
+                print(error_message)
+                errors.append(error_message)
+        except Exception as e: # Catch other potential errors
+            for format_name in ("OGG", "WebM"):
+                error_message = f"An unexpected error occurred while converting {filename} to {format_name}: {str(e)}"
+                print(error_message)
+                errors.append(error_message)
+        finished_processes[0] += 1
+        convert_to_ogg = convert_to_webm = False # Both handled above
+
+    if convert_to_ogg:
+        try:
+            print(f"Converting {filename} to OGG...")
+            run_encode(ogg_command(), ["OGG"])
+            print(f"Successfully converted {filename} to OGG.")
+            converted_formats.append("OGG")
+        except subprocess.CalledProcessError as e:
+            error_message = f"Failed to convert {filename} to OGG: {e.stderr}"
+            print(error_message)
+            errors.append(error_message)
+        except Exception as e: # Catch other potential errors
+            error_message = f"An unexpected error occurred while converting {filename} to OGG: {str(e)}"
+            print(error_message)
+            errors.append(error_message)
+        finished_processes[0] += 1
+
+
+    if convert_to_webm:
+        try:
+            print(f"Converting {filename} to WebM...")
+            run_encode(webm_command(webm_extra_args), ["WebM"])
+            print(f"Successfully converted {filename} to WebM.")
+            converted_formats.append("WebM")
+        except subprocess.CalledProcessError as e:
+            error_message = f"Failed to convert {filename} to WebM: {e.stderr}"
+            print(error_message)
+            errors.append(error_message)
+        except Exception as e: # Catch other potential errors
+            error_message = f"An unexpected error occurred while converting {filename} to WebM: {str(e)}"
+            print(error_message)
+            errors.append(error_message)
+    if uncached_passlog is not None:
+        firstpass_cache.discard(uncached_passlog)
+
+    # Only complete outputs are moved into place; partial files of failed encodes are deleted
+    staged = {}
+    for format_name, partial_file in partial_files.items():
+        if format_name in converted_formats and staging_dir is not None:
+            staged[format_name] = partial_file # Shipped from scratch below, or by the caller
+        elif format_name in converted_formats:
+            try:
+                os.replace(partial_file, output_files[format_name])
+            except OSError as e:
+                converted_formats.remove(format_name)
+                error_message = f"Failed to move the {format_name} output of {filename} into place: {e}"
+                print(error_message)
+                errors.append(error_message)
+        else:
+            try:
+                os.remove(partial_file)
+            except OSError:
+                pass
+    if staging_dir is not None and not staged:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    outputs = {format_name: output_files[format_name] for format_name in converted_formats}
+    if control is not None and control.cancelled:
+        print(f"Cancelled {filename}.")
+        result = {"path": file_path, "status": "cancelled", "formats": converted_formats, "errors": [], "outputs": outputs}
+    elif not converted_formats and not errors:
+        print(f"No conversion selected for {filename}.")
+        result = {"path": file_path, "status": "skipped", "formats": [], "errors": []}
+    elif errors:
+        # If there were errors, the status reflects that, even if one format succeeded
+        result = {"path": file_path, "status": "error", "formats": converted_formats, "errors": errors, "outputs": outputs}
+    elif converted_formats:
+        # If at least one format converted successfully and no errors
+        result = {"path": file_path, "status": "success", "formats": converted_formats, "errors": [], "outputs": outputs}
+    else:
+        # Should not be reached if at least one format was selected, but as a fallback
+        result = {"path": file_path, "status": "noop", "formats": [], "errors": ["No conversion attempted or an unknown issue."]}
+
+    if staged:
+        result["staged"] = staged
+        if not defer_moves:
+            result = ship_outputs(result)
+    return result
+
+
+class BatchRunner:
+    """Converts a list of task dicts ({'path', 'convert_ogg', 'convert_webm'}) in a thread pool.
+
+    Tasks are dispatched by an optional 'priority' key (higher first), then
+    longest estimated job first (see scheduler.py); set_priority() reorders
+    pending tasks while the batch runs. pause()/resume()/cancel() and their
+    per-job variants control a running batch (see batch_control.py). With a
+    batch_journal.BatchJournal, finished files are journaled so a crashed
+    batch can be resumed. Each job's wall time, CPU time, peak RSS and I/O are
+    measured and, with a job_metrics.MetricsRecorder, exported as events.
+
+    Optional callbacks are invoked from worker threads:
+      on_file_started(path), on_file_finished(result), on_progress(completed, total),
+      on_job_progress(path, info), on_batch_progress(fraction, eta_seconds).
+    run() blocks until the batch is done and returns the summary dict.
+    """
+
+    def __init__(self, tasks, options, convert_fn=None, on_file_finished=None, on_progress=None,
+                 on_job_progress=None, on_batch_progress=None, on_file_started=None, journal=None, metrics=None):
+        self.tasks = tasks
+        self.options = options
+        self.convert_fn = convert_fn or convert_video
+        self.on_file_started = on_file_started
+        self.on_file_finished = on_file_finished
+        self.on_progress = on_progress
+        self.on_job_progress = on_job_progress
+        self.on_batch_progress = on_batch_progress
+        self.batch_tracker = None
+        self.scheduler = JobScheduler()
+        self.control = BatchControl()
+        self.journal = journal
+        self.metrics = metrics
+
+    def _notify(self, callback, *args):
+        if callback:
+            callback(*args)
+
+    def _file_finished(self, result):
+        if self.journal is not None:
+            self.journal.record(result)
+        self._notify(self.on_file_finished, result)
+
+    # Batch and per-job control; keys are job IDs (or paths). Safe to call from another thread.
+    def pause(self):
+        return self.control.pause()
+
+    def resume(self):
+        self.control.resume()
+
+    def cancel(self):
+        self.control.cancel()
+
+    def pause_job(self, key):
+        return self.control.pause_job(key)
+
+    def resume_job(self, key):
+        return self.control.resume_job(key)
+
+    def cancel_job(self, key):
+        self.control.cancel_job(key)
+
+    def set_priority(self, key, priority):
+        """Reprioritize a pending task by job ID (or path). Safe to call from another thread.
+
+        Returns False if the task was already dispatched.
+        """
+        return self.scheduler.set_priority(key, priority)
+
+    def run(self):
+        """Convert every task and return the batch summary.
+
+        Jobs are dispatched only as workers free up, so each job's -threads value can be
+        chosen from the number of jobs still left (the tail of a batch gets more threads).
+        """
+        completed_count = 0
+        successful_ogg_conversions = 0
+        successful_webm_conversions = 0
+        files_with_errors = 0
+        error_details = [] # Store more detailed error messages
+        results = []
+
+        up_to_date_files = 0
+        cancelled_files = 0
+        manifests = {} # Source folder -> ConversionManifest, incremental mode only
+        incremental = self.options.get('incremental', False)
+        use_hash = self.options.get('incremental_hash', False)
+
+        if self.journal is not None:
+            self.journal.start(self.tasks, self.options)
+
+        tasks = self.tasks
+        if incremental:
+            # Drop formats whose outputs are current before any FFmpeg process is started
+            tasks = []
+            for item_data in self.tasks:
+                manifest = self._manifest_for(manifests, item_data['path'])
+                stale_formats = manifest.formats_to_convert(item_data['path'], job_formats(item_data), self.options, use_hash)
+                if stale_formats:
+                    tasks.append(dict(item_data, convert_ogg="OGG" in stale_formats, convert_webm="WebM" in stale_formats))
+                    continue
+                up_to_date_files += 1
+                completed_count += 1
+                result = {"path": item_data['path'], "status": "up_to_date", "formats": [], "errors": []}
+                results.append(result)
+                self._file_finished(result)
+            if up_to_date_files:
+                print(f"Incremental: {up_to_date_files} file(s) already up to date")
+                self._notify(self.on_progress, completed_count, len(self.tasks))
+
+        duplicates = {} # Path of the encoded file -> identical files that get links to its outputs
+        deduplicated_files = 0
+        dedupe_saved_bytes = 0
+        dedupe_saved_seconds = 0.0
+        if self.options.get('dedupe') and len(tasks) > 1:
+            if self.options.get('ladder'):
+                print("Dedupe: not applied to resolution ladders; every file is encoded.")
+            else:
+                tasks, duplicates = dedupe_tasks(tasks)
+
+        # Reported once here; each file then fails with its own error instead of the batch aborting
+        ffmpeg_missing = self.convert_fn is convert_video and bool(tasks) and shutil.which("ffmpeg") is None
+        if ffmpeg_missing:
+            err_msg = "FFmpeg not found: install it or add it to PATH"
+            print(err_msg)
+            error_details.append(err_msg)
+
+        if self.options.get('preflight') and tasks:
+            # Inspect sources first: unreadable files never reach a worker, and each task
+            # gets its own resolution/audio plan and a probed duration for the scheduler
+            tasks, unreadable = preflight(tasks, self.options['resolution'], ogg_audio_only=self.options.get('ogg_audio_only', False))
+            for item_data in unreadable:
+                # Identical copies of an unreadable file are unreadable too
+                for unreadable_data in [item_data] + duplicates.pop(item_data['path'], {}).get("tasks", []):
+                    files_with_errors += 1
+                    err_msg = f"Skipped {os.path.basename(unreadable_data['path'])}: not a readable video (corrupt or unsupported)"
+                    print(err_msg)
+                    error_details.append(err_msg)
+                    completed_count += 1
+                    result = {"path": unreadable_data['path'], "status": "error", "formats": [], "errors": [err_msg]}
+                    results.append(result)
+                    self._file_finished(result)
+            if unreadable:
+                self._notify(self.on_progress, completed_count, len(self.tasks))
+            if self.options.get('stream_copy'):
+                # Streams already in an output's codec are copied; the plan also lowers the job's cost estimate
+                tasks = [dict(item_data, copy_streams=plan_stream_copy(item_data, job_formats(item_data), self.options['audio_bitrate']))
+                         for item_data in tasks]
+
+        # Shared by all jobs so one batch's hits and misses can be reported
+        firstpass_cache = FirstPassCache() if self.options['webm_two_pass'] else None
+        encode_cache = None
+        if self.options.get('encode_cache'):
+            encode_cache = EncodeCache(self.options.get('encode_cache_dir'), self.options.get('encode_cache_size'))
+        # With a scratch folder, a job's slot is freed as soon as FFmpeg exits; the mover ships its outputs
+        mover = OutputMover(self.options.get('move_workers', DEFAULT_MOVE_WORKERS)) if self.options.get('scratch_dir') else None
+        moving = {} # Move future -> (task, result, wall seconds, usage, critical error) of a finished encode
+
+        batch_formats = {f for item_data in tasks for f in job_formats(item_data)}
+        num_workers, _ = plan_concurrency(
+            batch_formats, len(tasks), self.options['workers'], self.options['threads']
+        )
+        print(f"Scheduler: {num_workers} concurrent job(s) on {os.cpu_count()} CPU(s)")
+        # Configured concurrency regardless of batch size: the most FFmpeg encodes that run at once
+        worker_budget, _ = plan_concurrency(batch_formats, sys.maxsize, self.options['workers'], self.options['threads'])
+
+        # Jobs are grouped by the device their source is on; a device at its cap holds its next jobs back
+        limiter = DeviceLimiter(self.options.get('device_concurrency'), self.options.get('device_limits'))
+        devices = {task_key(item_data): device_of(item_data['path']) for item_data in tasks}
+        for device in sorted({device for device in devices.values() if device is not None}):
+            cap = limiter.cap(device)
+            if cap is not None and cap < num_workers:
+                print(f"Device {device_name(device)}: at most {cap} concurrent job(s) "
+                      f"({sum(1 for d in devices.values() if d == device)} queued file(s))")
+        device_workers = limiter.max_running(list(devices.values()))
+        if device_workers < num_workers:
+            print(f"Scheduler: device caps allow only {device_workers} of {num_workers} concurrent job(s)")
+        prefetch_sources = self.options.get('prefetch', False)
+
+        for item_data in tasks:
+            self.scheduler.push(item_data, estimate_cost(item_data, self.options['resolution'], self.options.get('ladder'),
+                                                         self.options.get('ogg_audio_only', False)),
+                                item_data.get('priority', 0), devices[task_key(item_data)])
+
+        self.batch_tracker = BatchProgress([item_data['path'] for item_data in tasks])
+        futures = {}
+        job_started = {} # Future -> monotonic start time, for the makespan report
+        job_controls = {} # Future -> JobControl, whose usage is read when the job ends
+        job_seconds = []
+        cpu_seconds = 0.0
+        peak_rss_kb = 0
+        last_manifest_save = time.monotonic()
+        batch_started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            try:
+                while True:
+                    while len(futures) < num_workers and not self.control.paused:
+                        item_data = self.scheduler.pop(limiter.available)
+                        if item_data is None:
+                            break # Nothing pending, or every pending source is on a device at its cap
+                        key = task_key(item_data)
+                        if self.control.is_cancelled(key):
+                            # Cancelled while queued: never started, nor are its identical copies
+                            for cancelled_data in [item_data] + duplicates.pop(item_data['path'], {}).get("tasks", []):
+                                cancelled_files += 1
+                                completed_count += 1
+                                result = {"path": cancelled_data['path'], "status": "cancelled", "formats": [], "errors": []}
+                                results.append(result)
+                                self._file_finished(result)
+                            self._notify(self.on_progress, completed_count, len(self.tasks))
+                            continue
+                        jobs_remaining = len(self.scheduler) + len(futures) + 1
+                        _, threads = plan_concurrency(
+                            job_formats(item_data), jobs_remaining,
+                            num_workers, self.options['threads']
+                        )
+                        # Chunks of a segmented job share the worker budget with the jobs that can run beside it
+                        segment_workers = max(1, worker_budget // min(worker_budget, jobs_remaining)) if self.options.get('segmented') else None
+                        job_control = self.control.job(key)
+                        limiter.acquire(devices.get(key))
+                        if prefetch_sources:
+                            # Readahead is queued by the kernel; the dispatch loop does not wait for it
+                            threading.Thread(target=prefetch, args=(item_data['path'],), daemon=True).start()
+                        if self.metrics is not None:
+                            self.metrics.job_started(item_data['path'], item_data.get('job_id'))
+                        future = executor.submit(
+                            self.convert_fn,
+                            item_data['path'],
+                            item_data['convert_ogg'],
+                            item_data['convert_webm'],
+                            item_data['resolution'] if 'resolution' in item_data else self.options['resolution'],
+                            self.options['audio_bitrate'],
+                            self.options['ogg_quality'],
+                            self.options['webm_quality'],
+                            threads, # This is the -threads for ffmpeg command
+                            self.options['single_decode'],
+                            self._make_progress_callback(item_data['path']),
+                            segment_workers,
+                            speed_profile=self.options['speed_profile'],
+                            two_pass=self.options['webm_two_pass'],
+                            webm_bitrate=self.options['webm_bitrate'],
+                            firstpass_cache=firstpass_cache,
+                            has_audio=item_data.get('has_audio', True),
+                            control=job_control,
+                            ladder=self.options.get('ladder'),
+                            copy_streams=item_data.get('copy_streams'),
+                            ogg_audio_only=self.options.get('ogg_audio_only', False),
+                            encode_cache=encode_cache,
+                            output_folder=output_folder(item_data['path'], self.options.get('output_root'), self.options.get('source_root')),
+                            scratch_dir=self.options.get('scratch_dir'),
+                            defer_moves=mover is not None
+                        )
+                        futures[future] = item_data
+                        job_started[future] = time.monotonic()
+                        job_controls[future] = job_control
+                        self._notify(self.on_file_started, item_data['path'])
+                    if not futures and not moving:
+                        if self.control.paused and len(self.scheduler):
+                            self.control.wait_while_paused()
+                            continue
+                        break
+
+                    done, _ = wait(list(futures) + list(moving), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if future in moving:
+                            # Outputs shipped from scratch: the file is finished now
+                            item_data, _, wall_seconds, usage, critical_error = moving.pop(future)
+                            original_file_path = item_data['path']
+                            result = future.result() # ship_outputs reports failed moves in the result
+                        else:
+                            item_data = futures.pop(future)
+                            original_file_path = item_data['path']
+                            self.control.release(task_key(item_data))
+                            limiter.release(devices.get(task_key(item_data)))
+                            wall_seconds = time.monotonic() - job_started.pop(future)
+                            job_seconds.append(wall_seconds)
+                            usage = job_controls.pop(future).usage
+                            cpu_seconds += usage.user_cpu + usage.system_cpu
+                            peak_rss_kb = max(peak_rss_kb, usage.peak_rss_kb)
+                            critical_error = None
+                            try:
+                                result = future.result()  # result is a dict from convert_video
+                            except Exception as e:
+                                # This catches errors from the future.result() call itself, or unexpected issues in convert_video
+                                critical_error = f"Critical error processing {os.path.basename(original_file_path)}: {str(e)}"
+                                print(critical_error) # Log critical errors to console
+                                result = {"path": original_file_path, "status": "error", "formats": [], "errors": [critical_error]}
+                            if result.get('staged') and mover is not None:
+                                moving[mover.submit(result)] = (item_data, result, wall_seconds, usage, critical_error)
+                                continue
+
+                        # Identical sources share the encode: link their outputs before primary's extra formats go
+                        finished = [result]
+                        if original_file_path in duplicates:
+                            linked_results, saved_bytes = link_duplicates(item_data, result, duplicates.pop(original_file_path),
+                                                                          self.options.get('output_root'), self.options.get('source_root'))
+                            finished += linked_results
+                            linked_count = sum(1 for linked_result in linked_results if linked_result['formats'])
+                            deduplicated_files += linked_count
+                            dedupe_saved_bytes += saved_bytes
+                            dedupe_saved_seconds += wall_seconds * linked_count
+
+                        if self.metrics is not None:
+                            self.metrics.job_finished(item_data, result, usage, wall_seconds)
+                        for result in finished:
+                            if incremental and result.get('outputs'):
+                                self._manifest_for(manifests, result['path']).record(
+                                    result['path'], result['outputs'], self.options, use_hash
+                                )
+
+                            if result['status'] == "success":
+                                if "OGG" in result['formats']:
+                                    successful_ogg_conversions += 1
+                                if "WebM" in result['formats']:
+                                    successful_webm_conversions += 1
+                            elif result['status'] == "cancelled":
+                                cancelled_files += 1
+                            elif result['status'] == "error":
+                                files_with_errors +=1
+                                if result['errors'] == [critical_error]:
+                                    error_details.append(critical_error) # Already names the file
+                                else:
+                                    for err_msg in result['errors']:
+                                        error_details.append(f"File {os.path.basename(result['path'])}: {err_msg}")
+                            # Other statuses like "skipped" or "noop" are logged by convert_video itself.
+
+                            completed_count += 1
+                            results.append(result)
+                            self._file_finished(result)
+                            self._notify(self.on_progress, completed_count, len(self.tasks))
+                        self._notify(self.on_batch_progress, *self.batch_tracker.update(original_file_path, 1.0))
+
+                    # Persist manifests now and then so a crash loses little incremental state
+                    if manifests and time.monotonic() - last_manifest_save > MANIFEST_SAVE_INTERVAL:
+                        for manifest in manifests.values():
+                            manifest.save()
+                        last_manifest_save = time.monotonic()
+            except KeyboardInterrupt:
+                # Stop FFmpeg before the executor waits for its workers; the journal stays for --resume
+                self.control.cancel()
+                raise
+            finally:
+                if mover is not None:
+                    mover.shutdown() # Moves already started are completed
+                if self.metrics is not None:
+                    # Jobs still running or moving when the batch was interrupted leave the running gauge
+                    self.metrics.jobs_abandoned([item_data['path'] for item_data in futures.values()] +
+                                                [entry[0]['path'] for entry in moving.values()])
+                if encode_cache is not None:
+                    encode_cache.save_index() # Source hashes of this batch, saved once
+
+        for manifest in manifests.values():
+            manifest.save()
+        if self.journal is not None:
+            self.journal.finish() # Completed or cancelled on purpose: nothing to resume
+        if cancelled_files:
+            print(f"Cancelled: {cancelled_files} file(s)")
+        if deduplicated_files:
+            print(f"Dedupe: {deduplicated_files} duplicate file(s) linked instead of encoded, saving about "
+                  f"{dedupe_saved_seconds:.1f}s of encoding and {dedupe_saved_bytes / (1024 * 1024):.1f} MB of disk")
+        encode_cache_stats = encode_cache.stats() if encode_cache is not None else None
+        if encode_cache_stats is not None:
+            print(f"Encode cache: {encode_cache_stats['hits']} hit(s), {encode_cache_stats['misses']} miss(es); "
+                  f"{encode_cache_stats['bytes'] / (1024 * 1024):.1f} MB in {encode_cache_stats['cache_dir']}")
+
+        makespan = time.monotonic() - batch_started if job_seconds else 0.0
+        lower_bound = makespan_lower_bound(job_seconds, num_workers)
+        if job_seconds:
+            print(f"Makespan: {makespan:.1f}s for {len(job_seconds)} job(s) on {num_workers} worker(s) "
+                  f"(ideal lower bound {lower_bound:.1f}s)")
+            print(f"FFmpeg resources: {cpu_seconds:.1f} CPU-seconds, peak RSS {peak_rss_kb / 1024:.0f} MB")
+
+        return {
+            "total": len(self.tasks),
+            "up_to_date": up_to_date_files,
+            "cancelled": cancelled_files,
+            "successful_ogg": successful_ogg_conversions,
+            "successful_webm": successful_webm_conversions,
+            "files_with_errors": files_with_errors,
+            "ffmpeg_missing": ffmpeg_missing,
+            "error_details": error_details,
+            "firstpass_cache_hits": firstpass_cache.hits if firstpass_cache else 0,
+            "firstpass_cache_misses": firstpass_cache.misses if firstpass_cache else 0,
+            "workers": num_workers,
+            "makespan_seconds": makespan,
+            "makespan_lower_bound_seconds": lower_bound,
+            "cpu_seconds": cpu_seconds,
+            "peak_rss_kb": peak_rss_kb,
+            "deduplicated_files": deduplicated_files,
+            "dedupe_saved_bytes": dedupe_saved_bytes,
+            "dedupe_saved_seconds": dedupe_saved_seconds,
+            "encode_cache": encode_cache_stats, # EncodeCache.stats(), None when the cache is off
+            "results": results,
+        }
+
+    @staticmethod
+    def _manifest_for(manifests, file_path):
+        """Get (loading on first use) the manifest of a source file's folder."""
+        folder = os.path.dirname(os.path.abspath(file_path))
+        if folder not in manifests:
+            manifests[folder] = ConversionManifest(folder)
+        return manifests[folder]
+
+    def _make_progress_callback(self, path):
+        """Build the per-job callback that forwards FFmpeg progress to the callbacks."""
+        def on_progress(info):
+            if self.metrics is not None:
+                self.metrics.job_progress(path, info)
+            self._notify(self.on_job_progress, path, info)
+            if info["fraction"] is not None:
+                self._notify(self.on_batch_progress, *self.batch_tracker.update(path, info["fraction"]))
+        return on_progress
@@ -0,0 +1,325 @@
+"""Headless MP4 to OGG/WebM converter.
+
+Runs the same conversion pipeline as the GUI without importing PyQt5, so it
+works on machines without a display:
+
+    python -m convert_cli videos/ extra/clip.mp4 "archive/**/*.mp4" --preset Web --json
+    python -m convert_cli --watch /srv/uploads -r --preset Web
+    python -m convert_cli --submit http://coordinator:8765 /shared/videos -r   # see distributed.py
+
+Exit codes: 0 when every file converted (or was already up to date), 1 when
+at least one file failed, 2 for usage errors (bad preset, no input files),
+130 when interrupted with Ctrl+C (continue later with --resume). --watch runs
+until stopped with Ctrl+C or SIGTERM and then exits with 0.
+"""
+import argparse
+import contextlib
+import glob
+import json
+import os
+import signal
+import sys
+import time
+
+from batch_journal import BatchJournal, interrupted_journals, journal_in_use
+from conversion_engine import (
+    PRESET_FILE, RESOLUTION_FILTERS, SPEED_PROFILES, BatchRunner, load_presets, options_from_settings
+)
+from distributed import CoordinatorClient
+from file_scanner import MEDIA_EXTENSIONS, PathIndex, scan_media_files
+from folder_watch import WATCH_POLL_INTERVAL, WATCH_QUEUE_SIZE, WATCH_SETTLE_SECONDS, watch_and_convert
+from job_metrics import METRICS_LOG_ENV, PROMETHEUS_FILE_ENV, MetricsRecorder
+
+EXIT_OK = 0
+EXIT_CONVERSION_ERRORS = 1
+EXIT_USAGE = 2
+EXIT_INTERRUPTED = 130
+
+
+def collect_input_files(inputs, recursive=False, follow_symlinks=False):
+    """Expand files, directories and glob patterns into unique paths (deduplicated by real path)."""
+    collected = []
+    index = PathIndex()
+    missing = []
+
+    def add(path):
+        if index.add(path):
+            collected.append(path)
+
+    for item in inputs:
+        if os.path.isdir(item):
+            for batch in scan_media_files([item], recursive=recursive, follow_symlinks=follow_symlinks):
+                for path in batch:
+                    add(path)
+        elif os.path.isfile(item):
+            add(item)
+        elif glob.has_magic(item):
+            matches = sorted(glob.glob(item, recursive=True))
+            for path in matches:
+                if os.path.isfile(path) and path.lower().endswith(MEDIA_EXTENSIONS):
+                    add(path)
+            if not matches:
+                missing.append(item)
+        else:
+            missing.append(item)
+    return collected, missing
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m convert_cli",
+        description="Convert MP4 videos to OGG (Theora/Vorbis) and WebM (VP9/Opus) without the GUI."
+    )
+    parser.add_argument("inputs", nargs="*", help="MP4 files, directories or glob patterns")
+    parser.add_argument("--resume", nargs="?", const=True, metavar="JOURNAL",
+                        help="Finish the last batch that was interrupted, or the one journaled in JOURNAL, with its "
+                             "original settings (no inputs needed); lists the other interrupted batches")
+    parser.add_argument("--submit", metavar="URL",
+                        help="Queue the files on a distributed coordinator (python -m distributed) instead of converting here")
+    parser.add_argument("--token", help="With --submit, the coordinator's shared secret")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and convert MP4s as they appear in the input directories (implies --incremental)")
+    parser.add_argument("--settle-seconds", type=float, default=WATCH_SETTLE_SECONDS,
+                        help=f"With --watch, how long a file must stay unchanged before it is converted (default: {WATCH_SETTLE_SECONDS:.0f})")
+    parser.add_argument("--poll", dest="use_inotify", action="store_false",
+                        help="With --watch, rescan the directories instead of using inotify")
+    parser.add_argument("--poll-interval", type=float, default=WATCH_POLL_INTERVAL,
+                        help=f"Seconds between rescans when polling (default: {WATCH_POLL_INTERVAL:.0f})")
+    parser.add_argument("--queue-size", type=int, default=WATCH_QUEUE_SIZE,
+                        help=f"With --watch, settled files held for conversion before the watcher waits (default: {WATCH_QUEUE_SIZE})")
+    parser.add_argument("-r", "--recursive", action="store_true", help="Include subdirectories of input directories")
+    parser.add_argument("--follow-symlinks", action="store_true", help="Descend into symlinked directories when recursing")
+    parser.add_argument("--preset", help="Name of a preset saved from the GUI")
+    parser.add_argument("--presets-file", default=PRESET_FILE, help=f"Presets file (default: {PRESET_FILE})")
+    parser.add_argument("--formats", nargs="+", choices=["ogg", "webm"], default=["ogg", "webm"],
+                        help="Output formats (default: ogg webm)")
+    parser.add_argument("--resolution", choices=list(RESOLUTION_FILTERS), help="Output resolution")
+    parser.add_argument("--audio-bitrate", help='Audio bitrate such as "128k", or "Original"')
+    parser.add_argument("--ogg-quality", help="OGG video quality, 1-10")
+    parser.add_argument("--webm-crf", dest="webm_quality", help="WebM CRF, lower is better")
+    parser.add_argument("--two-pass", dest="webm_two_pass", action="store_true", default=None,
+                        help="Encode WebM in two passes, reusing cached pass-1 logs")
+    parser.add_argument("--webm-bitrate", help='Two-pass WebM target bitrate such as "2M" (default: constant quality)')
+    parser.add_argument("--speed-profile", choices=list(SPEED_PROFILES),
+                        help="Encoder speed/efficiency trade-off (default: balanced)")
+    parser.add_argument("--workers", help='Concurrent FFmpeg jobs, or "auto"')
+    parser.add_argument("--threads", help='FFmpeg -threads per job, or "auto"')
+    parser.add_argument("--no-single-decode", dest="single_decode", action="store_false", default=None,
+                        help="Use separate FFmpeg processes for OGG and WebM")
+    parser.add_argument("--segmented", action="store_true", default=None,
+                        help="Split long inputs at keyframes and encode the chunks in parallel")
+    parser.add_argument("--ladder", nargs="*", choices=["480p", "720p", "1080p"], default=None, metavar="RES",
+                        help="Encode a resolution ladder into converted/<name>/ with a manifest, decoding once "
+                             "(default rungs: 480p 720p 1080p); replaces --resolution")
+    parser.add_argument("--stream-copy", action="store_true", default=None,
+                        help="Copy audio/video streams already in the output codec instead of re-encoding them")
+    parser.add_argument("--ogg-audio-only", action="store_true", default=None,
+                        help="Write only the audio to the OGG output, without decoding the video")
+    parser.add_argument("--dedupe", action="store_true", default=None,
+                        help="Encode identical sources (by content hash) once and link the other outputs to it")
+    parser.add_argument("--encode-cache", action="store_true", default=None,
+                        help="Reuse outputs of sources already encoded with the same settings, from a content-addressed cache")
+    parser.add_argument("--encode-cache-dir", help="Encode cache directory (default: ~/.cache/mp4-converter/encodes)")
+    parser.add_argument("--encode-cache-size", help='Encode cache size limit such as "20G"; least recently used outputs are evicted')
+    parser.add_argument("--output-root", help="Write outputs under this folder, mirroring the source folders "
+                                              "(default: a converted/ folder next to each source)")
+    parser.add_argument("--source-root", help="With --output-root, mirror source folders relative to this folder "
+                                              "(default: their absolute paths)")
+    parser.add_argument("--scratch-dir", help="Let FFmpeg write to this local folder (e.g. tmpfs) and move finished outputs "
+                                              "to their folder in the background")
+    parser.add_argument("--move-workers", type=int, help="Concurrent moves out of --scratch-dir (default: 1)")
+    parser.add_argument("--per-device", dest="device_concurrency",
+                        help='Concurrent jobs reading from one disk, "auto" (one per rotational or USB disk) '
+                             'or "off" (default: off)')
+    parser.add_argument("--device-limit", dest="device_limits", action="append", metavar="PATH=N",
+                        help='Concurrent jobs for the disk holding PATH, or "off" for no cap (repeatable)')
+    parser.add_argument("--prefetch", action="store_true", default=None,
+                        help="Read each source ahead into the page cache when its job starts")
+    parser.add_argument("--no-preflight", dest="preflight", action="store_false", default=None,
+                        help="Do not inspect inputs with ffprobe before converting")
+    parser.add_argument("--incremental", action="store_true", default=None,
+                        help="Skip files whose outputs are up to date")
+    parser.add_argument("--hash", dest="incremental_hash", action="store_true", default=None,
+                        help="In incremental mode, compare content hashes when timestamps change")
+    parser.add_argument("--metrics-log", help=f"Append per-job JSON-lines events to this file (default: ${METRICS_LOG_ENV})")
+    parser.add_argument("--prometheus-file", help=f"Write Prometheus text-format metrics to this file (default: ${PROMETHEUS_FILE_ENV})")
+    parser.add_argument("--json", action="store_true",
+                        help="Print a JSON summary on stdout (progress messages go to stderr)")
+    return parser
+
+
+def watch(args, options):
+    """--watch: convert files as they settle in the input directories until Ctrl+C or SIGTERM."""
+    folders = [item for item in args.inputs if os.path.isdir(item)]
+    if args.resume or not folders or len(folders) != len(args.inputs):
+        print("--watch needs one or more directories as inputs (and no --resume).", file=sys.stderr)
+        return EXIT_USAGE
+
+    summary_output = sys.stdout # Log lines are redirected below; summaries are not
+
+    def on_batch_finished(summary):
+        if args.json:
+            summary = {key: value for key, value in summary.items() if key != "results"}
+            summary_output.write(json.dumps(summary) + "\n")
+            summary_output.flush()
+        else:
+            print(f"Batch done: {summary['successful_ogg']} OGG, {summary['successful_webm']} WebM, "
+                  f"{summary['up_to_date']} up to date, {summary['files_with_errors']} with errors")
+
+    def on_sigterm(signum, frame):
+        raise KeyboardInterrupt # Stop the same way as Ctrl+C
+    signal.signal(signal.SIGTERM, on_sigterm)
+
+    metrics = MetricsRecorder.from_environment(args.metrics_log, args.prometheus_file)
+    log_target = sys.stderr if args.json else sys.stdout
+    try:
+        with contextlib.redirect_stdout(log_target):
+            watch_and_convert(
+                folders, options, "ogg" in args.formats, "webm" in args.formats, args.recursive, args.follow_symlinks,
+                metrics=metrics, on_batch_finished=on_batch_finished, queue_size=max(1, args.queue_size),
+                settle_seconds=args.settle_seconds, poll_interval=args.poll_interval, use_inotify=args.use_inotify
+            )
+    except KeyboardInterrupt:
+        print("Stopped watching.", file=sys.stderr)
+    return EXIT_OK
+
+
+def submit(args, tasks, options):
+    """--submit: queue tasks on a coordinator; the paths must be readable at the same location on its workers."""
+    tasks = [dict(item_data, path=os.path.abspath(item_data['path'])) for item_data in tasks]
+    try:
+        ids = CoordinatorClient(args.submit, args.token).submit(tasks, options)
+    except OSError as e:
+        print(f"Could not submit to {args.submit}: {e}", file=sys.stderr)
+        return EXIT_CONVERSION_ERRORS
+    if args.json:
+        json.dump({"ids": ids}, sys.stdout)
+        sys.stdout.write("\n")
+    else:
+        print(f"Submitted {len(ids)} job(s) to {args.submit} (IDs {ids[0]}-{ids[-1]})")
+    return EXIT_OK
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not args.inputs and not args.resume:
+        parser.print_usage(sys.stderr)
+        print("No inputs given (or use --resume).", file=sys.stderr)
+        return EXIT_USAGE
+
+    settings = {}
+    if args.preset:
+        try:
+            presets = load_presets(args.presets_file)
+        except (OSError, ValueError) as e: # json.JSONDecodeError is a ValueError
+            print(f"Could not load presets from {args.presets_file}: {e}", file=sys.stderr)
+            return EXIT_USAGE
+        if args.preset not in presets:
+            print(f"Preset '{args.preset}' not found in {args.presets_file}.", file=sys.stderr)
+            return EXIT_USAGE
+        settings.update(presets[args.preset])
+
+    # Explicit command-line options override the preset
+    for key in ("resolution", "audio_bitrate", "ogg_quality", "webm_quality", "speed_profile", "webm_two_pass",
+                "webm_bitrate", "workers", "threads", "single_decode", "segmented", "preflight", "incremental", "incremental_hash",
+                "stream_copy", "ogg_audio_only", "dedupe", "encode_cache", "encode_cache_dir", "encode_cache_size",
+                "output_root", "source_root", "scratch_dir", "move_workers", "device_concurrency", "device_limits", "prefetch"):
+        value = getattr(args, key)
+        if value is not None:
+            settings[key] = value
+    if args.ladder is not None:
+        settings["ladder"] = args.ladder or True # Bare --ladder: the default rungs
+    if args.watch:
+        # A restarted watcher must not convert the files already in its folders again
+        settings.setdefault("incremental", True)
+    options = options_from_settings(settings)
+
+    if args.watch:
+        return watch(args, options)
+
+    journal = BatchJournal("cli")
+    if args.resume:
+        journals = interrupted_journals("cli")
+        if args.resume is True:
+            journal = journals[0] if journals else None # The most recent
+        else:
+            journal = BatchJournal("cli", path=os.path.abspath(args.resume))
+            if journal_in_use(journal.path):
+                print(f"{args.resume} is the journal of a batch that is still running.", file=sys.stderr)
+                return EXIT_USAGE
+        others = [other.path for other in journals if journal is None or other.path != journal.path]
+        if others:
+            print(f"{len(others)} other interrupted batch(es); resume one with --resume JOURNAL:", file=sys.stderr)
+            for path in others:
+                print(f"  {path}", file=sys.stderr)
+        interrupted = journal.load() if journal is not None else None
+        if interrupted is None or not interrupted['tasks']:
+            # An unreadable file given on the command line may not be a journal at all, so it is left alone
+            if journal is not None and (interrupted is not None or args.resume is True):
+                journal.finish()
+            print("There is no interrupted batch with unfinished files.", file=sys.stderr)
+            return EXIT_USAGE
+        # The interrupted batch's settings, so resumed files match the ones already converted
+        options = interrupted['options']
+        tasks = interrupted['tasks']
+        print(f"Resuming: {len(tasks)} file(s) left, {interrupted['finished']} already finished", file=sys.stderr)
+    else:
+        files, missing = collect_input_files(args.inputs, args.recursive, args.follow_symlinks)
+        for item in missing:
+            print(f"Warning: no such file, directory or matching glob: {item}", file=sys.stderr)
+        if not files:
+            print("No MP4 files to convert.", file=sys.stderr)
+            return EXIT_USAGE
+
+        tasks = [
+            {'path': path, 'convert_ogg': "ogg" in args.formats, 'convert_webm': "webm" in args.formats}
+            for path in files
+        ]
+        if args.submit:
+            return submit(args, tasks, options)
+
+    started = time.monotonic()
+    # In JSON mode keep stdout clean for the summary; the pipeline's log lines go to stderr
+    log_target = sys.stderr if args.json else sys.stdout
+    try:
+        with contextlib.redirect_stdout(log_target):
+            metrics = MetricsRecorder.from_environment(args.metrics_log, args.prometheus_file)
+            summary = BatchRunner(tasks, options, journal=journal, metrics=metrics).run()
+    except KeyboardInterrupt:
+        print(f"Interrupted. Run again with --resume to convert the remaining files (journal: {journal.path}).", file=sys.stderr)
+        return EXIT_INTERRUPTED
+    summary["elapsed_seconds"] = round(time.monotonic() - started, 3)
+    summary["options"] = options
+
+    if args.json:
+        json.dump(summary, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        print(f"Total files attempted: {summary['total']}")
+        print(f"Successfully converted to OGG: {summary['successful_ogg']} file(s)")
+        print(f"Successfully converted to WebM: {summary['successful_webm']} file(s)")
+        print(f"Skipped (already up to date): {summary['up_to_date']} file(s)")
+        if summary['cancelled']:
+            print(f"Cancelled: {summary['cancelled']} file(s)")
+        if summary['firstpass_cache_hits'] or summary['firstpass_cache_misses']:
+            print(f"WebM pass-1 cache: {summary['firstpass_cache_hits']} hit(s), {summary['firstpass_cache_misses']} miss(es)")
+        if summary['makespan_seconds'] > 0:
+            print(f"Makespan: {summary['makespan_seconds']:.1f}s (ideal lower bound {summary['makespan_lower_bound_seconds']:.1f}s "
+                  f"on {summary['workers']} worker(s))")
+            print(f"FFmpeg resources: {summary['cpu_seconds']:.1f} CPU-seconds, peak RSS {summary['peak_rss_kb'] / 1024:.0f} MB")
+        if summary['deduplicated_files']:
+            print(f"Dedupe: {summary['deduplicated_files']} duplicate file(s) linked, saving about "
+                  f"{summary['dedupe_saved_seconds']:.1f}s of encoding and {summary['dedupe_saved_bytes'] / (1024 * 1024):.1f} MB")
+        if summary['encode_cache']:
+            print(f"Encode cache: {summary['encode_cache']['hits']} hit(s), {summary['encode_cache']['misses']} miss(es), "
+                  f"{summary['encode_cache']['bytes'] / (1024 * 1024):.1f} MB cached")
+        print(f"Files with errors: {summary['files_with_errors']}")
+        for err in summary['error_details']:
+            print(f"  - {err}", file=sys.stderr)
+
+    return EXIT_CONVERSION_ERRORS if summary['files_with_errors'] else EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
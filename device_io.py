@@ -0,0 +1,159 @@
+"""Per-device I/O limits for conversion batches.
+
+Sources are grouped by the device they are stored on (os.stat().st_dev), and
+each device runs at most its cap of jobs at once, so a slow disk is read one
+file at a time instead of thrashing between several while an SSD in the same
+batch still runs jobs in parallel. Caps are off by default. With "auto"
+rotational and USB disks are capped at one job and other devices are not
+capped; a number caps every device, and caps for single volumes can be given
+by any path on them ("off" or 0 lifts the cap of that volume). A cap holds a
+job's slot for its whole encode, not only while its source is read.
+
+Optionally a job's source is prefetched into the page cache with
+posix_fadvise(WILLNEED) when it starts, so the kernel reads it ahead in large
+sequential requests. Qt-free; the sysfs checks are Linux-only and report
+"not slow" elsewhere.
+"""
+import os
+import threading
+from collections import Counter
+
+PREFETCH_BYTES = 256 * 1024 * 1024 # Read ahead at most this much of each source
+SYSFS_BLOCK = "/sys/dev/block"
+
+
+def device_of(path):
+    """Device ID of the filesystem holding path, or None if it cannot be read."""
+    try:
+        return os.stat(path).st_dev
+    except OSError:
+        return None
+
+
+def device_name(device):
+    return f"{os.major(device)}:{os.minor(device)}"
+
+
+def device_is_slow(device):
+    """True for a rotational disk or a disk on a USB bus (from sysfs; False where unknown)."""
+    try:
+        sysfs_path = os.path.realpath(os.path.join(SYSFS_BLOCK, device_name(device)))
+    except (OSError, ValueError):
+        return False
+    if "/usb" in sysfs_path:
+        return True
+    # A partition has no queue/ of its own; its disk is the parent folder
+    for folder in (sysfs_path, os.path.dirname(sysfs_path)):
+        try:
+            with open(os.path.join(folder, "queue", "rotational")) as f:
+                return f.read().strip() == "1"
+        except OSError:
+            continue
+    return False
+
+
+def parse_device_concurrency(value):
+    """Cap for every device: a positive count, "auto", or None (off) for "off", 0 and anything unparsable."""
+    if isinstance(value, str) and value.strip().lower() == "auto":
+        return "auto"
+    try:
+        return max(0, int(value)) or None
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_device_limits(value):
+    """{path: cap} from a dict or from "PATH=N" strings; malformed entries are dropped.
+
+    A cap of "off" or 0 is kept as None, which exempts that device from the batch-wide cap.
+    """
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, (list, tuple)):
+        items = [str(entry).rpartition("=")[::2] for entry in value]
+    else:
+        return {}
+    limits = {}
+    for path, cap in items:
+        if not path:
+            continue
+        if str(cap).strip().lower() == "off":
+            limits[str(path)] = None
+            continue
+        try:
+            limits[str(path)] = max(0, int(cap)) or None
+        except (TypeError, ValueError):
+            continue
+    return limits
+
+
+def prefetch(path, max_bytes=PREFETCH_BYTES):
+    """Ask the kernel to read the first max_bytes of path into the page cache. No-op without posix_fadvise."""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        size = os.fstat(fd).st_size
+        os.posix_fadvise(fd, 0, min(size, max_bytes), os.POSIX_FADV_WILLNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class DeviceLimiter:
+    """Counts running jobs per device against each device's cap. Methods are safe to call from any thread.
+
+    per_device is None (no caps), "auto" (cap slow disks at 1) or a cap for
+    every device; limits ({path: cap or None}) overrides it for the devices of
+    those paths.
+    """
+
+    def __init__(self, per_device=None, limits=None):
+        self.per_device = per_device
+        self._caps = {}
+        for path, cap in (limits or {}).items():
+            device = device_of(path)
+            if device is None:
+                print(f"Device limit for {path} ignored: cannot stat it")
+            else:
+                self._caps[device] = cap
+        self._running = Counter()
+        self._lock = threading.Lock()
+
+    def cap(self, device):
+        """Concurrent jobs allowed on device, or None for no cap."""
+        if device is None:
+            return None
+        with self._lock:
+            if device not in self._caps:
+                if self.per_device == "auto":
+                    self._caps[device] = 1 if device_is_slow(device) else None
+                else:
+                    self._caps[device] = self.per_device
+            return self._caps[device]
+
+    def max_running(self, devices):
+        """Most jobs that can run at once for sources on these devices (one entry per source)."""
+        queued = Counter(devices)
+        total = 0
+        for device, count in queued.items():
+            cap = self.cap(device)
+            total += count if cap is None else min(cap, count)
+        return total
+
+    def available(self, device):
+        cap = self.cap(device)
+        with self._lock:
+            return cap is None or self._running[device] < cap
+
+    def acquire(self, device):
+        with self._lock:
+            self._running[device] += 1
+
+    def release(self, device):
+        with self._lock:
+            self._running[device] -= 1
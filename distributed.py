@@ -0,0 +1,392 @@
+"""Coordinator/worker mode: spread conversions over several machines.
+
+    python -m distributed coordinator --db jobs.sqlite --host 0.0.0.0 --port 8765 --token s3cret
+    python -m distributed worker http://coordinator:8765 --slots 2 --token s3cret  # on every node
+    python -m convert_cli --submit http://coordinator:8765 /shared/videos -r --preset Web --token s3cret
+    python -m distributed status http://coordinator:8765 --token s3cret
+
+The coordinator keeps the queue in a job_broker.JobBroker and serves it as a
+small JSON-over-HTTP API. Workers pull jobs, run convert_video and report the
+results, heartbeating while a job runs; jobs of workers that stop
+heartbeating are requeued. Paths are passed as they were submitted, so every
+node must see the sources at the same path (shared storage); outputs are
+written next to the sources as in a local batch.
+
+Anyone who can reach the coordinator can queue jobs, so it only listens on
+other interfaces when a token is set, and workers honor the folders a job
+names for outputs, scratch files and the encode cache only under the folders
+they were started with (--allow-path). Qt-free.
+"""
+import argparse
+import ipaddress
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from batch_control import JobControl
+from conversion_engine import convert_video, job_formats, plan_concurrency
+from encode_cache import EncodeCache
+from output_placement import output_folder
+from firstpass_cache import FirstPassCache
+from job_broker import BROKER_LEASE_SECONDS, JobBroker
+from media_probe import plan_stream_copy, preflight
+
+DEFAULT_PORT = 8765
+WORKER_POLL_INTERVAL = 5.0 # Seconds an idle worker waits before asking for a job again
+TOKEN_HEADER = "X-Converter-Token"
+# Job options naming folders a worker writes to; honored only under the worker's allowed paths
+WORKER_PATH_OPTIONS = ("output_root", "scratch_dir", "encode_cache_dir")
+
+
+def is_loopback_host(host):
+    """True if host (an address or a name) only reaches this machine."""
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        pass
+    if not host:
+        return False # All interfaces
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, None)}
+    except OSError:
+        return False
+    return bool(addresses) and all(ipaddress.ip_address(address.split("%")[0]).is_loopback for address in addresses)
+
+
+def restrict_path_options(options, allowed_paths=()):
+    """Job options with the folders of WORKER_PATH_OPTIONS that are not under one of allowed_paths removed."""
+    allowed = [os.path.realpath(path) for path in allowed_paths]
+    options = dict(options)
+    for key in WORKER_PATH_OPTIONS:
+        value = options.get(key)
+        if not value:
+            continue
+        folder = os.path.realpath(value)
+        if not any(folder == root or folder.startswith(root.rstrip(os.sep) + os.sep) for root in allowed):
+            print(f"Ignoring job option {key}={value!r}: not under a folder this worker allows (--allow-path)")
+            options[key] = None
+    return options
+
+
+class CoordinatorServer(ThreadingHTTPServer):
+    """HTTP front end of a JobBroker. serve_forever() runs it; expired leases are reaped in the background."""
+
+    daemon_threads = True
+
+    def __init__(self, address, broker, token=None):
+        super().__init__(address, _CoordinatorHandler)
+        self.broker = broker
+        self.token = token
+        self._stopped = threading.Event()
+        self._reaper = threading.Thread(target=self._reap, daemon=True)
+        self._reaper.start()
+
+    def _reap(self):
+        # Claims also reap, but with every worker gone nobody would claim
+        while not self._stopped.wait(max(1.0, self.broker.lease_seconds / 3)):
+            self.broker.requeue_expired()
+
+    def server_close(self):
+        self._stopped.set()
+        super().server_close()
+
+
+class _CoordinatorHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass # Heartbeats would flood the log
+
+    def _reply(self, code, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self):
+        if self.server.token and self.headers.get(TOKEN_HEADER) != self.server.token:
+            self._reply(403, {"error": "Missing or wrong token"})
+            return False
+        return True
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        url = urllib.parse.urlsplit(self.path)
+        broker = self.server.broker
+        if url.path == "/status":
+            self._reply(200, broker.status())
+        elif url.path == "/jobs":
+            ids = urllib.parse.parse_qs(url.query).get("ids")
+            try:
+                self._reply(200, {"jobs": broker.jobs(ids[0].split(",") if ids else None)})
+            except ValueError:
+                self._reply(400, {"error": "ids must be comma-separated job IDs"})
+        else:
+            self._reply(404, {"error": f"Unknown path {url.path}"})
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        except ValueError:
+            self._reply(400, {"error": "Request body is not JSON"})
+            return
+        broker = self.server.broker
+        try:
+            if self.path == "/submit":
+                self._reply(200, {"ids": broker.submit(request["tasks"], request["options"])})
+            elif self.path == "/claim":
+                self._reply(200, {"job": broker.claim(request["worker"])})
+            elif self.path == "/heartbeat":
+                self._reply(200, {"ok": broker.heartbeat(request["worker"], request.get("job_id"))})
+            elif self.path == "/complete":
+                self._reply(200, {"ok": broker.complete(request["worker"], request["job_id"], request["result"])})
+            else:
+                self._reply(404, {"error": f"Unknown path {self.path}"})
+        except (KeyError, TypeError) as e:
+            self._reply(400, {"error": f"Malformed request: {e}"})
+
+
+def start_coordinator(db_path, host="127.0.0.1", port=DEFAULT_PORT, token=None, lease_seconds=BROKER_LEASE_SECONDS):
+    """Serve a coordinator on a background thread. Returns the server; its URL port is server.server_address[1].
+
+    Stop it with server.shutdown() and server.server_close().
+    """
+    server = CoordinatorServer((host, port), JobBroker(db_path, lease_seconds), token)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class CoordinatorClient:
+    """Calls a coordinator's API. Methods raise OSError (urllib.error.URLError) when it cannot be reached."""
+
+    def __init__(self, url, token=None, timeout=30):
+        self.url = url.rstrip("/")
+        self.token = token
+        self.timeout = timeout
+
+    def _call(self, path, payload=None):
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers[TOKEN_HEADER] = self.token
+        data = json.dumps(payload).encode() if payload is not None else None
+        request = urllib.request.Request(self.url + path, data=data, headers=headers)
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def submit(self, tasks, options):
+        return self._call("/submit", {"tasks": tasks, "options": options})["ids"]
+
+    def claim(self, worker):
+        return self._call("/claim", {"worker": worker})["job"]
+
+    def heartbeat(self, worker, job_id=None):
+        return self._call("/heartbeat", {"worker": worker, "job_id": job_id})["ok"]
+
+    def complete(self, worker, job_id, result):
+        return self._call("/complete", {"worker": worker, "job_id": job_id, "result": result})["ok"]
+
+    def status(self):
+        return self._call("/status")
+
+    def jobs(self, ids=None):
+        return self._call("/jobs" + (f"?ids={','.join(str(job_id) for job_id in ids)}" if ids is not None else ""))["jobs"]
+
+
+def run_job(job, slots, control, firstpass_cache=None, busy_slots=1):
+    """Convert one claimed job like BatchRunner would, on a worker with slots concurrent jobs. Returns the result dict.
+
+    busy_slots is how many of the slots (this one included) are converting a
+    job; a segmented job encodes its chunks on its share of the slots.
+    """
+    item_data = job["task"]
+    options = job["options"]
+    if options.get("preflight"):
+        planned, unreadable = preflight([item_data], options["resolution"], ogg_audio_only=options.get("ogg_audio_only", False))
+        if unreadable:
+            error = f"Skipped {os.path.basename(item_data['path'])}: not a readable video (corrupt or unsupported)"
+            print(error)
+            return {"path": item_data['path'], "status": "error", "formats": [], "errors": [error]}
+        item_data = planned[0]
+        if options.get('stream_copy'):
+            item_data = dict(item_data, copy_streams=plan_stream_copy(item_data, job_formats(item_data), options['audio_bitrate']))
+    _, threads = plan_concurrency(job_formats(item_data), slots, slots, options["threads"])
+    encode_cache = None
+    if options.get('encode_cache'):
+        # A directory shared by the workers (e.g. on NFS) makes the cache shared as well
+        encode_cache = EncodeCache(options.get('encode_cache_dir'), options.get('encode_cache_size'))
+    result = convert_video(
+        item_data['path'],
+        item_data['convert_ogg'],
+        item_data['convert_webm'],
+        item_data['resolution'] if 'resolution' in item_data else options['resolution'],
+        options['audio_bitrate'],
+        options['ogg_quality'],
+        options['webm_quality'],
+        threads,
+        options['single_decode'],
+        None,
+        max(1, slots // max(1, busy_slots)) if options.get('segmented') else None,
+        speed_profile=options['speed_profile'],
+        two_pass=options['webm_two_pass'],
+        webm_bitrate=options['webm_bitrate'],
+        firstpass_cache=firstpass_cache,
+        has_audio=item_data.get('has_audio', True),
+        control=control,
+        ladder=options.get('ladder'),
+        copy_streams=item_data.get('copy_streams'),
+        ogg_audio_only=options.get('ogg_audio_only', False),
+        encode_cache=encode_cache,
+        output_folder=output_folder(item_data['path'], options.get('output_root'), options.get('source_root')),
+        scratch_dir=options.get('scratch_dir') # The worker's slot ships its own outputs before reporting the job
+    )
+    if encode_cache is not None:
+        encode_cache.save_index()
+    return result
+
+
+def run_worker(url, slots=1, token=None, name=None, poll_interval=WORKER_POLL_INTERVAL, stop_event=None, allowed_paths=()):
+    """Pull and convert jobs from the coordinator at url with slots concurrent jobs, until stop_event is set.
+
+    Output, scratch and cache folders named by a job are used only under allowed_paths (see restrict_path_options).
+    """
+    stop_event = stop_event or threading.Event()
+    client = CoordinatorClient(url, token)
+    name = name or f"{socket.gethostname()}-{os.getpid()}"
+    firstpass_cache = FirstPassCache()
+    busy = [0] # Slots converting a job
+    busy_lock = threading.Lock()
+
+    def heartbeat(worker, job, control, done):
+        # Keep the lease; a lost lease means the job was given to another worker, so stop converting it
+        while not done.wait(job["lease_seconds"] / 3):
+            try:
+                if not client.heartbeat(worker, job["id"]):
+                    print(f"{worker} lost job {job['id']}; stopping it.")
+                    control.cancel()
+                    return
+            except OSError as e:
+                print(f"{worker}: heartbeat failed: {e}")
+
+    def slot_loop(slot):
+        worker = f"{name}/{slot}"
+        while not stop_event.is_set():
+            try:
+                job = client.claim(worker)
+            except OSError as e:
+                print(f"{worker}: coordinator unreachable: {e}")
+                job = None
+            if job is None:
+                stop_event.wait(poll_interval)
+                continue
+            print(f"{worker}: job {job['id']}: {job['task']['path']}")
+            job = dict(job, options=restrict_path_options(job["options"], allowed_paths))
+            control = JobControl()
+            done = threading.Event()
+            heartbeat_thread = threading.Thread(target=heartbeat, args=(worker, job, control, done), daemon=True)
+            heartbeat_thread.start()
+            started = time.monotonic()
+            with busy_lock:
+                busy[0] += 1
+                busy_slots = busy[0]
+            try:
+                result = run_job(job, slots, control, firstpass_cache if job["options"].get("webm_two_pass") else None,
+                                 busy_slots)
+            except Exception as e:
+                result = {"path": job["task"]["path"], "status": "error", "formats": [],
+                          "errors": [f"Critical error processing {os.path.basename(job['task']['path'])}: {e}"]}
+            finally:
+                with busy_lock:
+                    busy[0] -= 1
+                done.set()
+                heartbeat_thread.join()
+            result.update(worker=worker, wall_seconds=round(time.monotonic() - started, 3), usage=control.usage.as_dict())
+            while not stop_event.is_set():
+                try:
+                    if not client.complete(worker, job["id"], result):
+                        print(f"{worker}: result of job {job['id']} discarded; it was requeued meanwhile.")
+                    break
+                except OSError as e:
+                    print(f"{worker}: could not report job {job['id']}: {e}")
+                    stop_event.wait(poll_interval) # Retried; the job is requeued if the lease runs out first
+
+    print(f"Worker {name}: {slots} slot(s), coordinator {url}")
+    slot_threads = [threading.Thread(target=slot_loop, args=(slot,), daemon=True) for slot in range(slots)]
+    for thread in slot_threads:
+        thread.start()
+    try:
+        while any(thread.is_alive() for thread in slot_threads):
+            for thread in slot_threads:
+                thread.join(1.0)
+    except KeyboardInterrupt:
+        stop_event.set() # Running jobs are left to the lease: they are requeued once it runs out
+        raise
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m distributed", description="Distributed conversion across several machines.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    coordinator = commands.add_parser("coordinator", help="Hold the job queue and hand jobs to workers")
+    coordinator.add_argument("--db", default="jobs.sqlite", help="SQLite file holding the queue (default: jobs.sqlite)")
+    coordinator.add_argument("--host", default="127.0.0.1", help="Address to listen on (0.0.0.0 for other machines)")
+    coordinator.add_argument("--port", type=int, default=DEFAULT_PORT)
+    coordinator.add_argument("--lease-seconds", type=float, default=BROKER_LEASE_SECONDS,
+                             help="Requeue a job when its worker has not heartbeated for this long")
+
+    worker = commands.add_parser("worker", help="Convert jobs pulled from a coordinator")
+    worker.add_argument("url", help="Coordinator URL, such as http://host:8765")
+    worker.add_argument("--slots", type=int, default=1, help="Jobs converted at the same time on this machine")
+    worker.add_argument("--name", help="Worker name shown in the status (default: host-pid)")
+    worker.add_argument("--poll-interval", type=float, default=WORKER_POLL_INTERVAL)
+    worker.add_argument("--allow-path", dest="allowed_paths", action="append", default=[], metavar="DIR",
+                        help="Use the output, scratch and encode cache folders a job asks for only under DIR "
+                             "(repeatable; by default they are ignored)")
+
+    status = commands.add_parser("status", help="Print the coordinator's queue and workers as JSON")
+    status.add_argument("url")
+
+    for command in (coordinator, worker, status):
+        command.add_argument("--token", help=f"Shared secret sent as the {TOKEN_HEADER} header")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        if args.command == "coordinator":
+            if not args.token and not is_loopback_host(args.host):
+                print(f"Refusing to listen on {args.host} without --token: anyone who can reach it could queue jobs.",
+                      file=sys.stderr)
+                return 2
+            server = CoordinatorServer((args.host, args.port), JobBroker(args.db, args.lease_seconds), args.token)
+            print(f"Coordinator listening on http://{args.host}:{server.server_address[1]} (queue: {args.db})")
+            try:
+                server.serve_forever()
+            finally:
+                server.server_close()
+        elif args.command == "worker":
+            run_worker(args.url, max(1, args.slots), args.token, args.name, args.poll_interval,
+                       allowed_paths=args.allowed_paths)
+        else:
+            try:
+                print(json.dumps(CoordinatorClient(args.url, args.token).status(), indent=2))
+            except OSError as e:
+                print(f"Coordinator {args.url} unreachable: {e}", file=sys.stderr)
+                return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
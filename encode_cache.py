@@ -0,0 +1,345 @@
+"""Content-addressed cache of encoded outputs.
+
+An FFmpeg command's outputs are stored under a key made of the source's
+content hash, the command's argument vector and the FFmpeg version, so a
+source that was moved, renamed or copied elsewhere is not encoded again: a hit
+materializes the outputs as reflinks, hard links or copies of the cached files
+without starting an encoder. In the argument vector the input, output and
+pass-log paths are replaced by placeholders and -threads is left out (it only
+changes how fast the same output is produced).
+
+Source hashes are remembered by real path, size and mtime in an index next
+to the cached files; new hashes are written out now and then and when a batch
+ends (save_index), and sources that no longer exist are dropped from the index
+on the first eviction pass. Entries are evicted least-recently-used first once the
+cache grows past its size limit; when an entry was last used is recorded on a
+hidden stamp file per entry, not on the cached files, which share their inode
+with the user's outputs. Qt-free.
+
+    python -m encode_cache stats     # JSON statistics of the default cache
+    python -m encode_cache clear
+"""
+import argparse
+import functools
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+from source_dedupe import full_hash, link_output
+
+ENCODE_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "mp4-converter", "encodes")
+ENCODE_CACHE_MAX_BYTES = 20 * 1024 ** 3
+SOURCE_INDEX_FILE = "sources.json"
+USED_STAMP_SUFFIX = ".used" # .<key>.used: its mtime is when the entry was last stored or fetched
+SOURCE_INDEX_SAVE_INTERVAL = 30 # Seconds between saves of new source hashes during a batch
+
+# Placeholders for the per-file paths of an argument vector
+INPUT_PLACEHOLDER = "<input>"
+PASSLOG_PLACEHOLDER = "<passlog>"
+
+
+@functools.lru_cache(maxsize=None)
+def ffmpeg_version(executable):
+    """First line of `ffmpeg -version` for an executable path ("unknown" if it cannot be run)."""
+    try:
+        output = subprocess.run([executable, "-version"], capture_output=True, text=True, errors="replace").stdout
+    except OSError:
+        return "unknown"
+    return output.splitlines()[0] if output else "unknown"
+
+
+def parse_size(value):
+    """Bytes of a size such as "20G", "500M" or "1048576"; None if empty or malformed."""
+    value = str(value or "").strip().upper().rstrip("B")
+    multiplier = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}.get(value[-1:], 1)
+    try:
+        return int(float(value.rstrip("KMGT")) * multiplier)
+    except ValueError:
+        return None
+
+
+def normalized_arguments(ffmpeg_command, file_path, output_files):
+    """The argument vector with per-file paths replaced by placeholders and -threads dropped."""
+    outputs = {path: f"<output{i}>" for i, path in enumerate(output_files)}
+    normalized = []
+    arguments = iter(ffmpeg_command[1:]) # Not the executable: its version is part of the key
+    for argument in arguments:
+        if argument == "-threads":
+            next(arguments, None)
+        elif argument == "-passlogfile":
+            next(arguments, None)
+            normalized += [argument, PASSLOG_PLACEHOLDER]
+        elif argument == file_path:
+            normalized.append(INPUT_PLACEHOLDER)
+        else:
+            normalized.append(outputs.get(argument, argument))
+    return normalized
+
+
+class EncodeCache:
+    """Directory of cached outputs with hit/miss counters. Methods are safe to call from worker threads."""
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = cache_dir or ENCODE_CACHE_DIR
+        self.max_bytes = max_bytes if max_bytes is not None else ENCODE_CACHE_MAX_BYTES
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._index_path = os.path.join(self.cache_dir, SOURCE_INDEX_FILE)
+        self._sources = {}
+        self._sources_dirty = False
+        self._sources_pruned = False
+        self._sources_saved = time.monotonic()
+        self._save_lock = threading.Lock() # Orders index writes; held without _lock while serializing
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(self._index_path, "r") as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                self._sources = data
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"Could not read encode cache index {self._index_path}: {e}")
+
+    def source_hash(self, file_path):
+        """Content hash of a source, answered from the index while its size and mtime are unchanged."""
+        stat = os.stat(file_path)
+        real_path = os.path.realpath(file_path)
+        with self._lock:
+            entry = self._sources.get(real_path)
+            if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                return entry["hash"]
+        content_hash = full_hash(file_path)
+        with self._lock:
+            self._sources[real_path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": content_hash}
+            self._sources_dirty = True
+            save_due = time.monotonic() - self._sources_saved > SOURCE_INDEX_SAVE_INTERVAL
+        if save_due:
+            self.save_index()
+        return content_hash
+
+    def save_index(self):
+        """Write the source index if hashes were added or dropped since it was last saved."""
+        with self._save_lock:
+            with self._lock:
+                if not self._sources_dirty:
+                    return
+                sources = dict(self._sources) # Serialized outside _lock so workers keep hashing
+                self._sources_dirty = False
+                self._sources_saved = time.monotonic()
+            tmp_path = os.path.join(self.cache_dir, f".{SOURCE_INDEX_FILE}.tmp-{os.getpid()}-{threading.get_ident()}")
+            try:
+                with open(tmp_path, "w") as f:
+                    json.dump(sources, f)
+                os.replace(tmp_path, self._index_path)
+            except OSError as e:
+                print(f"Could not save encode cache index {self._index_path}: {e}")
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                with self._lock:
+                    self._sources_dirty = True # Retried on the next save
+
+    def key(self, file_path, ffmpeg_command, output_files):
+        """Cache key of running ffmpeg_command on file_path to write output_files. Raises OSError if the source is unreadable."""
+        identity = json.dumps([
+            self.source_hash(file_path),
+            normalized_arguments(ffmpeg_command, file_path, output_files),
+            ffmpeg_version(shutil.which(ffmpeg_command[0]) or ffmpeg_command[0]),
+        ])
+        return hashlib.blake2b(identity.encode("utf-8", "surrogateescape"), digest_size=16).hexdigest()
+
+    def _entry_paths(self, key, output_files):
+        return [os.path.join(self.cache_dir, f"{key}-{i}{os.path.splitext(path)[1]}") for i, path in enumerate(output_files)]
+
+    def _stamp_path(self, key):
+        return os.path.join(self.cache_dir, f".{key}{USED_STAMP_SUFFIX}")
+
+    def _mark_used(self, key):
+        """Record that key was just used (the cached files themselves are left untouched)."""
+        stamp_path = self._stamp_path(key)
+        try:
+            with open(stamp_path, "a"):
+                pass
+            os.utime(stamp_path)
+        except OSError as e:
+            print(f"Could not update encode cache entry {stamp_path}: {e}")
+
+    def fetch(self, key, output_files):
+        """Materialize the cached outputs of key at output_files. Returns False (a miss) if any is missing."""
+        entry_paths = self._entry_paths(key, output_files)
+        try:
+            for entry_path in entry_paths:
+                os.stat(entry_path) # All outputs must still be cached
+            for entry_path, output_file in zip(entry_paths, output_files):
+                link_output(entry_path, output_file)
+            self._mark_used(key)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def store(self, key, output_files):
+        """Add freshly encoded output_files under key and evict old entries."""
+        try:
+            for entry_path, output_file in zip(self._entry_paths(key, output_files), output_files):
+                link_output(output_file, entry_path)
+        except OSError as e:
+            print(f"Could not add to encode cache {self.cache_dir}: {e}")
+            return
+        self._mark_used(key)
+        with self._lock:
+            self.stores += 1
+        self.evict()
+
+    def fetch_command(self, file_path, ffmpeg_command, output_files):
+        """fetch() by the key of a command; an unreadable source is a miss."""
+        try:
+            key = self.key(file_path, ffmpeg_command, output_files)
+        except OSError as e:
+            print(f"Encode cache: cannot hash {file_path}: {e}")
+            return False
+        return self.fetch(key, output_files)
+
+    def store_command(self, file_path, ffmpeg_command, output_files):
+        """store() the outputs a command just wrote under its key."""
+        try:
+            key = self.key(file_path, ffmpeg_command, output_files)
+        except OSError as e:
+            print(f"Encode cache: cannot hash {file_path}: {e}")
+            return
+        self.store(key, output_files)
+
+    def _entries(self, stamps=None):
+        """(last used, size, path) of the cached files.
+
+        Last used is the mtime of the entry's stamp, or of the file for entries
+        cached before stamps existed. With stamps (a dict), the stamps found
+        are added to it as {key: path}.
+        """
+        used = {}
+        files = []
+        with os.scandir(self.cache_dir) as scan:
+            for entry in scan:
+                if entry.name == SOURCE_INDEX_FILE:
+                    continue
+                if entry.name.startswith("."):
+                    if entry.name.endswith(USED_STAMP_SUFFIX):
+                        key = entry.name[1:-len(USED_STAMP_SUFFIX)]
+                        try:
+                            used[key] = entry.stat().st_mtime
+                        except OSError:
+                            continue
+                        if stamps is not None:
+                            stamps[key] = entry.path
+                    continue # Stamps, the index being saved and links being created
+                files.append(entry)
+        entries = []
+        for entry in files:
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((used.get(entry.name.split("-")[0], stat.st_mtime), stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes.
+
+        The first call also drops index entries of sources that no longer exist.
+        """
+        with self._lock:
+            if not self._sources_pruned:
+                self._sources_pruned = True
+                missing = [real_path for real_path in self._sources if not os.path.exists(real_path)]
+                for real_path in missing:
+                    del self._sources[real_path]
+                self._sources_dirty = self._sources_dirty or bool(missing)
+            stamps = {}
+            try:
+                entries = self._entries(stamps)
+            except OSError as e:
+                print(f"Could not read encode cache {self.cache_dir}: {e}")
+                return
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path) # An entry with a missing output is a miss, so outputs may go one by one
+                    total -= size
+                    self.evictions += 1
+                except OSError:
+                    continue
+            remaining = {os.path.basename(path).split("-")[0] for _, _, path in entries if os.path.exists(path)}
+            for key, stamp_path in stamps.items():
+                if key not in remaining:
+                    try:
+                        os.remove(stamp_path) # Every file of the entry is gone
+                    except OSError:
+                        pass
+
+    def clear(self):
+        """Remove every cached output and the source index."""
+        with self._lock:
+            stamps = {}
+            for _, _, path in self._entries(stamps):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            for stamp_path in stamps.values():
+                try:
+                    os.remove(stamp_path)
+                except OSError:
+                    pass
+            self._sources = {}
+            self._sources_dirty = False
+            try:
+                os.remove(self._index_path)
+            except OSError:
+                pass
+
+    def stats(self):
+        """{'hits', 'misses', 'stores', 'evictions', 'files', 'bytes', 'max_bytes', 'cache_dir'}; counters cover this process."""
+        with self._lock:
+            try:
+                entries = self._entries()
+            except OSError:
+                entries = []
+            return {
+                "hits": self.hits, "misses": self.misses, "stores": self.stores, "evictions": self.evictions,
+                "files": len(entries), "bytes": sum(size for _, size, _ in entries), "max_bytes": self.max_bytes,
+                "cache_dir": self.cache_dir,
+            }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m encode_cache", description="Inspect or empty the encode cache.")
+    parser.add_argument("command", choices=["stats", "clear"])
+    parser.add_argument("--cache-dir", help=f"Cache directory (default: {ENCODE_CACHE_DIR})")
+    args = parser.parse_args(argv)
+    cache = EncodeCache(args.cache_dir)
+    if args.command == "clear":
+        cache.clear()
+    else:
+        cache.evict()
+        cache.save_index() # Drops sources that no longer exist
+    print(json.dumps(cache.stats(), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""Recursive, parallel discovery of source videos.
+
+Qt-free so both the GUI (on a background thread) and the CLI can use it.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+MEDIA_EXTENSIONS = (".mp4",)
+
+# Output folders created by the converter are never scanned for sources
+SKIP_DIR_NAMES = ("converted",)
+
+
+def normalize_path(path):
+    """Key used to detect duplicates: the resolved, case-normalized absolute path."""
+    return os.path.normcase(os.path.realpath(path))
+
+
+class PathIndex:
+    """O(1) duplicate detection for queued files, keyed by normalize_path().
+
+    Resolved parent directories are cached, so indexing a batch of files from the
+    same folders costs one lstat per file instead of one per path component.
+    """
+
+    def __init__(self):
+        self._items = {}
+        self._real_dirs = {}
+
+    def _key(self, path):
+        directory, name = os.path.split(path)
+        real_dir = self._real_dirs.get(directory) # Relative directories resolve against the current directory
+        if real_dir is None:
+            real_dir = self._real_dirs[directory] = os.path.realpath(directory)
+        candidate = os.path.join(real_dir, name)
+        if os.path.islink(candidate):
+            candidate = os.path.realpath(candidate)
+        return os.path.normcase(candidate)
+
+    def __contains__(self, path):
+        return self._key(path) in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, path, item=True):
+        """Index path -> item. Returns False (and keeps the old entry) if it was already indexed."""
+        key = self._key(path)
+        if key in self._items:
+            return False
+        self._items[key] = item
+        return True
+
+    def get(self, path, default=None):
+        return self._items.get(self._key(path), default)
+
+    def remove(self, path):
+        self._items.pop(self._key(path), None)
+
+    def clear(self):
+        self._items.clear()
+        self._real_dirs.clear()
+
+
+def _scan_directory(path, extensions, follow_symlinks):
+    """List one directory: returns (matching files, subdirectories to descend into)."""
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=follow_symlinks):
+                        if entry.name not in SKIP_DIR_NAMES:
+                            subdirs.append(entry.path)
+                    elif entry.name.lower().endswith(extensions) and entry.is_file():
+                        files.append(entry.path)
+                except OSError:
+                    continue # Broken symlink or entry removed while scanning
+    except OSError as e:
+        print(f"Could not scan {path}: {e}")
+    files.sort()
+    subdirs.sort()
+    return files, subdirs
+
+
+def scan_media_files(roots, recursive=True, follow_symlinks=False, extensions=MEDIA_EXTENSIONS,
+                     max_workers=4, batch_size=500):
+    """Yield lists of media file paths found under roots, batch_size paths at a time.
+
+    Directories are listed with os.scandir on a small thread pool, which keeps
+    several directory reads in flight on network and spinning disks. With
+    follow_symlinks, symlinked directories are descended into; each directory is
+    visited once per (st_dev, st_ino), so symlink loops terminate.
+    """
+    extensions = tuple(ext.lower() for ext in extensions)
+    visited = set()
+    batch = []
+
+    def claim(directory):
+        # True the first time a physical directory is seen
+        try:
+            stat = os.stat(directory)
+        except OSError as e:
+            print(f"Could not scan {directory}: {e}")
+            return False
+        key = (stat.st_dev, stat.st_ino)
+        if key in visited:
+            return False
+        visited.add(key)
+        return True
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = set()
+        for root in roots:
+            if claim(root):
+                futures.add(executor.submit(_scan_directory, root, extensions, follow_symlinks))
+
+        while futures:
+            done, futures = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                batch.extend(files)
+                if recursive:
+                    for subdir in subdirs:
+                        if claim(subdir):
+                            futures.add(executor.submit(_scan_directory, subdir, extensions, follow_symlinks))
+            while len(batch) >= batch_size:
+                yield batch[:batch_size]
+                batch = batch[batch_size:]
+
+    if batch:
+        yield batch
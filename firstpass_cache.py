@@ -0,0 +1,99 @@
+"""Cache of libvpx-vp9 first-pass statistics for two-pass WebM encoding.
+
+Pass 1 only analyses the (scaled) source frames, so its log can be reused when
+the same source is encoded again at another target bitrate or CRF. Logs are
+keyed by the source (real path, size, mtime) and the scale filter, stored in a
+local directory, and evicted least-recently-used first once the directory grows
+past its size limit. Qt-free.
+"""
+import hashlib
+import os
+import threading
+
+FIRSTPASS_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "mp4-converter", "vp9-firstpass")
+FIRSTPASS_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# FFmpeg names a pass log "<passlogfile prefix>-<output stream index>.log"; the video is stream 0
+PASSLOG_SUFFIX = "-0.log"
+
+
+class FirstPassCache:
+    """Directory of pass-1 logs with hit/miss counters. Methods are safe to call from worker threads."""
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = cache_dir or FIRSTPASS_CACHE_DIR
+        self.max_bytes = max_bytes if max_bytes is not None else FIRSTPASS_CACHE_MAX_BYTES
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+        except OSError as e:
+            print(f"Could not create first-pass cache {self.cache_dir}: {e}")
+
+    @staticmethod
+    def key(file_path, resolution):
+        """Cache key for a source file encoded through a scale filter (None for the original size)."""
+        stat = os.stat(file_path)
+        identity = f"{os.path.realpath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}|{resolution or 'original'}"
+        return hashlib.blake2b(identity.encode("utf-8", "surrogateescape"), digest_size=16).hexdigest()
+
+    def prefix(self, key):
+        """-passlogfile prefix of a cached log."""
+        return os.path.join(self.cache_dir, key)
+
+    def lookup(self, key):
+        """Return the -passlogfile prefix for key if its log is cached (counting a hit), else None (a miss)."""
+        log_path = self.prefix(key) + PASSLOG_SUFFIX
+        try:
+            os.utime(log_path) # Mark as recently used
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return self.prefix(key)
+
+    def temp_prefix(self, key):
+        """-passlogfile prefix for writing a new pass-1 log; publish it with store()."""
+        return os.path.join(self.cache_dir, f"{key}.tmp-{os.getpid()}-{threading.get_ident()}")
+
+    def store(self, temp_prefix, key):
+        """Move a finished pass-1 log into the cache and evict old logs. Returns the cached prefix."""
+        os.replace(temp_prefix + PASSLOG_SUFFIX, self.prefix(key) + PASSLOG_SUFFIX)
+        self.evict()
+        return self.prefix(key)
+
+    def discard(self, temp_prefix):
+        """Remove the log of a failed pass 1."""
+        try:
+            os.remove(temp_prefix + PASSLOG_SUFFIX)
+        except OSError:
+            pass
+
+    def evict(self):
+        """Delete least recently used logs until the cache fits in max_bytes."""
+        entries = []
+        with self._lock:
+            try:
+                with os.scandir(self.cache_dir) as scan:
+                    for entry in scan:
+                        if entry.name.endswith(PASSLOG_SUFFIX) and ".tmp-" not in entry.name:
+                            try:
+                                stat = entry.stat()
+                            except OSError:
+                                continue
+                            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            except OSError as e:
+                print(f"Could not read first-pass cache {self.cache_dir}: {e}")
+                return
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    continue
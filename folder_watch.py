@@ -0,0 +1,297 @@
+"""Watch-folder mode: convert MP4s as they are dropped into folders.
+
+A FolderWatcher follows the folders with inotify (Linux, through ctypes) or,
+where inotify is unavailable, by rescanning them every poll interval. A new or
+changed file is only handed on once its size and modification time have not
+changed for settle_seconds, so uploads still being copied are left alone.
+Settled files go into a bounded queue; when the converter falls behind, the
+watcher blocks on the full queue (backpressure) and inotify events wait in the
+kernel, with a full rescan if its queue overflows. watch_and_convert() takes
+the queued files in batches through BatchRunner.
+
+Memory stays constant over long runs: the watcher only remembers files that
+are still settling and the signature (size, mtime) of files it has handed on,
+which are forgotten when the files disappear. Qt-free.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import queue
+import select
+import struct
+import threading
+import time
+
+from conversion_engine import BatchRunner
+from file_scanner import MEDIA_EXTENSIONS, SKIP_DIR_NAMES, scan_media_files
+
+WATCH_SETTLE_SECONDS = 5.0 # A file must be unchanged this long before it is converted
+WATCH_POLL_INTERVAL = 10.0 # Seconds between rescans without inotify
+WATCH_RESCAN_INTERVAL = 3600.0 # Safety-net rescan with inotify, for events lost in between
+WATCH_QUEUE_SIZE = 64 # Settled files waiting for conversion; also the largest batch
+WATCH_TICK = 1.0 # Seconds between stability checks
+
+# inotify(7) event masks
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+_EVENT_HEADER = struct.Struct("iIII") # wd, mask, cookie, len
+
+
+class Inotify:
+    """Minimal inotify binding. Raises OSError where inotify is not available."""
+
+    def __init__(self):
+        library = ctypes.util.find_library("c")
+        try:
+            self._libc = ctypes.CDLL(library, use_errno=True)
+            init = self._libc.inotify_init1
+        except (OSError, AttributeError):
+            raise OSError(errno.ENOSYS, "inotify is not available on this system")
+        self.fd = init(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {} # Watch descriptor -> directory
+
+    def add_watch(self, directory):
+        """Watch directory. Returns False if it (the same inode) was already watched."""
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, f"Cannot watch {directory}: {os.strerror(code)}")
+        if wd in self.watches:
+            return False
+        self.watches[wd] = directory
+        return True
+
+    def read_events(self, timeout):
+        """Events ready within timeout seconds, as (directory, name, mask) tuples.
+
+        directory is None for a queue overflow (IN_Q_OVERFLOW) and events of removed watches.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None) # The directory was removed
+                continue
+            events.append((self.watches.get(wd), name, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+def file_signature(path):
+    """(size, mtime_ns) of a file, or None if it is gone."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class FolderWatcher:
+    """Finds settled media files in folders and passes each new or changed one to enqueue(path).
+
+    enqueue may block (backpressure); run() keeps going until stop_event is set.
+    """
+
+    def __init__(self, folders, recursive=False, follow_symlinks=False, settle_seconds=WATCH_SETTLE_SECONDS,
+                 poll_interval=WATCH_POLL_INTERVAL, use_inotify=True, rescan_interval=WATCH_RESCAN_INTERVAL):
+        self.folders = [os.path.abspath(folder) for folder in folders]
+        self.recursive = recursive
+        self.follow_symlinks = follow_symlinks
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self.rescan_interval = rescan_interval
+        self.pending = {} # Path -> (signature, monotonic time it was first seen with it)
+        self.handed_on = {} # Path -> signature when it was enqueued
+        self.inotify = None
+
+    def _watch_tree(self, directory):
+        """Watch directory (and, recursively, its subdirectories except converter outputs)."""
+        if not self.inotify.add_watch(directory) or not self.recursive:
+            return # Already watched: also ends symlink loops
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=self.follow_symlinks) and entry.name not in SKIP_DIR_NAMES:
+                    self._watch_tree(entry.path)
+            except OSError:
+                continue
+
+    def _start_inotify(self):
+        if not self.use_inotify:
+            return
+        try:
+            self.inotify = Inotify()
+            for folder in self.folders:
+                self._watch_tree(folder)
+        except OSError as e:
+            print(f"inotify unavailable ({e}); polling every {self.poll_interval:.0f}s instead.")
+            if self.inotify is not None:
+                self.inotify.close()
+            self.inotify = None
+
+    def _candidate(self, path):
+        """A file appeared or changed: start (or restart) its settle timer unless it was already handed on as-is."""
+        if path in self.pending:
+            return # settled() notices further changes; no stat per write event
+        signature = file_signature(path)
+        if signature is None or self.handed_on.get(path) == signature:
+            return
+        self.pending[path] = (signature, time.monotonic())
+
+    def rescan(self):
+        """Check every file in the folders; forget handed-on files that no longer exist."""
+        present = set()
+        for batch in scan_media_files(self.folders, recursive=self.recursive, follow_symlinks=self.follow_symlinks):
+            for path in batch:
+                present.add(path)
+                self._candidate(path)
+        for path in [path for path in self.handed_on if path not in present]:
+            del self.handed_on[path]
+
+    def _handle_event(self, directory, name, mask):
+        if mask & IN_Q_OVERFLOW:
+            print("inotify queue overflowed; rescanning watched folders.")
+            self.rescan()
+            return
+        if directory is None:
+            return # Event of a watch that has since been removed
+        path = os.path.join(directory, name)
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO) and self.recursive and name not in SKIP_DIR_NAMES:
+                try:
+                    self._watch_tree(path)
+                except OSError as e:
+                    print(f"Could not watch {path}: {e}")
+                # Files may have landed in the directory before its watch existed
+                for batch in scan_media_files([path], recursive=True, follow_symlinks=self.follow_symlinks):
+                    for file_path in batch:
+                        self._candidate(file_path)
+            return
+        if not name.lower().endswith(MEDIA_EXTENSIONS):
+            return
+        if mask & (IN_DELETE | IN_MOVED_FROM):
+            self.pending.pop(path, None)
+            self.handed_on.pop(path, None)
+        else:
+            self._candidate(path)
+
+    def settled(self):
+        """Remove and return pending files whose signature has not changed for settle_seconds."""
+        now = time.monotonic()
+        ready = []
+        for path, (signature, since) in list(self.pending.items()):
+            current = file_signature(path)
+            if current is None:
+                del self.pending[path]
+            elif current != signature:
+                self.pending[path] = (current, now) # Still being written
+            elif now - since >= self.settle_seconds:
+                del self.pending[path]
+                ready.append((path, signature))
+        return sorted(ready)
+
+    def run(self, enqueue, stop_event):
+        """Watch until stop_event is set, calling enqueue(path) for each settled file.
+
+        enqueue returns False to give up on a file (for example while stopping);
+        it is then picked up again by the next rescan.
+        """
+        self._start_inotify()
+        try:
+            self.rescan()
+            last_rescan = time.monotonic()
+            while not stop_event.is_set():
+                if self.inotify is not None:
+                    for directory, name, mask in self.inotify.read_events(WATCH_TICK):
+                        self._handle_event(directory, name, mask)
+                    rescan_due = time.monotonic() - last_rescan >= self.rescan_interval
+                else:
+                    stop_event.wait(WATCH_TICK)
+                    rescan_due = time.monotonic() - last_rescan >= self.poll_interval
+                if rescan_due:
+                    self.rescan()
+                    last_rescan = time.monotonic()
+                for path, signature in self.settled():
+                    if stop_event.is_set() or not enqueue(path):
+                        break
+                    self.handed_on[path] = signature
+        finally:
+            if self.inotify is not None:
+                self.inotify.close()
+                self.inotify = None
+
+
+def watch_and_convert(folders, options, convert_ogg=True, convert_webm=True, recursive=False, follow_symlinks=False,
+                      metrics=None, stop_event=None, on_batch_finished=None, queue_size=WATCH_QUEUE_SIZE,
+                      settle_seconds=WATCH_SETTLE_SECONDS, poll_interval=WATCH_POLL_INTERVAL, use_inotify=True):
+    """Convert settled files from folders until stop_event is set (or KeyboardInterrupt).
+
+    Files waiting for a conversion slot are held in a queue of queue_size; the
+    files queued when a batch starts (up to queue_size) form that batch. Each
+    batch summary is passed to on_batch_finished.
+    """
+    stop_event = stop_event or threading.Event()
+    work = queue.Queue(maxsize=queue_size)
+    watcher = FolderWatcher(folders, recursive, follow_symlinks, settle_seconds, poll_interval, use_inotify)
+
+    def enqueue(path):
+        # Blocks while the queue is full, so the watcher falls behind instead of buffering without limit
+        while not stop_event.is_set():
+            try:
+                work.put(path, timeout=WATCH_TICK)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    watcher_thread = threading.Thread(target=watcher.run, args=(enqueue, stop_event), daemon=True)
+    watcher_thread.start()
+    print(f"Watching {', '.join(watcher.folders)} for new MP4 files (Ctrl+C to stop)...")
+    try:
+        while not stop_event.is_set():
+            try:
+                paths = [work.get(timeout=WATCH_TICK)]
+            except queue.Empty:
+                continue
+            while len(paths) < queue_size:
+                try:
+                    paths.append(work.get_nowait())
+                except queue.Empty:
+                    break
+            tasks = [{'path': path, 'convert_ogg': convert_ogg, 'convert_webm': convert_webm} for path in paths]
+            summary = BatchRunner(tasks, options, metrics=metrics).run()
+            if on_batch_finished:
+                on_batch_finished(summary)
+    finally:
+        stop_event.set()
+        watcher_thread.join()
@@ -0,0 +1,193 @@
+"""SQLite-backed job queue for distributed conversion.
+
+The coordinator (distributed.py) keeps every submitted task in one SQLite
+table, so the queue survives a coordinator restart. Workers claim jobs in
+the same order a local batch uses (priority, then longest estimated job
+first) and hold each claim as a lease they extend with heartbeats. A job
+whose lease runs out (its worker died or lost the network) is queued again,
+up to BROKER_MAX_ATTEMPTS times. Qt-free; methods are safe to call from any
+thread.
+"""
+import contextlib
+import json
+import sqlite3
+import threading
+import time
+
+from scheduler import estimate_cost
+
+BROKER_LEASE_SECONDS = 30.0 # A claimed job is requeued if not heartbeated for this long
+BROKER_MAX_ATTEMPTS = 3 # Claims lost to dead workers before a job is failed
+BROKER_FORGET_WORKER_SECONDS = 3600.0 # Workers not seen for this long are dropped from the status
+
+# States of a job row; the conversion status of a finished job is in its result
+BROKER_QUEUED = "queued"
+BROKER_RUNNING = "running"
+BROKER_FINISHED = "finished"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL,
+    task TEXT NOT NULL,
+    options TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    cost REAL NOT NULL DEFAULT 0,
+    state TEXT NOT NULL DEFAULT 'queued',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    submitted REAL NOT NULL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_by_state ON jobs (state, priority DESC, cost DESC, id);
+CREATE TABLE IF NOT EXISTS workers (
+    name TEXT PRIMARY KEY,
+    last_seen REAL NOT NULL
+);
+"""
+
+
+class JobBroker:
+    """Job queue in the SQLite database at db_path (":memory:" for a throwaway queue)."""
+
+    def __init__(self, db_path, lease_seconds=BROKER_LEASE_SECONDS, max_attempts=BROKER_MAX_ATTEMPTS):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None) # Autocommit; explicit transactions
+        self._db.row_factory = sqlite3.Row
+        if db_path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Run the block as one write transaction; the caller holds self._lock."""
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield self._db
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def submit(self, tasks, options):
+        """Queue task dicts ({'path', 'convert_ogg', 'convert_webm'}) to be converted with options. Returns their job IDs."""
+        now = time.time()
+        ids = []
+        with self._lock, self._transaction() as db:
+            for item_data in tasks:
+                cursor = db.execute(
+                    "INSERT INTO jobs (path, task, options, priority, cost, submitted) VALUES (?, ?, ?, ?, ?, ?)",
+                    (item_data['path'], json.dumps(item_data), json.dumps(options), item_data.get('priority', 0),
+                     estimate_cost(item_data, options.get('resolution'), options.get('ladder'), options.get('ogg_audio_only', False)), now)
+                )
+                ids.append(cursor.lastrowid)
+        return ids
+
+    def _requeue_expired(self, db, now):
+        """Requeue running jobs whose lease ran out; fail those that used up their attempts."""
+        expired = db.execute(
+            "SELECT id, worker, attempts FROM jobs WHERE state = ? AND lease_expires < ?", (BROKER_RUNNING, now)
+        ).fetchall()
+        for row in expired:
+            if row["attempts"] >= self.max_attempts:
+                error = f"Worker {row['worker']} stopped responding ({row['attempts']} attempt(s))"
+                db.execute(
+                    "UPDATE jobs SET state = ?, worker = NULL, lease_expires = NULL, result = ?, finished = ? WHERE id = ?",
+                    (BROKER_FINISHED, json.dumps({"status": "error", "formats": [], "errors": [error]}), now, row["id"])
+                )
+            else:
+                db.execute("UPDATE jobs SET state = ?, worker = NULL, lease_expires = NULL WHERE id = ?",
+                           (BROKER_QUEUED, row["id"]))
+            print(f"Job {row['id']}: lease of {row['worker']} expired, "
+                  f"{'failed' if row['attempts'] >= self.max_attempts else 'requeued'}")
+        return len(expired)
+
+    def requeue_expired(self):
+        """Requeue (or fail) jobs of workers that stopped heartbeating. Returns how many were affected."""
+        with self._lock, self._transaction() as db:
+            return self._requeue_expired(db, time.time())
+
+    def claim(self, worker):
+        """Lease the next job to worker: {'id', 'task', 'options', 'lease_seconds'}, or None if none is queued."""
+        now = time.time()
+        with self._lock, self._transaction() as db:
+            self._requeue_expired(db, now)
+            db.execute("DELETE FROM workers WHERE last_seen < ?", (now - BROKER_FORGET_WORKER_SECONDS,))
+            db.execute("INSERT OR REPLACE INTO workers (name, last_seen) VALUES (?, ?)", (worker, now))
+            row = db.execute(
+                "SELECT id, task, options FROM jobs WHERE state = ? ORDER BY priority DESC, cost DESC, id LIMIT 1",
+                (BROKER_QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE jobs SET state = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+                (BROKER_RUNNING, worker, now + self.lease_seconds, row["id"])
+            )
+        return {"id": row["id"], "task": json.loads(row["task"]), "options": json.loads(row["options"]),
+                "lease_seconds": self.lease_seconds}
+
+    def heartbeat(self, worker, job_id=None):
+        """Record that worker is alive and extend its lease on job_id. Returns False if it no longer holds that job."""
+        now = time.time()
+        with self._lock, self._transaction() as db:
+            db.execute("INSERT OR REPLACE INTO workers (name, last_seen) VALUES (?, ?)", (worker, now))
+            if job_id is None:
+                return True
+            cursor = db.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE id = ? AND state = ? AND worker = ?",
+                (now + self.lease_seconds, job_id, BROKER_RUNNING, worker)
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, worker, job_id, result):
+        """Store the result dict of a job. Returns False if worker had lost the job (it was requeued) meanwhile."""
+        now = time.time()
+        with self._lock, self._transaction() as db:
+            db.execute("INSERT OR REPLACE INTO workers (name, last_seen) VALUES (?, ?)", (worker, now))
+            cursor = db.execute(
+                "UPDATE jobs SET state = ?, lease_expires = NULL, result = ?, finished = ? WHERE id = ? AND state = ? AND worker = ?",
+                (BROKER_FINISHED, json.dumps(result), now, job_id, BROKER_RUNNING, worker)
+            )
+            return cursor.rowcount == 1
+
+    def status(self):
+        """{'jobs': {state: count}, 'results': {status: count}, 'workers': {name: seconds since last seen}}."""
+        now = time.time()
+        with self._lock:
+            jobs = {state: 0 for state in (BROKER_QUEUED, BROKER_RUNNING, BROKER_FINISHED)}
+            for row in self._db.execute("SELECT state, COUNT(*) AS count FROM jobs GROUP BY state"):
+                jobs[row["state"]] = row["count"]
+            results = {}
+            for row in self._db.execute(
+                "SELECT json_extract(result, '$.status') AS status, COUNT(*) AS count FROM jobs WHERE state = ? GROUP BY status",
+                (BROKER_FINISHED,)
+            ):
+                results[row["status"]] = row["count"]
+            workers = {row["name"]: round(now - row["last_seen"], 1) for row in self._db.execute("SELECT name, last_seen FROM workers")}
+        return {"jobs": jobs, "results": results, "workers": workers}
+
+    def jobs(self, ids=None):
+        """Job rows as dicts (all jobs, or those in ids), with decoded results."""
+        with self._lock:
+            if ids is None:
+                rows = self._db.execute("SELECT * FROM jobs ORDER BY id").fetchall()
+            else:
+                ids = [int(job_id) for job_id in ids]
+                rows = self._db.execute(
+                    f"SELECT * FROM jobs WHERE id IN ({','.join('?' * len(ids))}) ORDER BY id", ids
+                ).fetchall() if ids else []
+        return [
+            {"id": row["id"], "path": row["path"], "state": row["state"], "worker": row["worker"],
+             "attempts": row["attempts"], "result": json.loads(row["result"]) if row["result"] else None}
+            for row in rows
+        ]
@@ -0,0 +1,258 @@
+"""Per-job resource metrics and their export.
+
+run_ffmpeg reaps every FFmpeg process with os.wait4 for its CPU time and peak
+RSS, reading /proc/<pid>/io (Linux) just before for the bytes it read and
+wrote; the usage is added to the JobUsage of the process's job. BatchRunner
+reports each job to a MetricsRecorder as JSON-lines events (job_started,
+job_progress, job_finished, or job_abandoned when the batch stops before the
+job ends); the recorder also keeps running totals and
+writes them in the Prometheus text format for node_exporter's textfile
+collector. Qt-free.
+"""
+import json
+import os
+import sys
+import threading
+import time
+
+# Seconds between job_progress events of one job
+PROGRESS_EVENT_INTERVAL = 5.0
+
+# Used by the GUI, and by the CLI when --metrics-log / --prometheus-file are not given
+METRICS_LOG_ENV = "MP4_CONVERTER_METRICS_LOG"
+PROMETHEUS_FILE_ENV = "MP4_CONVERTER_PROMETHEUS_FILE"
+
+PROMETHEUS_PREFIX = "mp4_converter"
+
+
+def read_proc_io(pid):
+    """(bytes read, bytes written) by a process, from /proc/<pid>/io; None where unavailable.
+
+    Counts all read()/write() traffic, including reads served from the page cache.
+    """
+    counters = {}
+    try:
+        with open(f"/proc/{pid}/io", "r") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                counters[key] = int(value)
+    except (OSError, ValueError):
+        return None
+    return counters.get("rchar", 0), counters.get("wchar", 0)
+
+
+def wait_with_usage(process):
+    """Wait for a subprocess.Popen process and return (returncode, usage).
+
+    usage is {'user_cpu', 'system_cpu', 'peak_rss_kb', 'read_bytes', 'written_bytes'},
+    the byte counts being None without /proc; usage is None where os.wait4 is
+    missing (Windows) or the process was already reaped by Popen.poll().
+    """
+    if not hasattr(os, "wait4"):
+        return process.wait(), None
+    io_counters = None
+    try:
+        if hasattr(os, "waitid"):
+            # Wait for the exit without reaping: the I/O counters stay readable until wait4
+            os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+            io_counters = read_proc_io(process.pid)
+        _, status, rusage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        return process.wait(), None # Popen.send_signal() polled it first
+    process.returncode = os.waitstatus_to_exitcode(status)
+    peak_rss_kb = rusage.ru_maxrss // 1024 if sys.platform == "darwin" else rusage.ru_maxrss # Bytes on macOS
+    return process.returncode, {
+        "user_cpu": rusage.ru_utime,
+        "system_cpu": rusage.ru_stime,
+        "peak_rss_kb": peak_rss_kb,
+        "read_bytes": io_counters[0] if io_counters else None,
+        "written_bytes": io_counters[1] if io_counters else None,
+    }
+
+
+class JobUsage:
+    """Resource usage summed over the FFmpeg processes of one job (peak RSS is the largest process).
+
+    Thread-safe: a segmented job runs several processes at once.
+    """
+
+    def __init__(self):
+        self.processes = 0
+        self.user_cpu = 0.0
+        self.system_cpu = 0.0
+        self.peak_rss_kb = 0
+        self.read_bytes = 0
+        self.written_bytes = 0
+        self._lock = threading.Lock()
+
+    def add(self, usage):
+        """Add one process's usage from wait_with_usage (None is ignored)."""
+        if usage is None:
+            return
+        with self._lock:
+            self.processes += 1
+            self.user_cpu += usage["user_cpu"]
+            self.system_cpu += usage["system_cpu"]
+            self.peak_rss_kb = max(self.peak_rss_kb, usage["peak_rss_kb"])
+            self.read_bytes += usage["read_bytes"] or 0
+            self.written_bytes += usage["written_bytes"] or 0
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "processes": self.processes,
+                "user_cpu_seconds": round(self.user_cpu, 3),
+                "system_cpu_seconds": round(self.system_cpu, 3),
+                "peak_rss_kb": self.peak_rss_kb,
+                "read_bytes": self.read_bytes,
+                "written_bytes": self.written_bytes,
+            }
+
+
+def output_bytes(result):
+    """Total size of the outputs a convert_video result lists (every rendition of a ladder)."""
+    total = 0
+    for output_path in result.get("renditions") or (result.get("outputs") or {}).values():
+        try:
+            total += os.path.getsize(output_path)
+        except OSError:
+            pass
+    return total
+
+
+class MetricsRecorder:
+    """Job events as JSON lines (events_path) and totals in Prometheus text format (prometheus_path).
+
+    Either path may be None. Totals cover every batch the recorder has seen, so
+    one recorder per process gives counters that only reset on restart. Methods
+    are safe to call from worker threads.
+    """
+
+    def __init__(self, events_path=None, prometheus_path=None, progress_interval=PROGRESS_EVENT_INTERVAL):
+        self.events_path = events_path
+        self.prometheus_path = prometheus_path
+        self.progress_interval = progress_interval
+        self._lock = threading.Lock()
+        self._last_progress = {} # Path -> monotonic time of its last job_progress event
+        self._durations = {} # Path -> media duration FFmpeg reported
+        self.running = 0
+        self.jobs_by_status = {}
+        self.totals = {
+            "wall_seconds": 0.0, "user_cpu_seconds": 0.0, "system_cpu_seconds": 0.0, "read_bytes": 0,
+            "written_bytes": 0, "output_bytes": 0, "media_seconds": 0.0,
+        }
+        self.peak_rss_kb = 0
+        self.last_finished = None
+
+    @classmethod
+    def from_environment(cls, events_path=None, prometheus_path=None):
+        """Recorder for the given paths, defaulting to the MP4_CONVERTER_* environment variables; None if neither is set."""
+        events_path = events_path or os.environ.get(METRICS_LOG_ENV) or None
+        prometheus_path = prometheus_path or os.environ.get(PROMETHEUS_FILE_ENV) or None
+        if not events_path and not prometheus_path:
+            return None
+        return cls(events_path, prometheus_path)
+
+    def _emit(self, event):
+        """Append one event line; called with the lock held."""
+        if not self.events_path:
+            return
+        try:
+            with open(self.events_path, "a") as f:
+                f.write(json.dumps(event) + "\n")
+        except OSError as e:
+            print(f"Could not write metrics log {self.events_path}: {e}")
+
+    def job_started(self, path, job_id=None):
+        with self._lock:
+            self.running += 1
+            self._last_progress[path] = time.monotonic()
+            self._emit({"event": "job_started", "time": time.time(), "path": path, "job_id": job_id})
+            self._write_prometheus()
+
+    def job_progress(self, path, info):
+        """Record run_ffmpeg progress; an event is written at most every progress_interval seconds per job."""
+        with self._lock:
+            if info.get("duration"):
+                self._durations[path] = info["duration"]
+            now = time.monotonic()
+            if now - self._last_progress.get(path, 0.0) < self.progress_interval:
+                return
+            self._last_progress[path] = now
+            self._emit({
+                "event": "job_progress", "time": time.time(), "path": path, "out_time": info.get("out_time"),
+                "fraction": info.get("fraction"), "fps": info.get("fps"), "speed": info.get("speed"),
+            })
+
+    def job_finished(self, item_data, result, usage, wall_seconds):
+        """Record a finished job: its result dict, JobUsage (or None) and wall time."""
+        path = item_data['path']
+        usage = usage.as_dict() if usage is not None else JobUsage().as_dict()
+        with self._lock:
+            self.running = max(0, self.running - 1)
+            self._last_progress.pop(path, None)
+            media_seconds = item_data.get('duration') or self._durations.pop(path, None) or 0.0
+            self._durations.pop(path, None)
+            event = dict(
+                {"event": "job_finished", "time": time.time(), "path": path, "job_id": item_data.get('job_id'),
+                 "status": result['status'], "wall_seconds": round(wall_seconds, 3)},
+                **usage,
+                media_seconds=round(media_seconds, 3),
+                speed=round(media_seconds / wall_seconds, 3) if wall_seconds > 0 and media_seconds else None,
+                output_bytes=output_bytes(result),
+            )
+            self._emit(event)
+
+            self.jobs_by_status[result['status']] = self.jobs_by_status.get(result['status'], 0) + 1
+            for key in self.totals:
+                self.totals[key] += event[key]
+            self.peak_rss_kb = max(self.peak_rss_kb, usage["peak_rss_kb"])
+            self.last_finished = event["time"]
+            self._write_prometheus()
+
+    def jobs_abandoned(self, paths):
+        """Record jobs that started but will not finish (their batch was interrupted or failed)."""
+        if not paths:
+            return
+        with self._lock:
+            self.running = max(0, self.running - len(paths))
+            for path in paths:
+                self._last_progress.pop(path, None)
+                self._durations.pop(path, None)
+                self._emit({"event": "job_abandoned", "time": time.time(), "path": path})
+            self._write_prometheus()
+
+    def _write_prometheus(self):
+        """Replace the Prometheus file atomically (the textfile collector may read it at any time)."""
+        if not self.prometheus_path:
+            return
+        metrics = [
+            ("jobs_total", "counter", "Finished conversion jobs by status.",
+             [(f'status="{status}"', count) for status, count in sorted(self.jobs_by_status.items())]),
+            ("jobs_running", "gauge", "Conversion jobs currently running.", [("", self.running)]),
+            ("job_wall_seconds_total", "counter", "Wall time spent in conversion jobs.", [("", self.totals["wall_seconds"])]),
+            ("cpu_seconds_total", "counter", "CPU time of FFmpeg processes.",
+             [('mode="user"', self.totals["user_cpu_seconds"]), ('mode="system"', self.totals["system_cpu_seconds"])]),
+            ("read_bytes_total", "counter", "Bytes read by FFmpeg processes.", [("", self.totals["read_bytes"])]),
+            ("written_bytes_total", "counter", "Bytes written by FFmpeg processes.", [("", self.totals["written_bytes"])]),
+            ("output_bytes_total", "counter", "Size of the converted outputs.", [("", self.totals["output_bytes"])]),
+            ("encoded_media_seconds_total", "counter", "Seconds of source media converted.", [("", self.totals["media_seconds"])]),
+            ("ffmpeg_peak_rss_bytes", "gauge", "Largest peak RSS of any FFmpeg process.", [("", self.peak_rss_kb * 1024)]),
+        ]
+        if self.last_finished is not None:
+            metrics.append(("last_job_finished_timestamp_seconds", "gauge", "Unix time the last job finished.",
+                            [("", self.last_finished)]))
+        lines = []
+        for name, metric_type, help_text, samples in metrics:
+            full_name = f"{PROMETHEUS_PREFIX}_{name}"
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {metric_type}")
+            for labels, value in samples:
+                lines.append(f"{full_name}{{{labels}}} {value}" if labels else f"{full_name} {value}")
+        temp_path = self.prometheus_path + ".tmp"
+        try:
+            with open(temp_path, "w") as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(temp_path, self.prometheus_path)
+        except OSError as e:
+            print(f"Could not write Prometheus metrics {self.prometheus_path}: {e}")
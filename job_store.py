@@ -0,0 +1,223 @@
+"""Registry of queued conversion jobs.
+
+Qt-free: the GUI's table model reads from a JobStore, and bulk operations
+("select all WebM", "clear finished") run on the store instead of on widgets.
+"""
+import itertools
+import os
+import time
+
+from file_scanner import PathIndex
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_PAUSED = "paused"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_SKIPPED = "skipped"
+JOB_CANCELLED = "cancelled"
+
+JOB_STATES = (JOB_QUEUED, JOB_RUNNING, JOB_PAUSED, JOB_DONE, JOB_FAILED, JOB_SKIPPED, JOB_CANCELLED)
+FINISHED_STATES = (JOB_DONE, JOB_FAILED, JOB_SKIPPED, JOB_CANCELLED)
+
+# convert_video / BatchRunner result status -> job state
+RESULT_STATES = {
+    "success": JOB_DONE,
+    "error": JOB_FAILED,
+    "up_to_date": JOB_SKIPPED,
+    "skipped": JOB_SKIPPED,
+    "noop": JOB_SKIPPED,
+    "cancelled": JOB_CANCELLED,
+}
+
+# Format name used by the GUI -> Job attribute
+FORMAT_FLAGS = {"ogg": "convert_ogg", "webm": "convert_webm"}
+
+
+class Job:
+    """One queued file. Compact (__slots__) so 100k-file queues stay small."""
+
+    __slots__ = (
+        "id", "path", "convert_ogg", "convert_webm", "priority", "state", "progress", "eta",
+        "added_at", "started_at", "finished_at", "output_sizes", "errors",
+    )
+
+    def __init__(self, job_id, path, convert_ogg=True, convert_webm=True):
+        self.id = job_id
+        self.path = path
+        self.convert_ogg = convert_ogg
+        self.convert_webm = convert_webm
+        self.priority = 0 # Higher runs first; equal priorities run longest job first
+        self.state = JOB_QUEUED
+        self.progress = 0.0 # Fraction 0-1 of the running or last run
+        self.eta = None # Seconds left for the running job, if known
+        self.added_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.output_sizes = {} # Format name -> bytes written
+        self.errors = []
+
+    def __repr__(self):
+        return f"Job({self.id}, {self.path!r}, state={self.state!r})"
+
+    @property
+    def has_formats(self):
+        return self.convert_ogg or self.convert_webm
+
+    @property
+    def elapsed(self):
+        """Seconds spent converting, or None if the job never started."""
+        if self.started_at is None:
+            return None
+        return (self.finished_at or time.time()) - self.started_at
+
+    def as_task(self):
+        """Task dict in the form conversion_engine.BatchRunner expects."""
+        return {'path': self.path, 'convert_ogg': self.convert_ogg, 'convert_webm': self.convert_webm, 'job_id': self.id,
+                'priority': self.priority}
+
+
+class JobStore:
+    """Ordered job registry with O(1) lookup by job ID and by path.
+
+    Duplicates are rejected by real path (see file_scanner.PathIndex), so a
+    file reached through a symlink or a relative path is queued once.
+    """
+
+    def __init__(self):
+        self._jobs = [] # Display order
+        self._by_id = {}
+        self._by_path = {} # Path exactly as added -> Job
+        self._row_by_id = {}
+        self._index = PathIndex() # Real path -> Job
+        self._ids = itertools.count(1)
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def __iter__(self):
+        return iter(self._jobs)
+
+    def __getitem__(self, row):
+        return self._jobs[row]
+
+    def add(self, path, convert_ogg=True, convert_webm=True):
+        """Queue path. Returns the new Job, or None if the file is already queued."""
+        if path in self._by_path:
+            return None
+        job = Job(next(self._ids), path, convert_ogg, convert_webm)
+        if not self._index.add(path, job):
+            return None
+        self._row_by_id[job.id] = len(self._jobs)
+        self._jobs.append(job)
+        self._by_id[job.id] = job
+        self._by_path[path] = job
+        return job
+
+    def new_paths(self, paths):
+        """The paths add() would queue, in order: neither queued already nor repeated in paths. Adds nothing."""
+        batch = PathIndex()
+        return [path for path in paths if path not in self._by_path and path not in self._index and batch.add(path)]
+
+    def get(self, job_id):
+        return self._by_id.get(job_id)
+
+    def find(self, path):
+        """Job for path: an exact match first, then by real path."""
+        job = self._by_path.get(path)
+        if job is None:
+            job = self._index.get(path)
+        return job
+
+    def row_of(self, job):
+        return self._row_by_id.get(job.id)
+
+    def set_format(self, job, format_name, enabled):
+        setattr(job, FORMAT_FLAGS[format_name], bool(enabled))
+
+    def set_format_all(self, format_name, enabled):
+        """Turn one output format on or off for every job. Returns the number of jobs changed."""
+        attribute = FORMAT_FLAGS[format_name]
+        enabled = bool(enabled)
+        changed = 0
+        for job in self._jobs:
+            if getattr(job, attribute) != enabled:
+                setattr(job, attribute, enabled)
+                changed += 1
+        return changed
+
+    def set_priority(self, job, priority):
+        job.priority = int(priority)
+
+    def prioritize(self, jobs, first=True):
+        """Move jobs ahead of (or, with first=False, behind) every other job in dispatch order.
+
+        Sets their priority one above the highest (or below the lowest) priority of
+        the other jobs. Returns the priority given.
+        """
+        moved = {job.id for job in jobs}
+        others = [job.priority for job in self._jobs if job.id not in moved]
+        if first:
+            priority = max(others, default=0) + 1
+        else:
+            priority = min(others, default=0) - 1
+        for job in jobs:
+            job.priority = priority
+        return priority
+
+    def mark_running(self, job):
+        job.state = JOB_RUNNING
+        job.started_at = time.time()
+        job.finished_at = None
+
+    def finish(self, job, result):
+        """Apply a convert_video result dict to job: final state, errors and output sizes."""
+        job.state = RESULT_STATES.get(result['status'], JOB_FAILED)
+        job.finished_at = time.time()
+        job.progress = 1.0 if job.state in (JOB_DONE, JOB_SKIPPED) else 0.0
+        job.eta = None
+        job.errors = list(result.get('errors', []))
+        job.output_sizes = {}
+        for format_name, output_path in (result.get('outputs') or {}).items():
+            try:
+                job.output_sizes[format_name] = os.path.getsize(output_path)
+            except OSError:
+                pass
+
+    def reset(self, job):
+        """Put a job back in the queue before it is converted again."""
+        job.state = JOB_QUEUED
+        job.progress = 0.0
+        job.eta = None
+        job.started_at = None
+        job.finished_at = None
+
+    def tasks(self):
+        """BatchRunner task dicts for every job with at least one format selected."""
+        return [job.as_task() for job in self._jobs if job.has_formats]
+
+    def remove_finished(self):
+        """Drop done, failed, skipped and cancelled jobs. Returns the number removed."""
+        kept = []
+        for job in self._jobs:
+            if job.state in FINISHED_STATES:
+                del self._by_id[job.id]
+                del self._by_path[job.path]
+                self._index.remove(job.path)
+            else:
+                kept.append(job)
+        removed = len(self._jobs) - len(kept)
+        if removed:
+            self._jobs = kept
+            self._row_by_id = {job.id: row for row, job in enumerate(kept)}
+        return removed
+
+    def clear(self):
+        self._jobs = []
+        self._by_id = {}
+        self._by_path = {}
+        self._row_by_id = {}
+        self._index.clear()
+
+    def count(self, state):
+        return sum(1 for job in self._jobs if job.state == state)
@@ -0,0 +1,221 @@
+"""Resolution ladder: every rendition of an adaptive-streaming set from one decode.
+
+One FFmpeg process decodes the source once, splits the decoded video into one
+branch per rung, scales each branch once and splits it again between the OGG
+and WebM encoders, so a 480p/720p/1080p ladder in both formats costs a single
+decode and three scales. Renditions are written to converted/<stem>/ as
+<stem>_<height>p.<ext>, next to a manifest.json listing each rendition with its
+codecs, size and bitrate for a packager or player. Rungs above the source
+height are dropped rather than upscaled.
+
+Qt-free; used by conversion_engine.convert_video when a ladder is set.
+"""
+import json
+import os
+import re
+import subprocess
+
+from conversion_engine import run_ffmpeg, ogg_output_args, webm_output_args, partial_output_path
+from media_probe import probe_media
+
+LADDER_HEIGHTS = (480, 720, 1080) # Default rungs
+LADDER_MANIFEST_FILE = "manifest.json"
+
+# Container extension and codecs of each format's renditions
+RENDITION_FORMATS = {
+    "OGG": {"extension": ".ogg", "video_codec": "theora", "audio_codec": "vorbis"},
+    "WebM": {"extension": ".webm", "video_codec": "vp9", "audio_codec": "opus"},
+}
+
+
+def ladder_heights(ladder, source_height):
+    """Rungs of ladder (heights) that do not upscale the source, lowest first.
+
+    A source below every rung gets a single rendition at its own height.
+    """
+    heights = sorted(set(ladder))
+    if not source_height:
+        return heights
+    fitting = [height for height in heights if height <= source_height]
+    return fitting or [source_height]
+
+
+def ladder_folder(file_path, output_folder=None):
+    """Per-source folder under converted/ (or output_folder) that holds a file's renditions."""
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(output_folder or os.path.join(os.path.dirname(file_path), "converted"), stem)
+
+
+def rendition_path(folder, stem, height, format_name):
+    return os.path.join(folder, f"{stem}_{height}p{RENDITION_FORMATS[format_name]['extension']}")
+
+
+def is_rendition_file(folder, stem, path, format_name):
+    """True if path is a rendition of stem in format_name directly inside folder (not elsewhere via ../ or a link)."""
+    name = os.path.basename(path)
+    pattern = rf"{re.escape(stem)}_\d+p{re.escape(RENDITION_FORMATS[format_name]['extension'])}"
+    return os.path.dirname(os.path.realpath(path)) == os.path.realpath(folder) and re.fullmatch(pattern, name) is not None
+
+
+def build_ladder_command(file_path, renditions, source_height, audio_bitrate, ogg_quality, webm_quality, threads,
+                         speed_profile="balanced", audio=True):
+    """One FFmpeg command that decodes file_path once and encodes every rendition.
+
+    renditions is a list of (height, format name, output path). The decoded
+    video is split once per distinct height; each branch is scaled once (not at
+    all at the source height) and split again between that height's outputs.
+    """
+    heights = sorted({height for height, _, _ in renditions})
+    by_height = {height: [r for r in renditions if r[0] == height] for height in heights}
+    graph = [f"[0:v:0]split={len(heights)}" + "".join(f"[s{i}]" for i in range(len(heights)))]
+    video_maps = {}
+    for i, height in enumerate(heights):
+        scale = "null" if height == source_height else f"scale=-2:{height}"
+        labels = [f"v{i}_{j}" for j in range(len(by_height[height]))]
+        graph.append(f"[s{i}]{scale},split={len(labels)}" + "".join(f"[{label}]" for label in labels))
+        for label, (_, _, output_path) in zip(labels, by_height[height]):
+            video_maps[output_path] = f"[{label}]"
+
+    ffmpeg_command = ["ffmpeg", "-y", "-i", file_path, "-filter_complex", ";".join(graph)]
+    audio_map = ["-map", "0:a:0?"] if audio else []
+    for height, format_name, output_path in renditions:
+        ffmpeg_command += ["-map", video_maps[output_path]] + audio_map
+        if format_name == "OGG":
+            ffmpeg_command += ogg_output_args(ogg_quality, audio_bitrate, threads, speed_profile, audio)
+        else:
+            # Per-rung resolution so the VP9 tile columns fit each output's width
+            ffmpeg_command += webm_output_args(webm_quality, audio_bitrate, threads, speed_profile,
+                                               f"scale=-2:{height}", None, audio)
+        ffmpeg_command.append(output_path)
+    return ffmpeg_command
+
+
+def read_ladder_manifest(folder):
+    """Renditions listed in folder's manifest.json ([] if there is none or it is unreadable)."""
+    try:
+        with open(os.path.join(folder, LADDER_MANIFEST_FILE), "r") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return []
+    renditions = data.get("renditions") if isinstance(data, dict) else None
+    return renditions if isinstance(renditions, list) else []
+
+
+def describe_rendition(folder, format_name, path, duration, has_audio):
+    """Manifest entry of one rendition, with its probed size and average bitrate."""
+    info = probe_media(path) or {}
+    video = info.get("video") or {}
+    size = os.path.getsize(path)
+    duration = info.get("duration") or duration
+    return {
+        "format": format_name,
+        "file": os.path.relpath(path, folder),
+        "width": video.get("width"),
+        "height": video.get("height"),
+        "video_codec": RENDITION_FORMATS[format_name]["video_codec"],
+        "audio_codec": RENDITION_FORMATS[format_name]["audio_codec"] if has_audio else None,
+        "bytes": size,
+        "bitrate": int(size * 8 / duration) if duration else None,
+    }
+
+
+def write_ladder_manifest(folder, source, duration, renditions):
+    """Replace folder's manifest.json atomically; renditions are ordered by format, then height."""
+    renditions = sorted(renditions, key=lambda r: (r["format"], r["height"] or 0))
+    manifest_path = os.path.join(folder, LADDER_MANIFEST_FILE)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"version": 1, "source": os.path.basename(source), "duration": duration, "renditions": renditions}, f, indent=1)
+    os.replace(tmp_path, manifest_path)
+    return manifest_path
+
+
+def convert_ladder(file_path, formats, ladder, audio_bitrate, ogg_quality, webm_quality, threads, progress_callback=None,
+                   speed_profile="balanced", has_audio=True, control=None, output_folder=None):
+    """Encode file_path to every rung of ladder (heights) in each of formats ("OGG", "WebM").
+
+    Returns a convert_video-style result dict: outputs maps each format to its
+    highest rendition, renditions lists every file written and ladder_manifest
+    is the manifest's path. Renditions of formats not converted this time are
+    kept in the manifest; rungs that no longer belong to a converted format are
+    deleted.
+    """
+    filename = os.path.basename(file_path)
+    stem = os.path.splitext(filename)[0]
+    try:
+        info = probe_media(file_path)
+    except OSError as e:
+        error_message = f"Failed to convert {filename} to a resolution ladder: cannot run ffprobe/ffmpeg: {e}"
+        print(error_message)
+        return {"path": file_path, "status": "error", "formats": [], "errors": [error_message]}
+    if not info or not info.get("video"):
+        error_message = f"Failed to convert {filename} to a resolution ladder: not a readable video"
+        print(error_message)
+        return {"path": file_path, "status": "error", "formats": [], "errors": [error_message]}
+    source_height = info["video"].get("height")
+    heights = ladder_heights(ladder, source_height)
+    folder = ladder_folder(file_path, output_folder)
+    os.makedirs(folder, exist_ok=True)
+
+    renditions = [(height, format_name, rendition_path(folder, stem, height, format_name))
+                  for format_name in formats for height in heights]
+    partial_files = {path: partial_output_path(path) for _, _, path in renditions}
+    command = build_ladder_command(
+        file_path, [(height, format_name, partial_files[path]) for height, format_name, path in renditions],
+        source_height, audio_bitrate, ogg_quality, webm_quality, threads, speed_profile, has_audio
+    )
+
+    rung_names = ", ".join(f"{height}p" for height in heights)
+    error_message = None
+    try:
+        print(f"Converting {filename} to a {rung_names} ladder in {' and '.join(formats)} (single decode)...")
+        run_ffmpeg(command, progress_callback, control)
+    except subprocess.CalledProcessError as e:
+        error_message = f"Failed to convert {filename} to a resolution ladder: {e.stderr}"
+    except Exception as e:
+        error_message = f"An unexpected error occurred while converting {filename} to a resolution ladder: {str(e)}"
+    if error_message is not None:
+        for partial_file in partial_files.values():
+            try:
+                os.remove(partial_file)
+            except OSError:
+                pass
+        if control is not None and control.cancelled:
+            print(f"Cancelled {filename}.")
+            return {"path": file_path, "status": "cancelled", "formats": [], "errors": []}
+        print(error_message)
+        return {"path": file_path, "status": "error", "formats": [], "errors": [error_message]}
+
+    try:
+        for path, partial_file in partial_files.items():
+            os.replace(partial_file, path)
+        current = {path for _, _, path in renditions}
+        kept = []
+        for entry in read_ladder_manifest(folder):
+            path = os.path.join(folder, str(entry.get("file", "")))
+            if path in current or not os.path.isfile(path):
+                continue
+            if entry.get("format") in formats:
+                if is_rendition_file(folder, stem, path, entry["format"]):
+                    os.remove(path) # A rung this ladder no longer has
+                else:
+                    print(f"Ignoring manifest entry {entry.get('file')!r} of {filename}: not a rendition in {folder}")
+            else:
+                kept.append(entry)
+        duration = info.get("duration")
+        entries = kept + [describe_rendition(folder, format_name, path, duration, has_audio)
+                          for _, format_name, path in renditions]
+        manifest_path = write_ladder_manifest(folder, file_path, duration, entries)
+    except OSError as e:
+        error_message = f"Failed to move the ladder of {filename} into place: {e}"
+        print(error_message)
+        return {"path": file_path, "status": "error", "formats": [], "errors": [error_message]}
+
+    print(f"Successfully converted {filename} to {' and '.join(formats)} renditions ({rung_names}).")
+    top = max(heights)
+    return {
+        "path": file_path, "status": "success", "formats": list(formats), "errors": [],
+        "outputs": {format_name: rendition_path(folder, stem, top, format_name) for format_name in formats},
+        "renditions": [path for _, _, path in renditions],
+        "ladder_manifest": manifest_path,
+    }
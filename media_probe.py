@@ -0,0 +1,304 @@
+"""Media inspection and the pre-flight planner.
+
+Sources are inspected with ffprobe (or, without it, from the stream summary
+`ffmpeg -i` prints) before any encoder starts. Results are kept in an on-disk
+index keyed by path, size and mtime, so a queue is only probed once. The
+planner uses them to reject unreadable files, drop scale filters that would be
+a no-op or an upscale and skip audio encoding for silent sources; the probed
+duration and height also feed the batch scheduler's cost estimate, and the
+stream codecs tell plan_stream_copy which streams can be copied unchanged into
+an output. Qt-free.
+"""
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+PROBE_INDEX_FILE = os.path.join(os.path.expanduser("~"), ".cache", "mp4-converter", "media-index.json")
+PROBE_WORKERS = 8 # Concurrent ffprobe processes; they mostly wait on disk
+PROBE_INDEX_VERSION = 2 # Entries of older versions lack fields (audio bitrate) and are probed again
+PROBE_INDEX_MAX_ENTRIES = 50000 # Least recently used entries beyond this are dropped when the index is saved
+
+_DURATION_RE = re.compile(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)")
+_STREAM_RE = re.compile(r"Stream #\d+:\d+[^:]*: (Video|Audio): (\w+)(.*)")
+_SIZE_RE = re.compile(r"\b(\d{2,5})x(\d{2,5})\b")
+_BITRATE_RE = re.compile(r"\b(\d+) kb/s")
+
+# Source codecs (ffprobe names) each output format takes unchanged with a stream copy.
+# Video only matches the format's own encoder; both Ogg and WebM carry Vorbis and Opus audio.
+PASSTHROUGH_CODECS = {
+    "OGG": {"video": ("theora",), "audio": ("vorbis", "opus")},
+    "WebM": {"video": ("vp9",), "audio": ("opus", "vorbis")},
+}
+
+
+def _probe_with_ffprobe(file_path):
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries",
+         "format=duration:stream=codec_type,codec_name,width,height,bit_rate", "-of", "json", file_path],
+        capture_output=True, text=True, errors="replace"
+    )
+    if result.returncode != 0:
+        return None
+    try:
+        data = json.loads(result.stdout)
+    except ValueError:
+        return None
+    info = {"duration": None, "video": None, "audio": None}
+    try:
+        info["duration"] = float(data.get("format", {}).get("duration"))
+    except (TypeError, ValueError):
+        pass
+    for stream in data.get("streams", []):
+        if stream.get("codec_type") == "video" and info["video"] is None:
+            info["video"] = {"codec": stream.get("codec_name"), "width": stream.get("width"), "height": stream.get("height")}
+        elif stream.get("codec_type") == "audio" and info["audio"] is None:
+            info["audio"] = {"codec": stream.get("codec_name"), "bit_rate": bitrate_bps(stream.get("bit_rate"))}
+    return info
+
+
+def _probe_with_ffmpeg(file_path):
+    # Without an output FFmpeg exits with an error after printing the input summary
+    result = subprocess.run(["ffmpeg", "-hide_banner", "-i", file_path], capture_output=True, text=True, errors="replace")
+    info = {"duration": None, "video": None, "audio": None}
+    match = _DURATION_RE.search(result.stderr)
+    if match:
+        hours, minutes, seconds = match.groups()
+        info["duration"] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    for stream_type, codec, details in _STREAM_RE.findall(result.stderr):
+        if stream_type == "Video" and info["video"] is None:
+            size = _SIZE_RE.search(details)
+            info["video"] = {
+                "codec": codec,
+                "width": int(size.group(1)) if size else None,
+                "height": int(size.group(2)) if size else None,
+            }
+        elif stream_type == "Audio" and info["audio"] is None:
+            bitrate = _BITRATE_RE.search(details)
+            info["audio"] = {"codec": codec, "bit_rate": int(bitrate.group(1)) * 1000 if bitrate else None}
+    if info["duration"] is None and info["video"] is None and info["audio"] is None:
+        return None
+    return info
+
+
+def probe_media(file_path):
+    """Inspect file_path: {'duration', 'video': {'codec', 'width', 'height'} or None, 'audio': {'codec', 'bit_rate'} or None}.
+
+    Returns None when the file cannot be read as media. Raises OSError when
+    ffprobe/ffmpeg cannot be run (for example, not installed).
+    """
+    if shutil.which("ffprobe"):
+        return _probe_with_ffprobe(file_path)
+    return _probe_with_ffmpeg(file_path)
+
+
+class ProbeIndex:
+    """On-disk cache of probe_media results keyed by real path, size and mtime.
+
+    Unreadable files are cached too (as None), so a corrupt file is not probed
+    again until it changes. The first save of an index drops entries of files
+    that no longer exist, and every save keeps at most max_entries, the most
+    recently used. Methods are safe to call from worker threads.
+    """
+
+    def __init__(self, path=None, max_entries=PROBE_INDEX_MAX_ENTRIES):
+        self.path = path or PROBE_INDEX_FILE
+        self.max_entries = max_entries
+        self.entries = {}
+        self._pruned = False
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if isinstance(data, dict) and isinstance(data.get("files"), dict) and data.get("version") == PROBE_INDEX_VERSION:
+                self.entries = data["files"]
+        except FileNotFoundError:
+            pass
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Could not read media index {self.path}: {e}. Files will be probed again.")
+
+    def probe(self, file_path):
+        """probe_media(file_path), answered from the index when the file is unchanged.
+
+        OSError from running the prober propagates and nothing is cached.
+        """
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        key = os.path.realpath(file_path)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry and entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns:
+                self.hits += 1
+                entry["used"] = time.time() # Saved with the next change; recency need not be exact
+                return entry.get("info")
+            self.misses += 1
+        info = probe_media(file_path)
+        with self._lock:
+            self.entries[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "info": info, "used": time.time()}
+            self._dirty = True
+        return info
+
+    def _prune(self):
+        """Drop entries of vanished files (once per index) and the least recently used over max_entries. Called with the lock held."""
+        if not self._pruned:
+            self.entries = {path: entry for path, entry in self.entries.items() if os.path.exists(path)}
+            self._pruned = True
+        if len(self.entries) > self.max_entries:
+            recent = sorted(self.entries.items(), key=lambda item: item[1].get("used", 0), reverse=True)
+            self.entries = dict(recent[:self.max_entries])
+
+    def save(self):
+        """Write the index atomically if it changed."""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._prune()
+            # Unique per writer: worker slots and other processes may save the same index at once
+            tmp_path = f"{self.path}.tmp-{os.getpid()}-{threading.get_ident()}"
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(tmp_path, 'w') as f:
+                    json.dump({"version": PROBE_INDEX_VERSION, "files": self.entries}, f)
+                os.replace(tmp_path, self.path)
+                self._dirty = False
+            except OSError as e:
+                print(f"Error saving media index {self.path}: {e}")
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+
+_shared_indexes = {}
+_shared_indexes_lock = threading.Lock()
+
+
+def shared_probe_index():
+    """The process-wide ProbeIndex of PROBE_INDEX_FILE.
+
+    Loaded once and reused by every pre-flight of the process (a worker's jobs,
+    a watch session's batches) instead of being read again for each.
+    """
+    with _shared_indexes_lock:
+        index = _shared_indexes.get(PROBE_INDEX_FILE)
+        if index is None:
+            index = _shared_indexes[PROBE_INDEX_FILE] = ProbeIndex(PROBE_INDEX_FILE)
+        return index
+
+
+def target_height(resolution):
+    """Height requested by a scale filter such as "scale=-2:720", or None for the original size."""
+    match = re.search(r"scale=-?\d+:(\d+)", resolution or "")
+    return int(match.group(1)) if match else None
+
+
+def bitrate_bps(value):
+    """Bits per second of a bitrate such as "64k", "2M" or "128000"; None if empty or malformed."""
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([kKmM]?)", str(value or "").strip())
+    if not match:
+        return None
+    return int(float(match.group(1)) * {"": 1, "k": 1000, "m": 1000000}[match.group(2).lower()])
+
+
+def plan_stream_copy(item_data, formats, audio_bitrate=None):
+    """Streams of a planned task that can be copied into each output format instead of re-encoded.
+
+    Returns {format name: {'video': bool, 'audio': bool}}. Video is copied when
+    the source codec is the format's own and no scale filter is planned; audio
+    when the format carries its codec and its bitrate is within audio_bitrate
+    (any bitrate when audio_bitrate is None, i.e. "Original"). Tasks without
+    pre-flight codec information copy nothing.
+    """
+    limit = bitrate_bps(audio_bitrate)
+    source_audio_bitrate = item_data.get('audio_bitrate')
+    audio_fits = limit is None or (source_audio_bitrate is not None and source_audio_bitrate <= limit)
+    plan = {}
+    for format_name in formats:
+        codecs = PASSTHROUGH_CODECS[format_name]
+        plan[format_name] = {
+            "video": item_data.get('video_codec') in codecs["video"] and item_data.get('resolution', "unplanned") is None,
+            "audio": item_data.get('audio_codec') in codecs["audio"] and audio_fits,
+        }
+    return plan
+
+
+def plan_task(item_data, info, resolution, ogg_audio_only=False):
+    """Adjust one task dict for its probed media. Returns the new task, or None if the file is unreadable.
+
+    A file is unreadable when it has none of the streams its outputs need: a
+    video stream for WebM and video OGG, an audio stream for audio-only OGG
+    (ogg_audio_only), so audio-only sources can still be converted to audio.
+    The task gets 'duration', 'height' (of the source), 'has_audio', the source
+    'video_codec', 'audio_codec' and 'audio_bitrate', and its own 'resolution':
+    the scale filter is dropped when the source is already at (or below) the
+    target height.
+    """
+    if not info:
+        return None
+    needs_video = item_data.get('convert_webm') or (item_data.get('convert_ogg') and not ogg_audio_only)
+    needs_audio = item_data.get('convert_ogg') and ogg_audio_only
+    if not ((needs_video and info.get("video")) or (needs_audio and info.get("audio"))):
+        return None
+    video = info.get("video") or {}
+    planned = dict(item_data)
+    planned["duration"] = info.get("duration")
+    planned["has_audio"] = info.get("audio") is not None
+    planned["video_codec"] = video.get("codec")
+    planned["audio_codec"] = (info.get("audio") or {}).get("codec")
+    planned["audio_bitrate"] = (info.get("audio") or {}).get("bit_rate")
+    source_height = video.get("height")
+    planned["height"] = source_height
+    height = target_height(resolution)
+    if height is not None and source_height and source_height <= height:
+        planned["resolution"] = None # Same height is a no-op filter; a larger one would upscale
+    else:
+        planned["resolution"] = resolution
+    return planned
+
+
+def preflight(tasks, resolution, index=None, max_workers=PROBE_WORKERS, ogg_audio_only=False):
+    """Probe tasks concurrently and plan them (see plan_task; ogg_audio_only is the batch's setting).
+
+    Returns (planned tasks, unreadable tasks), both in queue order. When
+    ffprobe/ffmpeg cannot be run, files are passed on unplanned, so the
+    conversion reports each of them.
+    """
+    index = index or shared_probe_index()
+    hits_before = index.hits
+    probe_errors = []
+
+    def probe(item_data):
+        try:
+            return index.probe(item_data['path'])
+        except OSError as e:
+            probe_errors.append(e)
+            return probe_errors # Marks an unprobed file
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        infos = list(executor.map(probe, tasks))
+    index.save()
+    if probe_errors:
+        print(f"Pre-flight: cannot run ffprobe/ffmpeg ({probe_errors[0]}); {len(probe_errors)} file(s) not inspected")
+
+    planned = []
+    unreadable = []
+    for item_data, info in zip(tasks, infos):
+        if info is probe_errors:
+            planned.append(item_data)
+            continue
+        planned_task = plan_task(item_data, info, resolution, ogg_audio_only)
+        if planned_task is None:
+            unreadable.append(item_data)
+        else:
+            planned.append(planned_task)
+    print(f"Pre-flight: {len(tasks)} file(s) inspected ({index.hits - hits_before} from the media index), {len(unreadable)} unreadable")
+    return planned, unreadable
@@ -1,14 +1,105 @@
 import os
-import subprocess
 import json # Added for preset management
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from PyQt5.QtCore import Qt # Added for Qt.Checked
+import traceback
+from PyQt5.QtCore import Qt, QObject, QThread, pyqtSignal # Qt.Checked, background conversion
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QLabel, QPushButton, QFileDialog, QMessageBox, QComboBox, QLineEdit, QFormLayout, QProgressBar,
-    QListWidget, QListWidgetItem, QCheckBox, QHBoxLayout, QGroupBox, QInputDialog # Added QGroupBox, QInputDialog
+    QCheckBox, QHBoxLayout, QGroupBox, QInputDialog, QTableView, QHeaderView, QAbstractItemView, QMenu
 )
 
-PRESET_FILE = "presets.json"
+from conversion_engine import (
+    PRESET_FILE, SPEED_PROFILES, BatchRunner, convert_video, format_eta, resolution_filter, parse_audio_bitrate,
+    parse_ogg_quality, parse_webm_quality, parse_speed_profile, parse_count_or_auto, options_from_settings
+)
+from batch_journal import BatchJournal, interrupted_journals
+from file_scanner import scan_media_files
+from job_metrics import MetricsRecorder
+from job_store import JobStore, JOB_QUEUED, JOB_RUNNING, JOB_PAUSED, JOB_CANCELLED
+from queue_model import FileQueueModel, ProgressBarDelegate, COLUMN_FILE, COLUMN_PROGRESS, COLUMN_TITLES
+
+
+class ConversionWorker(QObject):
+    """Runs a conversion batch off the GUI thread and reports back through signals.
+
+    Move an instance to a QThread and connect the thread's started signal to run().
+    """
+    file_started = pyqtSignal(str) # Path of a job handed to FFmpeg
+    file_finished = pyqtSignal(dict) # Result dict from convert_video
+    progress = pyqtSignal(int, int) # Completed files, total files
+    job_progress = pyqtSignal(str, dict) # Path, FFmpeg progress dict (out_time, duration, fraction, fps, speed)
+    batch_progress = pyqtSignal(float, object) # Batch fraction (0-1), ETA seconds or None
+    finished = pyqtSignal(dict) # Batch summary
+    failed = pyqtSignal(str) # Error that stopped the batch; finished is not emitted then
+
+    def __init__(self, convert_fn, tasks, options, journal=None, metrics=None):
+        super().__init__()
+        self.convert_fn = convert_fn
+        self.tasks = tasks
+        self.options = options
+        # Created here so the GUI thread can pause, cancel and reprioritize before run() starts
+        self.runner = BatchRunner(
+            self.tasks, self.options, self.convert_fn,
+            on_file_started=self.file_started.emit,
+            on_file_finished=self.file_finished.emit,
+            on_progress=self.progress.emit,
+            on_job_progress=self.job_progress.emit,
+            on_batch_progress=self.batch_progress.emit,
+            journal=journal,
+            metrics=metrics,
+        )
+
+    # Called from the GUI thread; BatchRunner's scheduler and controls lock internally
+    def set_priority(self, job_id, priority):
+        """Reprioritize a job that has not started yet."""
+        self.runner.set_priority(job_id, priority)
+
+    def pause(self):
+        return self.runner.pause()
+
+    def resume(self):
+        self.runner.resume()
+
+    def cancel(self):
+        self.runner.cancel()
+
+    def pause_job(self, job_id):
+        return self.runner.pause_job(job_id)
+
+    def resume_job(self, job_id):
+        return self.runner.resume_job(job_id)
+
+    def cancel_job(self, job_id):
+        self.runner.cancel_job(job_id)
+
+    def run(self):
+        """Run the batch with conversion_engine.BatchRunner, re-emitting its callbacks as signals."""
+        try:
+            summary = self.runner.run()
+        except Exception as e: # An exception escaping a slot would abort the application
+            traceback.print_exc()
+            if self.runner.journal is not None:
+                self.runner.journal.close() # Kept, so the unfinished files can be resumed
+            self.failed.emit(f"{type(e).__name__}: {e}")
+            return
+        self.finished.emit(summary)
+
+
+class FolderScanWorker(QObject):
+    """Scans folders for MP4 files off the GUI thread, emitting paths in batches."""
+    files_found = pyqtSignal(list) # Batch of file paths
+    finished = pyqtSignal()
+
+    def __init__(self, folder, recursive, follow_symlinks):
+        super().__init__()
+        self.folder = folder
+        self.recursive = recursive
+        self.follow_symlinks = follow_symlinks
+
+    def run(self):
+        for batch in scan_media_files([self.folder], recursive=self.recursive, follow_symlinks=self.follow_symlinks):
+            self.files_found.emit(batch)
+        self.finished.emit()
+
 
 class VideoConverterApp(QWidget):
     def __init__(self):
@@ -17,6 +108,10 @@ class VideoConverterApp(QWidget):
         self.setWindowTitle("MP4 to OGG & WebM Converter")
         self.setGeometry(100, 100, 500, 450) # Adjusted size for new elements
 
+        # Job events / Prometheus export when MP4_CONVERTER_METRICS_LOG or _PROMETHEUS_FILE is set;
+        # one recorder for the whole session so its counters keep growing across batches
+        self.metrics = MetricsRecorder.from_environment()
+
         # Main Layout
         self.layout = QVBoxLayout()
 
@@ -29,9 +124,60 @@ class VideoConverterApp(QWidget):
         self.add_folder_button.clicked.connect(self.add_folder)
         self.layout.addWidget(self.add_folder_button)
 
-        # File List Display
-        self.file_list_widget = QListWidget()
-        self.layout.addWidget(self.file_list_widget)
+        # Folder scan options and list management
+        self.scan_options_layout = QHBoxLayout()
+        self.recursive_scan_checkbox = QCheckBox("Include subfolders")
+        self.recursive_scan_checkbox.setChecked(True)
+        self.scan_options_layout.addWidget(self.recursive_scan_checkbox)
+        self.follow_symlinks_checkbox = QCheckBox("Follow symlinks")
+        self.follow_symlinks_checkbox.setChecked(False)
+        self.scan_options_layout.addWidget(self.follow_symlinks_checkbox)
+        self.scan_options_layout.addStretch(1)
+        self.clear_files_button = QPushButton("Clear List")
+        self.clear_files_button.clicked.connect(self.clear_files)
+        self.scan_options_layout.addWidget(self.clear_files_button)
+        self.layout.addLayout(self.scan_options_layout)
+
+        # Bulk selection for the whole queue
+        self.bulk_actions_layout = QHBoxLayout()
+        self.select_all_ogg_button = QPushButton("Select All OGG")
+        self.select_all_ogg_button.clicked.connect(lambda: self.select_all_format('ogg', True))
+        self.bulk_actions_layout.addWidget(self.select_all_ogg_button)
+        self.select_all_webm_button = QPushButton("Select All WebM")
+        self.select_all_webm_button.clicked.connect(lambda: self.select_all_format('webm', True))
+        self.bulk_actions_layout.addWidget(self.select_all_webm_button)
+        self.run_first_button = QPushButton("Run Selected First")
+        self.run_first_button.clicked.connect(lambda: self.prioritize_selected(True))
+        self.bulk_actions_layout.addWidget(self.run_first_button)
+        self.run_last_button = QPushButton("Run Selected Last")
+        self.run_last_button.clicked.connect(lambda: self.prioritize_selected(False))
+        self.bulk_actions_layout.addWidget(self.run_last_button)
+        self.bulk_actions_layout.addStretch(1)
+        self.clear_finished_button = QPushButton("Clear Finished")
+        self.clear_finished_button.clicked.connect(self.clear_finished)
+        self.bulk_actions_layout.addWidget(self.clear_finished_button)
+        self.layout.addLayout(self.bulk_actions_layout)
+
+        # File Queue Display (model/view: no widgets are created per file)
+        self.job_store = JobStore() # Queued jobs; O(1) lookup by ID and path, duplicates rejected by real path
+        self.file_model = FileQueueModel(self.job_store, self)
+        self.file_model.priority_changed.connect(self.on_priority_changed)
+        self.file_view = QTableView()
+        self.file_view.setModel(self.file_model)
+        self.file_view.setItemDelegateForColumn(COLUMN_PROGRESS, ProgressBarDelegate(self.file_view))
+        self.file_view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.file_view.setContextMenuPolicy(Qt.CustomContextMenu) # Pause/resume/cancel selected jobs
+        self.file_view.customContextMenuRequested.connect(self.show_queue_menu)
+        self.file_view.setShowGrid(False)
+        self.file_view.setWordWrap(False)
+        self.file_view.verticalHeader().setVisible(False)
+        self.file_view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed) # Uniform rows scroll fast
+        self.file_view.verticalHeader().setDefaultSectionSize(self.file_view.fontMetrics().height() + 8)
+        header = self.file_view.horizontalHeader()
+        for column in range(len(COLUMN_TITLES)):
+            header.setSectionResizeMode(column, QHeaderView.Interactive)
+        header.setSectionResizeMode(COLUMN_FILE, QHeaderView.Stretch)
+        self.layout.addWidget(self.file_view)
 
         # Presets GroupBox
         self.presets_groupbox = QGroupBox("Preset Management")
@@ -83,10 +229,96 @@ class VideoConverterApp(QWidget):
         self.webm_quality_input.setText("30")  # Default WebM quality
         self.form_layout.addRow("WebM CRF (Lower = Better):", self.webm_quality_input)
 
+        # Two-pass WebM
+        self.webm_two_pass_checkbox = QCheckBox("Encode WebM in two passes (pass 1 is cached per source)")
+        self.webm_two_pass_checkbox.setChecked(False)
+        self.form_layout.addRow("WebM Two-Pass:", self.webm_two_pass_checkbox)
+
+        self.webm_bitrate_input = QLineEdit()
+        self.webm_bitrate_input.setPlaceholderText("e.g. 2M; empty = constant quality (CRF)")
+        self.form_layout.addRow("WebM Target Bitrate (two-pass):", self.webm_bitrate_input)
+
+        # Encoder speed profile (libvpx-vp9 speed/tiling options, Theora keyframe interval)
+        self.speed_profile_dropdown = QComboBox()
+        self.speed_profile_dropdown.addItems(list(SPEED_PROFILES))
+        self.speed_profile_dropdown.setCurrentText("balanced")
+        self.form_layout.addRow("Speed Profile:", self.speed_profile_dropdown)
+
+        # Parallel jobs
+        self.workers_input = QLineEdit()
+        self.workers_input.setText("auto")  # Scheduler picks from CPU count and codec mix
+        self.form_layout.addRow("Parallel Jobs (number or auto):", self.workers_input)
+
         # Threads
         self.threads_input = QLineEdit()
-        self.threads_input.setText("4")  # Default number of threads
-        self.form_layout.addRow("FFmpeg Threads:", self.threads_input)
+        self.threads_input.setText("auto")  # Scheduler picks per job
+        self.form_layout.addRow("FFmpeg Threads per Job (number or auto):", self.threads_input)
+
+        # Single decode for OGG + WebM
+        self.single_decode_checkbox = QCheckBox("Decode once when converting to both OGG and WebM")
+        self.single_decode_checkbox.setChecked(True)
+        self.form_layout.addRow("Single Decode:", self.single_decode_checkbox)
+
+        # Segmented encoding of long inputs
+        self.segmented_checkbox = QCheckBox("Split long videos (10+ min) into chunks encoded in parallel")
+        self.segmented_checkbox.setChecked(False)
+        self.form_layout.addRow("Segmented:", self.segmented_checkbox)
+
+        # Resolution ladder (adaptive-streaming rendition set) from one decode
+        self.ladder_checkbox = QCheckBox("Encode 480p, 720p and 1080p renditions per file (replaces Video Resolution)")
+        self.ladder_checkbox.setChecked(False)
+        self.form_layout.addRow("Resolution Ladder:", self.ladder_checkbox)
+
+        # Passthrough of streams already in the output codec, and audio-only OGG
+        self.stream_copy_checkbox = QCheckBox("Copy audio/video already in the output codec instead of re-encoding")
+        self.stream_copy_checkbox.setChecked(False)
+        self.form_layout.addRow("Stream Copy:", self.stream_copy_checkbox)
+
+        self.ogg_audio_only_checkbox = QCheckBox("OGG output contains only the audio (video is not decoded)")
+        self.ogg_audio_only_checkbox.setChecked(False)
+        self.form_layout.addRow("Audio-only OGG:", self.ogg_audio_only_checkbox)
+
+        # Content-hash deduplication of identical sources in different folders
+        self.dedupe_checkbox = QCheckBox("Encode identical files once and link the other outputs to it")
+        self.dedupe_checkbox.setChecked(False)
+        self.form_layout.addRow("Deduplicate:", self.dedupe_checkbox)
+
+        # Content-addressed cache of encoded outputs, shared across batches
+        self.encode_cache_checkbox = QCheckBox("Reuse outputs of files already encoded with these settings")
+        self.encode_cache_checkbox.setChecked(False)
+        self.form_layout.addRow("Encode Cache:", self.encode_cache_checkbox)
+
+        # Output placement: a mirrored output tree, and local scratch staging for remote destinations
+        self.output_root_input = QLineEdit()
+        self.output_root_input.setPlaceholderText("empty = a 'converted' folder next to each file")
+        self.form_layout.addRow("Output Root:", self.output_root_input)
+
+        self.scratch_dir_input = QLineEdit()
+        self.scratch_dir_input.setPlaceholderText("e.g. /dev/shm; empty = encode straight into the output folder")
+        self.form_layout.addRow("Scratch Folder:", self.scratch_dir_input)
+
+        # Per-disk read concurrency, so a slow disk is read one file at a time
+        self.device_concurrency_input = QLineEdit("off")
+        self.device_concurrency_input.setPlaceholderText("off, a number, or auto = one job per rotational/USB disk")
+        self.form_layout.addRow("Jobs per Disk:", self.device_concurrency_input)
+
+        self.prefetch_checkbox = QCheckBox("Read each file ahead into memory when its conversion starts")
+        self.prefetch_checkbox.setChecked(False)
+        self.form_layout.addRow("Prefetch:", self.prefetch_checkbox)
+
+        # Pre-flight inspection of the queue
+        self.preflight_checkbox = QCheckBox("Inspect files before converting (skip unreadable files, avoid upscaling)")
+        self.preflight_checkbox.setChecked(True)
+        self.form_layout.addRow("Pre-flight:", self.preflight_checkbox)
+
+        # Incremental mode
+        self.incremental_checkbox = QCheckBox("Skip files whose outputs are up to date")
+        self.incremental_checkbox.setChecked(False)
+        self.form_layout.addRow("Incremental:", self.incremental_checkbox)
+
+        self.incremental_hash_checkbox = QCheckBox("Compare content hashes when timestamps change")
+        self.incremental_hash_checkbox.setChecked(False)
+        self.form_layout.addRow("", self.incremental_hash_checkbox)
 
         self.layout.addLayout(self.form_layout)
 
@@ -95,12 +327,30 @@ class VideoConverterApp(QWidget):
         self.progress_bar.setValue(0)
         self.layout.addWidget(self.progress_bar)
 
+        # Status line for the running batch
+        self.status_label = QLabel("")
+        self.layout.addWidget(self.status_label)
+
         # Convert Button
         self.convert_button = QPushButton("Convert Videos")
         self.convert_button.clicked.connect(self.convert_videos)
         # self.convert_button.setEnabled(False) # Will be handled by update_convert_button_state
         self.layout.addWidget(self.convert_button)
 
+        # Controls for the running batch, and resuming one that was interrupted by a crash
+        self.batch_controls_layout = QHBoxLayout()
+        self.pause_button = QPushButton("Pause")
+        self.pause_button.clicked.connect(self.toggle_pause)
+        self.batch_controls_layout.addWidget(self.pause_button)
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.cancel_conversion)
+        self.batch_controls_layout.addWidget(self.cancel_button)
+        self.batch_controls_layout.addStretch(1)
+        self.resume_batch_button = QPushButton("Resume Interrupted Batch")
+        self.resume_batch_button.clicked.connect(self.resume_interrupted_batch)
+        self.batch_controls_layout.addWidget(self.resume_batch_button)
+        self.layout.addLayout(self.batch_controls_layout)
+
         # Set Layout
         self.setLayout(self.layout)
 
@@ -112,9 +362,14 @@ class VideoConverterApp(QWidget):
 
         # Variables
         self.presets = {} # To store loaded presets
-        # self.input_folder = None # Replaced by file_list_widget
+        # self.input_folder = None # Replaced by the file queue view
         self.output_folder = None # Will be set based on first file or a general setting
-        self.files_to_process = [] # To store file paths and their conversion choices
+        self.scan_jobs = [] # (QThread, FolderScanWorker) pairs for running folder scans
+        self.conversion_thread = None # Background QThread while a batch runs
+        self.conversion_worker = None # ConversionWorker living on conversion_thread
+        self.completed_label_text = "" # Status line parts, refreshed by progress slots
+        self.job_status_text = ""
+        self.batch_eta_text = ""
         
         self.load_presets_from_file() # Load presets at startup
         self.update_convert_button_state() # Initial state
@@ -163,7 +418,25 @@ class VideoConverterApp(QWidget):
             "audio_bitrate": self.audio_bitrate_dropdown.currentText(),
             "ogg_quality": self.ogg_quality_input.text(),
             "webm_quality": self.webm_quality_input.text(),
+            "speed_profile": self.speed_profile_dropdown.currentText(),
+            "webm_two_pass": self.webm_two_pass_checkbox.isChecked(),
+            "webm_bitrate": self.webm_bitrate_input.text(),
+            "workers": self.workers_input.text(),
             "threads": self.threads_input.text(),
+            "single_decode": self.single_decode_checkbox.isChecked(),
+            "segmented": self.segmented_checkbox.isChecked(),
+            "ladder": ["480p", "720p", "1080p"] if self.ladder_checkbox.isChecked() else [],
+            "stream_copy": self.stream_copy_checkbox.isChecked(),
+            "ogg_audio_only": self.ogg_audio_only_checkbox.isChecked(),
+            "dedupe": self.dedupe_checkbox.isChecked(),
+            "encode_cache": self.encode_cache_checkbox.isChecked(),
+            "output_root": self.output_root_input.text().strip(),
+            "scratch_dir": self.scratch_dir_input.text().strip(),
+            "device_concurrency": self.device_concurrency_input.text(),
+            "prefetch": self.prefetch_checkbox.isChecked(),
+            "preflight": self.preflight_checkbox.isChecked(),
+            "incremental": self.incremental_checkbox.isChecked(),
+            "incremental_hash": self.incremental_hash_checkbox.isChecked(),
         }
 
     def save_presets_to_file(self):
@@ -247,164 +520,348 @@ class VideoConverterApp(QWidget):
             files_to_add, _ = QFileDialog.getOpenFileNames(self, "Select MP4 Files", "", "MP4 Files (*.mp4)")
         
         if files_to_add:
-            for file_path in files_to_add:
-                if not any(d['path'] == file_path for d in self.files_to_process): # Avoid duplicates
-                    self.add_file_to_list(file_path)
+            self.file_model.add_paths(files_to_add) # Duplicates are skipped by the job store
             self.update_convert_button_state()
 
     def add_folder(self, test_folder=None): # Added test_folder for testing
-        """Open file dialog to select a folder and add MP4 files from it."""
+        """Open file dialog to select a folder and add MP4 files from it.
+
+        The folder is scanned on a background thread; files appear in the list in batches.
+        """
         folder_to_scan = test_folder
         if not folder_to_scan: # pragma: no cover
             folder_to_scan = QFileDialog.getExistingDirectory(self, "Select Folder")
         
         if folder_to_scan:
-            for filename in os.listdir(folder_to_scan):
-                if filename.lower().endswith(".mp4"):
-                    file_path = os.path.join(folder_to_scan, filename)
-                    if not any(d['path'] == file_path for d in self.files_to_process): # Avoid duplicates
-                        self.add_file_to_list(file_path)
-            self.update_convert_button_state()
-
-    def add_file_to_list(self, file_path):
-        """Adds a file to the list widget with custom controls and stores its data."""
-        item_data = {'path': file_path, 'convert_ogg': True, 'convert_webm': True}
-        self.files_to_process.append(item_data)
-
-        list_item = QListWidgetItem(self.file_list_widget)
-        
-        custom_widget = QWidget()
-        custom_layout = QHBoxLayout(custom_widget)
-        custom_layout.setContentsMargins(5, 2, 5, 2) # Adjust margins for tighter packing
-
-        file_label = QLabel(os.path.basename(file_path)) # Show only filename
-        file_label.setToolTip(file_path) # Show full path on hover
+            scan_thread = QThread()
+            scan_worker = FolderScanWorker(
+                folder_to_scan, self.recursive_scan_checkbox.isChecked(), self.follow_symlinks_checkbox.isChecked()
+            )
+            scan_worker.moveToThread(scan_thread)
+            scan_thread.started.connect(scan_worker.run)
+            scan_worker.files_found.connect(self.on_files_found)
+            scan_worker.finished.connect(scan_thread.quit)
+            scan_thread.finished.connect(lambda job=(scan_thread, scan_worker): self.on_scan_thread_finished(job))
+            self.scan_jobs.append((scan_thread, scan_worker))
+            self.status_label.setText(f"Scanning {folder_to_scan}...")
+            scan_thread.start()
+
+    def is_scanning(self):
+        """True while any folder scan is running."""
+        return bool(self.scan_jobs)
+
+    def on_files_found(self, file_paths):
+        """Slot: a batch of paths from a folder scan, inserted into the model at once."""
+        self.file_model.add_paths(file_paths)
+        self.update_convert_button_state()
+        self.status_label.setText(f"{len(self.files_to_process)} file(s) queued")
+
+    def on_scan_thread_finished(self, scan_job):
+        """Slot: a folder scan thread stopped; release it."""
+        scan_thread, _ = scan_job
+        scan_thread.wait() # finished is emitted just before the thread exits
+        self.scan_jobs.remove(scan_job)
+        self.update_convert_button_state()
+
+    def clear_files(self):
+        """Remove all queued files."""
+        self.file_model.clear()
+        self.update_convert_button_state()
+
+    def clear_finished(self):
+        """Remove done, failed and skipped jobs, keeping queued ones."""
+        if self.is_converting():
+            QMessageBox.warning(self, "Warning", "Finished jobs can be cleared once the batch is done.")
+            return
+        removed = self.file_model.remove_finished()
+        self.status_label.setText(f"Removed {removed} finished file(s)")
+        self.update_convert_button_state()
+
+    def select_all_format(self, format_type, enabled=True):
+        """Check (or uncheck) one output format for every queued file."""
+        self.file_model.set_format_all(format_type, enabled)
+
+    def selected_jobs(self):
+        """Jobs of the selected table rows."""
+        return [self.job_store[index.row()] for index in self.file_view.selectionModel().selectedRows()]
+
+    def prioritize_selected(self, first=True):
+        """Move the selected queued files to the front (or back) of the dispatch order."""
+        jobs = [job for job in self.selected_jobs() if job.state == JOB_QUEUED]
+        self.file_model.prioritize(jobs, first)
+
+    def on_priority_changed(self, jobs):
+        """Slot: priorities were edited; jobs still waiting in a running batch are reordered."""
+        if self.conversion_worker is None:
+            return
+        for job in jobs:
+            if job.state == JOB_QUEUED:
+                self.conversion_worker.set_priority(job.id, job.priority)
 
-        ogg_checkbox = QCheckBox("OGG")
-        ogg_checkbox.setChecked(True)
-        ogg_checkbox.stateChanged.connect(lambda state, path=file_path: self.update_conversion_choice(path, 'ogg', state))
+    @property
+    def files_to_process(self):
+        """Queued jobs (job_store.Job) in display order."""
+        return self.job_store
 
-        webm_checkbox = QCheckBox("WebM")
-        webm_checkbox.setChecked(True)
-        webm_checkbox.stateChanged.connect(lambda state, path=file_path: self.update_conversion_choice(path, 'webm', state))
-        
-        custom_layout.addWidget(file_label, 1) # Add label with stretch factor
-        custom_layout.addWidget(ogg_checkbox)
-        custom_layout.addWidget(webm_checkbox)
-        
-        custom_widget.setLayout(custom_layout)
-        list_item.setSizeHint(custom_widget.sizeHint())
-        
-        self.file_list_widget.addItem(list_item)
-        self.file_list_widget.setItemWidget(list_item, custom_widget)
+    def add_file_to_list(self, file_path):
+        """Adds a file to the job store and the queue view."""
+        self.file_model.add_paths([file_path])
 
     def update_conversion_choice(self, file_path, format_type, state):
-        """Updates the conversion choice for a file in self.files_to_process."""
-        for item_data in self.files_to_process:
-            if item_data['path'] == file_path:
-                if format_type == 'ogg':
-                    item_data['convert_ogg'] = (state == Qt.Checked)
-                elif format_type == 'webm':
-                    item_data['convert_webm'] = (state == Qt.Checked)
-                break
-        # For debugging, print the updated list
-        # print(self.files_to_process)
+        """Updates the conversion choice for a queued file."""
+        job = self.job_store.find(file_path)
+        if job is not None and format_type in ('ogg', 'webm'):
+            self.job_store.set_format(job, format_type, state == Qt.Checked)
+            self.file_model.job_changed(job)
 
     def update_convert_button_state(self):
-        """Enable/disable convert button based on file list."""
-        self.convert_button.setEnabled(len(self.files_to_process) > 0)
+        """Enable/disable convert button based on file list, and the batch controls based on the batch state."""
+        converting = self.is_converting()
+        self.convert_button.setEnabled(len(self.files_to_process) > 0 and not converting)
+        self.pause_button.setEnabled(converting)
+        self.cancel_button.setEnabled(converting)
+        if not converting:
+            self.pause_button.setText("Pause")
+        self.resume_batch_button.setEnabled(not converting and bool(interrupted_journals("gui")))
 
 
     def convert_videos(self):
-        """Convert selected MP4 videos to OGG and/or WebM based on per-file choices."""
+        """Start converting selected MP4 videos to OGG and/or WebM based on per-file choices.
+
+        The batch runs on a background QThread; results come back through queued signals
+        so the event loop keeps repainting while FFmpeg works.
+        """
+        if self.is_converting():
+            QMessageBox.warning(self, "Warning", "A conversion batch is already running.")
+            return
+
         if not self.files_to_process:
             QMessageBox.warning(self, "Warning", "Please add files to convert first!")
             return
 
-        # Filter files that actually need conversion
-        files_to_convert_tasks = [
-            item_data for item_data in self.files_to_process
-            if item_data.get('convert_ogg', False) or item_data.get('convert_webm', False)
-        ]
+        # Only jobs with at least one format selected are converted
+        files_to_convert_tasks = self.job_store.tasks()
 
         if not files_to_convert_tasks:
             QMessageBox.information(self, "No Conversions Selected", "No files have OGG or WebM formats selected for conversion.")
             return
 
-        # Global FFmpeg options from UI
-        resolution = self.get_resolution()
-        audio_bitrate = self.get_audio_bitrate()
-        threads_per_ffmpeg_process = self.get_threads() # Renamed for clarity
-        ogg_quality = self.get_ogg_quality()
-        webm_quality = self.get_webm_quality()
+        # Global FFmpeg options from UI, read here on the GUI thread
+        conversion_options = options_from_settings(self._get_current_quality_settings())
+        self._start_batch(files_to_convert_tasks, conversion_options)
 
-        # Progress Bar setup
-        self.progress_bar.setValue(0)
-        self.progress_bar.setMaximum(len(files_to_convert_tasks))
+    def resume_interrupted_batch(self):
+        """Re-queue the unfinished files of a batch that was interrupted by a crash and convert them
+        with that batch's settings."""
+        if self.is_converting():
+            QMessageBox.warning(self, "Warning", "A conversion batch is already running.")
+            return
+        # The most recent one; the button stays enabled while older interrupted batches are left
+        journal = next(iter(interrupted_journals("gui")), None)
+        interrupted = journal.load() if journal is not None else None
+        if interrupted is None or not interrupted['tasks']:
+            if journal is not None:
+                journal.finish()
+            self.update_convert_button_state()
+            QMessageBox.information(self, "Nothing to Resume", "There is no interrupted batch with unfinished files.")
+            return
 
-        # Determine number of parallel worker threads for the ThreadPoolExecutor
-        # This is different from threads_per_ffmpeg_process.
-        # For simplicity, let's use a fixed number of worker threads or make it configurable if needed.
-        # Here, using the same "FFmpeg Threads" input for ThreadPoolExecutor workers for now.
-        try:
-            # This 'threads' variable is for the ThreadPoolExecutor max_workers
-            num_worker_threads = max(1, int(self.threads_input.text())) 
-        except ValueError:
-            num_worker_threads = 4  # Default worker threads for ThreadPoolExecutor
-
-        completed_count = 0
-        successful_ogg_conversions = 0
-        successful_webm_conversions = 0
-        files_with_errors = 0
-        error_details = [] # Store more detailed error messages
-
-        with ThreadPoolExecutor(max_workers=num_worker_threads) as executor:
-            futures = {
-                executor.submit(
-                    self.convert_video,
-                    item_data['path'],
-                    item_data['convert_ogg'],
-                    item_data['convert_webm'],
-                    resolution,
-                    audio_bitrate,
-                    ogg_quality,
-                    webm_quality,
-                    threads_per_ffmpeg_process # This is the -threads for ffmpeg command
-                ): item_data['path'] for item_data in files_to_convert_tasks
-            }
-
-            for future in as_completed(futures):
-                original_file_path = futures[future]
-                try:
-                    result = future.result()  # result is a dict from convert_video
-                    
-                    if result['status'] == "success":
-                        if "OGG" in result['formats']:
-                            successful_ogg_conversions += 1
-                        if "WebM" in result['formats']:
-                            successful_webm_conversions += 1
-                    elif result['status'] == "error":
-                        files_with_errors +=1
-                        for err_msg in result['errors']:
-                            error_details.append(f"File {os.path.basename(original_file_path)}: {err_msg}")
-                    # Other statuses like "skipped" or "noop" are logged by convert_video itself.
-                
-                except Exception as e:
-                    # This catches errors from the future.result() call itself, or unexpected issues in convert_video
-                    files_with_errors +=1
-                    err_msg = f"Critical error processing {os.path.basename(original_file_path)}: {str(e)}"
-                    print(err_msg) # Log critical errors to console
-                    error_details.append(err_msg)
-                
-                completed_count += 1
-                self.progress_bar.setValue(completed_count)
+        self.file_model.add_paths([task['path'] for task in interrupted['tasks']])
+        tasks = []
+        for task in interrupted['tasks']:
+            job = self.job_store.find(task['path'])
+            if job is None:
+                continue
+            job.convert_ogg = task['convert_ogg']
+            job.convert_webm = task['convert_webm']
+            job.priority = task.get('priority', 0)
+            tasks.append(job.as_task())
+        print(f"Resuming interrupted batch: {len(tasks)} file(s) left, {interrupted['finished']} already finished")
+        self._start_batch(tasks, interrupted['options'], journal)
+
+    def _start_batch(self, files_to_convert_tasks, conversion_options, journal=None):
+        """Reset the tasks' jobs and run them on a background QThread, journaled in journal (default: a new one)."""
+        queued_jobs = [self.job_store.get(task['job_id']) for task in files_to_convert_tasks]
+        for job in queued_jobs:
+            self.job_store.reset(job)
+        self.file_model.jobs_changed(queued_jobs)
+
+        # Progress Bar setup (per mille of the size-weighted batch)
+        self.progress_bar.setValue(0)
+        self.progress_bar.setMaximum(1000)
+        self.completed_label_text = f"0/{len(files_to_convert_tasks)} file(s) done"
+        self.job_status_text = ""
+        self.batch_eta_text = ""
+        self.status_label.setText(f"Converting {len(files_to_convert_tasks)} file(s)...")
+
+        self.conversion_thread = QThread()
+        self.conversion_worker = ConversionWorker(convert_video, files_to_convert_tasks, conversion_options, journal or BatchJournal("gui"), self.metrics)
+        self.conversion_worker.moveToThread(self.conversion_thread)
+
+        # The worker lives on conversion_thread, so these connections are queued onto the GUI thread
+        self.conversion_thread.started.connect(self.conversion_worker.run)
+        self.conversion_worker.file_started.connect(self.on_file_started)
+        self.conversion_worker.file_finished.connect(self.on_file_converted)
+        self.conversion_worker.progress.connect(self.on_conversion_progress)
+        self.conversion_worker.job_progress.connect(self.on_job_progress)
+        self.conversion_worker.batch_progress.connect(self.on_batch_progress)
+        self.conversion_worker.finished.connect(self.on_conversion_finished)
+        self.conversion_worker.finished.connect(self.conversion_thread.quit)
+        self.conversion_worker.failed.connect(self.on_conversion_failed)
+        self.conversion_worker.failed.connect(self.conversion_thread.quit)
+        self.conversion_thread.finished.connect(self.on_conversion_thread_finished)
+
+        self.conversion_thread.start()
+        self.update_convert_button_state()
+
+    def is_converting(self):
+        """True while a conversion batch is running on the background thread."""
+        return self.conversion_thread is not None
+
+    def toggle_pause(self):
+        """Pause the running batch (stopping its FFmpeg processes), or resume it."""
+        if self.conversion_worker is None:
+            return
+        running = [job for job in self.job_store if job.state in (JOB_RUNNING, JOB_PAUSED)]
+        if self.pause_button.text() == "Pause":
+            if not self.conversion_worker.pause():
+                QMessageBox.warning(self, "Pause Not Supported", "Pausing FFmpeg is not supported on this platform.")
+                return
+            new_state, button_text = JOB_PAUSED, "Resume"
+        else:
+            self.conversion_worker.resume()
+            new_state, button_text = JOB_RUNNING, "Pause"
+        for job in running:
+            job.state = new_state
+        self.file_model.jobs_changed(running)
+        self.pause_button.setText(button_text)
+
+    def cancel_conversion(self):
+        """Cancel the running batch: FFmpeg processes are terminated and queued files are not started."""
+        if self.conversion_worker is not None:
+            self.conversion_worker.cancel()
+            self.status_label.setText("Cancelling...")
+
+    def show_queue_menu(self, position):
+        """Context menu of the queue view with per-job controls."""
+        menu = QMenu(self.file_view)
+        menu.addAction("Pause", self.pause_selected)
+        menu.addAction("Resume", self.resume_selected)
+        menu.addAction("Cancel", self.cancel_selected)
+        menu.exec_(self.file_view.viewport().mapToGlobal(position))
+
+    def pause_selected(self):
+        """Stop the selected running jobs."""
+        if self.conversion_worker is None:
+            return
+        paused = [job for job in self.selected_jobs() if job.state == JOB_RUNNING and self.conversion_worker.pause_job(job.id)]
+        for job in paused:
+            job.state = JOB_PAUSED
+        self.file_model.jobs_changed(paused)
+
+    def resume_selected(self):
+        """Continue the selected paused jobs."""
+        if self.conversion_worker is None:
+            return
+        resumed = [job for job in self.selected_jobs() if job.state == JOB_PAUSED and self.conversion_worker.resume_job(job.id)]
+        for job in resumed:
+            job.state = JOB_RUNNING
+        self.file_model.jobs_changed(resumed)
+
+    def cancel_selected(self):
+        """Cancel the selected jobs of the running batch; queued ones will not be started."""
+        if self.conversion_worker is None:
+            return
+        jobs = [job for job in self.selected_jobs() if job.state in (JOB_QUEUED, JOB_RUNNING, JOB_PAUSED)]
+        for job in jobs:
+            self.conversion_worker.cancel_job(job.id)
+            if job.state == JOB_QUEUED:
+                job.state = JOB_CANCELLED # Running jobs report back once FFmpeg has exited
+        self.file_model.jobs_changed(jobs)
+
+    def on_conversion_thread_finished(self):
+        """Slot: the background thread has stopped; release it and re-enable the UI."""
+        self.conversion_thread.wait() # finished is emitted just before the thread exits
+        self.conversion_thread = None
+        self.conversion_worker = None
+        self.update_convert_button_state()
+
+    def on_file_started(self, path):
+        """Slot: a job was handed to FFmpeg."""
+        job = self.job_store.find(path)
+        if job is not None:
+            self.job_store.mark_running(job)
+            self.file_model.job_changed(job)
+
+    def on_file_converted(self, result):
+        """Slot: one file finished (successfully or not)."""
+        job = self.job_store.find(result['path'])
+        if job is not None:
+            self.job_store.finish(job, result)
+            self.file_model.job_changed(job)
+        self.job_status_text = f"Finished {os.path.basename(result['path'])} ({result['status']})"
+        self._refresh_status_label()
+
+    def on_conversion_progress(self, completed_count, total_count):
+        """Slot: number of finished files changed."""
+        self.completed_label_text = f"{completed_count}/{total_count} file(s) done"
+
+    def on_job_progress(self, path, info):
+        """Slot: streaming FFmpeg progress for one running job."""
+        remaining_media = (info['duration'] - info['out_time']) if info['duration'] else None
+        job_eta = remaining_media / info['speed'] if remaining_media is not None and info['speed'] else None
+        job = self.job_store.find(path)
+        if job is not None:
+            job.progress = info['fraction'] or 0.0
+            job.eta = job_eta
+            self.file_model.job_changed(job)
+        percent = f"{info['fraction'] * 100:.0f}%" if info['fraction'] is not None else f"{info['out_time']:.0f}s"
+        fps = f"{info['fps']:.0f} fps" if info['fps'] is not None else "- fps"
+        speed = f"{info['speed']:.2f}x" if info['speed'] is not None else "-x"
+        self.job_status_text = f"{os.path.basename(path)}: {percent}, {fps}, {speed}"
+        self._refresh_status_label()
+
+    def on_batch_progress(self, fraction, eta_seconds):
+        """Slot: aggregate batch progress and ETA."""
+        self.progress_bar.setValue(int(fraction * self.progress_bar.maximum()))
+        self.batch_eta_text = f"ETA {format_eta(eta_seconds)}"
+        self._refresh_status_label()
+
+    def _refresh_status_label(self):
+        """Combine file count, latest job progress and batch ETA into the status line."""
+        parts = [self.completed_label_text, self.job_status_text, self.batch_eta_text]
+        self.status_label.setText(" | ".join(part for part in parts if part))
+
+    def on_conversion_finished(self, summary):
+        """Slot: the batch is done; report results."""
+        total_files_processed = summary['total']
+        successful_ogg_conversions = summary['successful_ogg']
+        successful_webm_conversions = summary['successful_webm']
+        files_with_errors = summary['files_with_errors']
+        error_details = summary['error_details']
 
         # Report results
-        total_files_processed = len(files_to_convert_tasks)
         summary_message = f"Conversion process finished.\n\n"
         summary_message += f"Total files attempted: {total_files_processed}\n"
         summary_message += f"Successfully converted to OGG: {successful_ogg_conversions} file(s)\n"
         summary_message += f"Successfully converted to WebM: {successful_webm_conversions} file(s)\n"
+        if summary['up_to_date'] > 0:
+            summary_message += f"Skipped (already up to date): {summary['up_to_date']} file(s)\n"
+        if summary['cancelled'] > 0:
+            summary_message += f"Cancelled: {summary['cancelled']} file(s)\n"
+        if summary['firstpass_cache_hits'] or summary['firstpass_cache_misses']:
+            summary_message += (f"WebM pass-1 cache: {summary['firstpass_cache_hits']} hit(s), "
+                                f"{summary['firstpass_cache_misses']} miss(es)\n")
+        if summary['makespan_seconds'] > 0:
+            summary_message += (f"Batch time: {format_eta(summary['makespan_seconds'])} "
+                                f"(ideal with {summary['workers']} worker(s): {format_eta(summary['makespan_lower_bound_seconds'])})\n")
+        if summary['deduplicated_files'] > 0:
+            summary_message += (f"Identical files linked instead of encoded: {summary['deduplicated_files']} "
+                                f"(saved {format_eta(summary['dedupe_saved_seconds'])} of encoding, "
+                                f"{summary['dedupe_saved_bytes'] / (1024 * 1024):.1f} MB of disk)\n")
+        if summary['encode_cache']:
+            summary_message += (f"Encode cache: {summary['encode_cache']['hits']} hit(s), "
+                                f"{summary['encode_cache']['misses']} miss(es)\n")
         
         if files_with_errors > 0:
             summary_message += f"\nEncountered errors with {files_with_errors} file(s).\n"
@@ -425,139 +882,66 @@ class VideoConverterApp(QWidget):
         print(f"Total files attempted: {total_files_processed}")
         print(f"Successful OGG conversions: {successful_ogg_conversions}")
         print(f"Successful WebM conversions: {successful_webm_conversions}")
+        print(f"Skipped as up to date: {summary['up_to_date']}")
+        print(f"Cancelled: {summary['cancelled']}")
+        print(f"WebM pass-1 cache: {summary['firstpass_cache_hits']} hit(s), {summary['firstpass_cache_misses']} miss(es)")
+        print(f"Makespan: {summary['makespan_seconds']:.1f}s (ideal lower bound {summary['makespan_lower_bound_seconds']:.1f}s)")
+        print(f"FFmpeg resources: {summary['cpu_seconds']:.1f} CPU-seconds, peak RSS {summary['peak_rss_kb'] / 1024:.0f} MB")
+        print(f"Deduplicated: {summary['deduplicated_files']} file(s), {summary['dedupe_saved_bytes']} bytes saved")
+        if summary['encode_cache']:
+            print(f"Encode cache: {summary['encode_cache']['hits']} hit(s), {summary['encode_cache']['misses']} miss(es)")
         print(f"Files with errors: {files_with_errors}")
         if error_details:
             print("Error Details:")
             for err in error_details:
                 print(f"  - {err}")
         print("--- End of Summary ---\n")
-        
+
+        self.progress_bar.setValue(self.progress_bar.maximum())
+        self.status_label.setText("Conversion finished.")
         QMessageBox.information(self, "Conversion Complete", summary_message)
 
+    def on_conversion_failed(self, message):
+        """Slot: the batch stopped with an error; fail its unfinished jobs and report it."""
+        stopped = [job for job in self.job_store if job.state in (JOB_RUNNING, JOB_PAUSED)]
+        for job in stopped:
+            self.job_store.finish(job, {"path": job.path, "status": "error", "formats": [], "errors": [message]})
+        self.file_model.jobs_changed(stopped)
+        print(f"Conversion stopped by an error: {message}")
+        self.status_label.setText("Conversion failed.")
+        QMessageBox.critical(self, "Conversion Failed", f"The conversion stopped because of an error:\n\n{message}")
+
     def get_resolution(self):
         """Map resolution dropdown to FFmpeg scale."""
-        resolution = self.resolution_dropdown.currentText()
-        if resolution == "480p":
-            return "scale=-2:480"
-        elif resolution == "720p":
-            return "scale=-2:720"
-        elif resolution == "1080p":
-            return "scale=-2:1080"
-        return None  # Original resolution
+        return resolution_filter(self.resolution_dropdown.currentText()) # None for original resolution
 
     def get_audio_bitrate(self):
         """Get audio bitrate from dropdown."""
-        bitrate = self.audio_bitrate_dropdown.currentText()
-        return None if bitrate == "Original" else bitrate
+        return parse_audio_bitrate(self.audio_bitrate_dropdown.currentText())
 
     def get_ogg_quality(self):
         """Get OGG video quality (1-10)."""
-        try:
-            return max(1, min(10, int(self.ogg_quality_input.text())))
-        except ValueError:
-            return 5  # Default OGG quality
+        return parse_ogg_quality(self.ogg_quality_input.text())
 
     def get_webm_quality(self):
         """Get WebM CRF value."""
-        try:
-            return max(0, int(self.webm_quality_input.text()))
-        except ValueError:
-            return 30  # Default WebM quality
+        return parse_webm_quality(self.webm_quality_input.text())
+
+    def get_speed_profile(self):
+        """Get the encoder speed profile name."""
+        return parse_speed_profile(self.speed_profile_dropdown.currentText())
 
     def get_threads(self):
-        """Get number of threads from input."""
-        try:
-            return max(1, int(self.threads_input.text()))
-        except ValueError:
-            return 4  # Default to 4 threads
-
-    def convert_video(self, file_path, convert_to_ogg, convert_to_webm, resolution, audio_bitrate, ogg_quality, webm_quality, threads):
-        """Convert a single MP4 video to OGG and/or WebM based on flags."""
-        filename = os.path.basename(file_path)
-        base_output_folder = os.path.join(os.path.dirname(file_path), "converted")
-        os.makedirs(base_output_folder, exist_ok=True)
-
-        converted_formats = []
-        errors = []
-
-        if convert_to_ogg:
-            try:
-                ogg_output_file = os.path.join(base_output_folder, os.path.splitext(filename)[0] + ".ogg")
-                print(f"Converting {filename} to OGG...")
-                ffmpeg_command = [
-                    "ffmpeg", "-y", "-i", file_path,
-                    "-c:v", "libtheora",
-                    "-c:a", "libvorbis",
-                    "-q:v", str(ogg_quality),
-                    "-q:a", "5", # Audio quality for OGG (fixed at medium)
-                    "-threads", str(threads),
-                    ogg_output_file
-                ]
-                if resolution:
-                    ffmpeg_command.insert(-2, "-vf")
-                    ffmpeg_command.insert(-2, resolution)
-                if audio_bitrate:
-                    ffmpeg_command.insert(-2, "-b:a")
-                    ffmpeg_command.insert(-2, audio_bitrate)
-                
-                subprocess.run(ffmpeg_command, check=True, capture_output=True, text=True)
-                print(f"Successfully converted {filename} to OGG.")
-                converted_formats.append("OGG")
-            except subprocess.CalledProcessError as e:
-                error_message = f"Failed to convert {filename} to OGG: {e.stderr}"
-                print(error_message)
-                errors.append(error_message)
-            except Exception as e: # Catch other potential errors
-                error_message = f"An unexpected error occurred while converting {filename} to OGG: {str(e)}"
-                print(error_message)
-                errors.append(error_message)
-
-
-        if convert_to_webm:
-            try:
-                webm_output_file = os.path.join(base_output_folder, os.path.splitext(filename)[0] + ".webm")
-                print(f"Converting {filename} to WebM...")
-                ffmpeg_command = [
-                    "ffmpeg", "-y", "-i", file_path,
-                    "-c:v", "libvpx-vp9",
-                    "-c:a", "libopus",
-                    "-crf", str(webm_quality),
-                    "-threads", str(threads),
-                    webm_output_file
-                ]
-                if resolution:
-                    ffmpeg_command.insert(-2, "-vf")
-                    ffmpeg_command.insert(-2, resolution)
-                if audio_bitrate:
-                    ffmpeg_command.insert(-2, "-b:a")
-                    ffmpeg_command.insert(-2, audio_bitrate)
-
-                subprocess.run(ffmpeg_command, check=True, capture_output=True, text=True)
-                print(f"Successfully converted {filename} to WebM.")
-                converted_formats.append("WebM")
-            except subprocess.CalledProcessError as e:
-                error_message = f"Failed to convert {filename} to WebM: {e.stderr}"
-                print(error_message)
-                errors.append(error_message)
-            except Exception as e: # Catch other potential errors
-                error_message = f"An unexpected error occurred while converting {filename} to WebM: {str(e)}"
-                print(error_message)
-                errors.append(error_message)
-
-        if not convert_to_ogg and not convert_to_webm:
-            print(f"No conversion selected for {filename}.")
-            return {"path": file_path, "status": "skipped", "formats": [], "errors": []}
-
-
-        if errors:
-            # If there were errors, the status reflects that, even if one format succeeded
-            return {"path": file_path, "status": "error", "formats": converted_formats, "errors": errors}
-        elif converted_formats:
-            # If at least one format converted successfully and no errors
-            return {"path": file_path, "status": "success", "formats": converted_formats, "errors": []}
-        else:
-            # Should not be reached if at least one format was selected, but as a fallback
-            return {"path": file_path, "status": "noop", "formats": [], "errors": ["No conversion attempted or an unknown issue."]}
+        """Get FFmpeg -threads per job from input, or "auto"."""
+        return parse_count_or_auto(self.threads_input.text())
+
+    def get_workers(self):
+        """Get number of concurrent FFmpeg jobs from input, or "auto"."""
+        return parse_count_or_auto(self.workers_input.text())
+
+    def get_single_decode(self):
+        """Whether OGG and WebM should share one decode when both are selected."""
+        return self.single_decode_checkbox.isChecked()
 
 
 # Run the application
@@ -0,0 +1,101 @@
+"""Where outputs are written, and staging them on a local scratch disk.
+
+By default a source's outputs go to a converted/ folder next to it. With an
+output root they go to a mirror of the source's folder under that root:
+relative to a source root when the source is inside it, else the folder's
+absolute path. With a scratch directory (tmpfs or a local NVMe disk) FFmpeg
+writes there instead of to a possibly remote destination, and finished files
+are shipped to their final folder afterwards, by an OutputMover whose few
+threads keep the copies from competing with the encoders. Qt-free.
+"""
+import errno
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_MOVE_WORKERS = 1
+
+
+def output_folder(file_path, output_root=None, source_root=None):
+    """Folder that receives file_path's outputs."""
+    source_folder = os.path.dirname(os.path.abspath(file_path))
+    if not output_root:
+        return os.path.join(source_folder, "converted")
+    if source_root:
+        relative = os.path.relpath(source_folder, os.path.abspath(source_root))
+        if relative != os.pardir and not relative.startswith(os.pardir + os.sep):
+            return os.path.normpath(os.path.join(output_root, relative))
+    return os.path.normpath(os.path.join(output_root, os.path.splitdrive(source_folder)[1].lstrip(os.sep)))
+
+
+def staging_folder(scratch_dir, file_path):
+    """New private folder in scratch_dir for one job's partial outputs."""
+    os.makedirs(scratch_dir, exist_ok=True)
+    return tempfile.mkdtemp(prefix=f".{os.path.splitext(os.path.basename(file_path))[0]}-", dir=scratch_dir)
+
+
+def ship_output(staged_file, output_file):
+    """Move a finished file from scratch to output_file, which is replaced atomically.
+
+    Across filesystems the file is copied to a hidden name next to output_file
+    first, so a reader never sees a partial output.
+    """
+    folder, name = os.path.split(output_file)
+    os.makedirs(folder, exist_ok=True)
+    try:
+        os.replace(staged_file, output_file)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    temp_path = os.path.join(folder, f".{name}.moving")
+    try:
+        shutil.copyfile(staged_file, temp_path)
+        os.replace(temp_path, output_file)
+    except OSError:
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        raise
+    os.remove(staged_file)
+
+
+def ship_outputs(result):
+    """Ship the outputs a convert_video result left in scratch ('staged') and return the updated result.
+
+    Formats that could not be shipped are dropped from the result with an error.
+    """
+    staged = result.pop("staged", None) or {}
+    filename = os.path.basename(result["path"])
+    for format_name, staged_file in staged.items():
+        try:
+            ship_output(staged_file, result["outputs"][format_name])
+        except OSError as e:
+            error_message = f"Failed to move the {format_name} output of {filename} into place: {e}"
+            print(error_message)
+            result["errors"].append(error_message)
+            result["formats"].remove(format_name)
+            del result["outputs"][format_name]
+            try:
+                os.remove(staged_file)
+            except OSError:
+                pass
+    for staging_dir in {os.path.dirname(staged_file) for staged_file in staged.values()}:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    if result["errors"] and result["status"] == "success":
+        result["status"] = "error"
+    return result
+
+
+class OutputMover:
+    """Ships staged outputs in the background on at most max_workers threads."""
+
+    def __init__(self, max_workers=DEFAULT_MOVE_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="output-mover")
+
+    def submit(self, result):
+        """Future of ship_outputs(result)."""
+        return self._executor.submit(ship_outputs, result)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
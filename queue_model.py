@@ -0,0 +1,170 @@
+"""Model/view pieces for the GUI's file queue.
+
+One QTableView row per job in a job_store.JobStore; no widgets are created
+per file, so 100k-row queues stay responsive.
+"""
+import os
+
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, pyqtSignal
+from PyQt5.QtWidgets import QApplication, QStyle, QStyledItemDelegate, QStyleOptionProgressBar
+
+from conversion_engine import format_eta
+from job_store import JobStore, JOB_QUEUED, JOB_RUNNING, JOB_PAUSED, JOB_DONE, JOB_FAILED, JOB_SKIPPED, JOB_CANCELLED
+
+COLUMN_FILE, COLUMN_OGG, COLUMN_WEBM, COLUMN_PRIORITY, COLUMN_STATUS, COLUMN_PROGRESS, COLUMN_ETA = range(7)
+COLUMN_TITLES = ["File", "OGG", "WebM", "Priority", "Status", "Progress", "ETA"]
+
+# Checkable columns -> format name in job_store.FORMAT_FLAGS
+FORMAT_COLUMNS = {COLUMN_OGG: 'ogg', COLUMN_WEBM: 'webm'}
+
+JOB_STATE_LABELS = {
+    JOB_QUEUED: "Queued",
+    JOB_RUNNING: "Running",
+    JOB_PAUSED: "Paused",
+    JOB_DONE: "Done",
+    JOB_FAILED: "Failed",
+    JOB_SKIPPED: "Skipped",
+    JOB_CANCELLED: "Cancelled",
+}
+
+
+class FileQueueModel(QAbstractTableModel):
+    """Table model over a JobStore, with checkable OGG/WebM columns and an editable Priority column."""
+    priority_changed = pyqtSignal(list) # Jobs whose priority was edited
+
+    def __init__(self, store=None, parent=None):
+        super().__init__(parent)
+        self.store = store if store is not None else JobStore()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.store)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMN_TITLES)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return COLUMN_TITLES[section]
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        flags = Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        if index.column() in FORMAT_COLUMNS:
+            flags |= Qt.ItemIsUserCheckable
+        elif index.column() == COLUMN_PRIORITY and self.store[index.row()].state == JOB_QUEUED:
+            flags |= Qt.ItemIsEditable
+        return flags
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        job = self.store[index.row()]
+        column = index.column()
+
+        if role == Qt.DisplayRole:
+            if column == COLUMN_FILE:
+                return os.path.basename(job.path) # Show only filename
+            if column == COLUMN_PRIORITY:
+                return job.priority
+            if column == COLUMN_STATUS:
+                return JOB_STATE_LABELS.get(job.state, job.state)
+            if column == COLUMN_PROGRESS:
+                return job.progress
+            if column == COLUMN_ETA:
+                return format_eta(job.eta) if job.eta is not None else ""
+        elif role == Qt.EditRole and column == COLUMN_PRIORITY:
+            return job.priority
+        elif role == Qt.CheckStateRole and column in FORMAT_COLUMNS:
+            return Qt.Checked if getattr(job, 'convert_' + FORMAT_COLUMNS[column]) else Qt.Unchecked
+        elif role == Qt.ToolTipRole:
+            if column == COLUMN_FILE:
+                return job.path # Show full path on hover
+            if column == COLUMN_STATUS and job.errors:
+                return "\n".join(job.errors)
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if role == Qt.EditRole and index.column() == COLUMN_PRIORITY:
+            try:
+                priority = int(value)
+            except (TypeError, ValueError):
+                return False
+            job = self.store[index.row()]
+            self.store.set_priority(job, priority)
+            self.dataChanged.emit(index, index, [Qt.DisplayRole, Qt.EditRole])
+            self.priority_changed.emit([job])
+            return True
+        if role != Qt.CheckStateRole or index.column() not in FORMAT_COLUMNS:
+            return False
+        self.store.set_format(self.store[index.row()], FORMAT_COLUMNS[index.column()], value == Qt.Checked)
+        self.dataChanged.emit(index, index, [Qt.CheckStateRole])
+        return True
+
+    def add_paths(self, paths, convert_ogg=True, convert_webm=True):
+        """Queue paths (skipping duplicates) in one insert. Returns the new jobs."""
+        paths = self.store.new_paths(paths)
+        if not paths:
+            return []
+        first = len(self.store)
+        self.beginInsertRows(QModelIndex(), first, first + len(paths) - 1)
+        new_jobs = [self.store.add(path, convert_ogg, convert_webm) for path in paths]
+        self.endInsertRows()
+        return new_jobs
+
+    def clear(self):
+        self.beginResetModel()
+        self.store.clear()
+        self.endResetModel()
+
+    def remove_finished(self):
+        """Drop done, failed, skipped and cancelled jobs. Returns the number removed."""
+        self.beginResetModel()
+        removed = self.store.remove_finished()
+        self.endResetModel()
+        return removed
+
+    def set_format_all(self, format_name, enabled):
+        """Check or uncheck one format column for every job with a single repaint."""
+        changed = self.store.set_format_all(format_name, enabled)
+        if changed:
+            column = next(c for c, name in FORMAT_COLUMNS.items() if name == format_name)
+            self.dataChanged.emit(self.index(0, column), self.index(len(self.store) - 1, column), [Qt.CheckStateRole])
+        return changed
+
+    def prioritize(self, jobs, first=True):
+        """Run jobs before (or after) every other job; see JobStore.prioritize."""
+        if not jobs:
+            return
+        self.store.prioritize(jobs, first)
+        self.jobs_changed(jobs)
+        self.priority_changed.emit(list(jobs))
+
+    def job_changed(self, job):
+        """Repaint the row of a job whose fields were updated."""
+        row = self.store.row_of(job)
+        if row is not None:
+            self.dataChanged.emit(self.index(row, 0), self.index(row, len(COLUMN_TITLES) - 1))
+
+    def jobs_changed(self, jobs):
+        """Repaint the rows of many updated jobs with a single signal."""
+        rows = [row for row in (self.store.row_of(job) for job in jobs) if row is not None]
+        if rows:
+            self.dataChanged.emit(self.index(min(rows), 0), self.index(max(rows), len(COLUMN_TITLES) - 1))
+
+
+class ProgressBarDelegate(QStyledItemDelegate):
+    """Paints the Progress column as a native progress bar without creating widgets."""
+
+    def paint(self, painter, option, index):
+        fraction = index.data(Qt.DisplayRole) or 0.0
+        progress_option = QStyleOptionProgressBar()
+        progress_option.rect = option.rect.adjusted(2, 2, -2, -2)
+        progress_option.minimum = 0
+        progress_option.maximum = 100
+        progress_option.progress = int(fraction * 100)
+        progress_option.text = f"{progress_option.progress}%"
+        progress_option.textVisible = True
+        progress_option.state = option.state
+        QApplication.style().drawControl(QStyle.CE_ProgressBar, progress_option, painter)
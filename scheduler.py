@@ -0,0 +1,146 @@
+"""Job ordering for conversion batches.
+
+Jobs are dispatched longest-processing-time first (LPT): with a fixed pool of
+workers, starting the most expensive jobs early keeps one long job from running
+alone at the end of a batch. Cost is estimated from the probed duration (or,
+without a probe, the file size), the output resolution and the codecs. A
+per-job priority overrides the estimate, and priorities of pending jobs can be
+changed while the batch runs. Tasks are grouped (by the disk their source is
+on), and a group a caller cannot start yet (a disk already at its job cap) is
+passed over without its tasks losing their place.
+Qt-free.
+"""
+import heapq
+import itertools
+import os
+import threading
+
+from media_probe import target_height
+
+# Relative encoding cost per second of 720p video (Theora is much cheaper than VP9)
+CODEC_COST = {"OGG": 1.0, "WebM": 4.0}
+# Cost per second of an output whose video is copied or dropped (audio-only OGG): I/O and audio only
+PASSTHROUGH_COST = 0.05
+REFERENCE_HEIGHT = 720
+
+# Without a probed duration, duration is estimated from the file size at this rate (~5 Mbit/s)
+FALLBACK_BYTES_PER_SECOND = 625000
+
+
+def estimate_cost(item_data, resolution=None, ladder=None, ogg_audio_only=False):
+    """Relative cost of a task dict: seconds of video x output pixels x codec weight.
+
+    Uses the 'duration', 'height' and 'resolution' keys the pre-flight planner
+    adds when present; resolution is the batch-wide scale filter. With a ladder
+    (rung heights) the output pixels of every rung the source reaches are summed.
+    Outputs that copy the video ('copy_streams') or drop it (ogg_audio_only)
+    cost PASSTHROUGH_COST regardless of size.
+    """
+    duration = item_data.get('duration')
+    if not duration:
+        try:
+            duration = os.path.getsize(item_data['path']) / FALLBACK_BYTES_PER_SECOND
+        except OSError:
+            duration = 0.0
+    if ladder:
+        source_height = item_data.get('height')
+        heights = [height for height in ladder if not source_height or height <= source_height] or [source_height]
+        return duration * sum((height / REFERENCE_HEIGHT) ** 2 for height in heights) * \
+            sum(CODEC_COST[format_name] for format_name, flag in (("OGG", 'convert_ogg'), ("WebM", 'convert_webm')) if item_data.get(flag))
+    if 'resolution' in item_data:
+        resolution = item_data['resolution']
+    height = target_height(resolution) or item_data.get('height') or REFERENCE_HEIGHT
+    copy_streams = item_data.get('copy_streams') or {}
+    cost = 0.0
+    for format_name, flag in (("OGG", 'convert_ogg'), ("WebM", 'convert_webm')):
+        if not item_data.get(flag):
+            continue
+        if copy_streams.get(format_name, {}).get("video") or (format_name == "OGG" and ogg_audio_only):
+            cost += PASSTHROUGH_COST
+        else:
+            cost += CODEC_COST[format_name] * (height / REFERENCE_HEIGHT) ** 2
+    return duration * cost
+
+
+def task_key(item_data):
+    """Identifier used to reprioritize a pending task: its job ID, or its path for CLI tasks."""
+    return item_data.get('job_id', item_data['path'])
+
+
+class JobScheduler:
+    """Pending tasks ordered by priority (higher first), then estimated cost (larger first).
+
+    Ties keep queue order. Tasks are pushed into a group (such as the device
+    their source is on) with a heap of its own, so a group that cannot run now
+    is passed over as a whole instead of task by task. Methods are safe to
+    call from any thread.
+    """
+
+    def __init__(self):
+        self._heaps = {} # group -> heap of (-priority, -cost, order, key); entries go stale after a priority change
+        self._entries = {} # key -> [priority, cost, order, item_data, group]
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def push(self, item_data, cost, priority=0, group=None):
+        key = task_key(item_data)
+        with self._lock:
+            entry = [priority, cost, next(self._order), item_data, group]
+            self._entries[key] = entry
+            heapq.heappush(self._heaps.setdefault(group, []), (-priority, -cost, entry[2], key))
+
+    def _head(self, group):
+        """Best live heap entry of group (stale entries above it are dropped), or None. Called with the lock held."""
+        heap = self._heaps[group]
+        while heap:
+            neg_priority, _, order, key = heap[0]
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == -neg_priority and entry[2] == order:
+                return heap[0]
+            heapq.heappop(heap)
+        del self._heaps[group]
+        return None
+
+    def pop(self, available=None):
+        """Remove and return the next task dict, or None if nothing is pending.
+
+        With available, groups for which available(group) is false are passed
+        over (their tasks stay pending in their place), so None can also mean
+        that every pending task is in a blocked group. Costs O(groups + log n).
+        """
+        with self._lock:
+            best_group = None
+            best = None
+            for group in list(self._heaps):
+                head = self._head(group)
+                if head is None or (best is not None and head >= best):
+                    continue
+                if available is not None and not available(group):
+                    continue
+                best_group, best = group, head
+            if best is None:
+                return None
+            heapq.heappop(self._heaps[best_group])
+            return self._entries.pop(best[3])[3]
+
+    def set_priority(self, key, priority):
+        """Change the priority of a pending task. Returns False if it was already dispatched."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            if entry[0] != priority:
+                entry[0] = priority
+                heapq.heappush(self._heaps.setdefault(entry[4], []), (-priority, -entry[1], entry[2], key))
+            return True
+
+
+def makespan_lower_bound(job_seconds, workers):
+    """Shortest possible batch time for jobs of these durations on this many workers."""
+    if not job_seconds:
+        return 0.0
+    return max(max(job_seconds), sum(job_seconds) / max(1, workers))
@@ -0,0 +1,253 @@
+"""Segmented (chunked) encoding of long inputs.
+
+A long source is cut at video keyframes with a stream copy, the pieces are
+encoded in parallel (video only), the audio is encoded once, and the encoded
+pieces are joined with FFmpeg's concat demuxer without re-encoding. The result
+is checked against the source (stream durations and A/V offset) before it is
+accepted; otherwise the caller falls back to a regular single-pass encode.
+
+Qt-free; used by conversion_engine.convert_video when segment_workers is set.
+"""
+import bisect
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from conversion_engine import (
+    run_ffmpeg, plan_concurrency, ogg_video_args, ogg_audio_args, webm_video_args, webm_audio_args
+)
+from media_probe import probe_media
+
+SEGMENT_MIN_DURATION = 600 # Seconds; shorter sources are encoded in one pass
+SEGMENT_MIN_CHUNK_SECONDS = 60 # Chunks shorter than this cost more in startup than they save
+SEGMENT_CHUNKS_PER_WORKER = 2 # More chunks than workers evens out chunks of different complexity
+
+# Accepted differences between the joined output and the source, in seconds
+SEGMENT_DURATION_TOLERANCE = 0.25
+SEGMENT_SYNC_TOLERANCE = 0.1
+
+# Output container of each format's encoded pieces
+CHUNK_EXTENSIONS = {"OGG": ".ogg", "WebM": ".webm"}
+
+def probe_source(file_path):
+    """Return {'duration', 'has_audio', 'keyframes'} for file_path, or None if it cannot be read.
+
+    keyframes (video keyframe times in seconds) comes from ffprobe's packet list;
+    it is None when ffprobe is not installed, in which case the cut points are
+    left to the segment muxer, which also only cuts on keyframes.
+    """
+    try:
+        info = probe_media(file_path)
+    except OSError:
+        return None # FFmpeg cannot be run; the single-pass attempt reports it
+    if not info or not info.get("video") or not info.get("duration"):
+        return None
+    keyframes = None
+    if shutil.which("ffprobe"):
+        packets = subprocess.run(
+            ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "packet=pts_time,flags",
+             "-of", "csv=p=0", file_path],
+            capture_output=True, text=True, errors="replace"
+        )
+        keyframes = []
+        for line in packets.stdout.splitlines():
+            pts_time, _, flags = line.partition(",")
+            if "K" in flags:
+                try:
+                    keyframes.append(float(pts_time))
+                except ValueError:
+                    continue # pts_time is N/A for some packets
+        keyframes.sort()
+    return {"duration": info["duration"], "has_audio": info.get("audio") is not None, "keyframes": keyframes}
+
+
+def choose_cut_points(duration, chunk_count, keyframes=None):
+    """Split times that divide duration into chunk_count roughly equal chunks.
+
+    With a keyframe list each time is moved to the nearest keyframe, so the
+    stream-copy split does not have to extend a chunk to the next keyframe.
+    """
+    cut_points = []
+    for i in range(1, chunk_count):
+        target = duration * i / chunk_count
+        if keyframes:
+            position = bisect.bisect_left(keyframes, target)
+            nearby = keyframes[max(0, position - 1):position + 1]
+            target = min(nearby, key=lambda keyframe: abs(keyframe - target))
+        if 0 < target < duration and (not cut_points or target > cut_points[-1]):
+            cut_points.append(target)
+    return cut_points
+
+
+def build_split_command(file_path, cut_points, piece_pattern):
+    """Stream-copy the first video stream into pieces at cut_points (cuts land on keyframes)."""
+    return [
+        "ffmpeg", "-y", "-i", file_path, "-map", "0:v:0", "-c", "copy",
+        "-f", "segment", "-segment_times", ",".join(f"{t:.6f}" for t in cut_points),
+        "-segment_format", "matroska", "-reset_timestamps", "1", piece_pattern,
+    ]
+
+
+def build_chunk_command(piece_path, chunk_outputs, resolution, ogg_quality, webm_quality, threads, speed_profile="balanced"):
+    """Encode one video-only piece to every format in chunk_outputs ({format: path}), decoding it once."""
+    ffmpeg_command = ["ffmpeg", "-y", "-i", piece_path]
+    formats = list(chunk_outputs)
+    if resolution and len(formats) > 1:
+        ffmpeg_command += ["-filter_complex", f"[0:v:0]{resolution},split={len(formats)}" + "".join(f"[v{i}]" for i in range(len(formats)))]
+        video_maps = [f"[v{i}]" for i in range(len(formats))]
+    else:
+        video_maps = ["0:v:0"] * len(formats)
+        if resolution:
+            ffmpeg_command += ["-vf", resolution]
+
+    for format_name, video_map in zip(formats, video_maps):
+        ffmpeg_command += ["-map", video_map, "-an"]
+        if format_name == "OGG":
+            ffmpeg_command += ogg_video_args(ogg_quality, threads, speed_profile)
+        else:
+            ffmpeg_command += webm_video_args(webm_quality, threads, speed_profile, resolution)
+        ffmpeg_command.append(chunk_outputs[format_name])
+    return ffmpeg_command
+
+
+def build_audio_command(file_path, audio_outputs, audio_bitrate):
+    """Encode the source's first audio stream once per format in audio_outputs ({format: path})."""
+    ffmpeg_command = ["ffmpeg", "-y", "-i", file_path]
+    for format_name, output_path in audio_outputs.items():
+        ffmpeg_command += ["-map", "0:a:0", "-vn"]
+        ffmpeg_command += ogg_audio_args(audio_bitrate) if format_name == "OGG" else webm_audio_args(audio_bitrate)
+        ffmpeg_command.append(output_path)
+    return ffmpeg_command
+
+
+def build_concat_command(list_file, audio_file, output_file):
+    """Join encoded pieces listed in list_file (and the encoded audio, if any) without re-encoding."""
+    ffmpeg_command = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_file]
+    if audio_file:
+        ffmpeg_command += ["-i", audio_file, "-map", "0:v:0", "-map", "1:a:0"]
+    else:
+        ffmpeg_command += ["-map", "0:v:0"]
+    ffmpeg_command += ["-c", "copy", output_file]
+    return ffmpeg_command
+
+
+def stream_end_times(file_path, has_audio=True):
+    """Timestamp where the first video and (optionally) audio stream end, read by a stream copy to the null muxer."""
+    end_times = {}
+    for stream in ("v", "a") if has_audio else ("v",):
+        last = {"out_time": 0.0}
+        run_ffmpeg(
+            ["ffmpeg", "-i", file_path, "-map", f"0:{stream}:0", "-c", "copy", "-f", "null", "-"],
+            lambda info: last.update(out_time=info["out_time"])
+        )
+        end_times[stream] = last["out_time"]
+    return end_times
+
+
+def validate_output(source_ends, output_ends):
+    """List of problems with a joined output compared with the source's stream end times (empty if it matches)."""
+    problems = []
+    if abs(output_ends["v"] - source_ends["v"]) > SEGMENT_DURATION_TOLERANCE:
+        problems.append(f"video ends at {output_ends['v']:.3f}s, source at {source_ends['v']:.3f}s")
+    if "a" in source_ends:
+        if "a" not in output_ends:
+            problems.append("audio stream missing")
+        else:
+            source_offset = source_ends["a"] - source_ends["v"]
+            output_offset = output_ends["a"] - output_ends["v"]
+            if abs(output_offset - source_offset) > SEGMENT_SYNC_TOLERANCE:
+                problems.append(f"A/V offset {output_offset:+.3f}s, source {source_offset:+.3f}s")
+    return problems
+
+
+def convert_segmented(file_path, output_files, resolution, audio_bitrate, ogg_quality, webm_quality, workers,
+                      progress_callback=None, min_duration=SEGMENT_MIN_DURATION,
+                      min_chunk_seconds=SEGMENT_MIN_CHUNK_SECONDS, speed_profile="balanced", control=None):
+    """Encode file_path to output_files ({format: path}) in parallel chunks.
+
+    Returns the list of formats written, or None when the file is too short to
+    split or any step (split, encode, join, validation) fails; the caller then
+    converts the file in a single pass. progress_callback receives run_ffmpeg-style
+    dicts covering the whole file. control (a batch_control.JobControl) pauses or
+    cancels every FFmpeg process of the file.
+    """
+    filename = os.path.basename(file_path)
+    source = probe_source(file_path)
+    if source is None or source["duration"] < min_duration:
+        return None
+    chunk_count = min(int(source["duration"] // min_chunk_seconds), max(2, workers * SEGMENT_CHUNKS_PER_WORKER))
+    cut_points = choose_cut_points(source["duration"], chunk_count, source["keyframes"])
+    if not cut_points:
+        return None
+
+    formats = list(output_files)
+    work_dir = tempfile.mkdtemp(prefix=f".{os.path.splitext(filename)[0]}.segments-", dir=os.path.dirname(output_files[formats[0]]))
+    try:
+        print(f"Splitting {filename} into {len(cut_points) + 1} chunks...")
+        run_ffmpeg(build_split_command(file_path, cut_points, os.path.join(work_dir, "piece_%05d.mkv")), control=control)
+        pieces = sorted(name for name in os.listdir(work_dir) if name.startswith("piece_"))
+        chunk_paths = {
+            format_name: [os.path.join(work_dir, os.path.splitext(piece)[0] + CHUNK_EXTENSIONS[format_name]) for piece in pieces]
+            for format_name in formats
+        }
+        audio_files = {format_name: os.path.join(work_dir, f"audio_{format_name.lower()}.mka") for format_name in formats}
+        _, threads = plan_concurrency(formats, len(pieces), workers)
+
+        # Per-chunk encoded seconds, summed into one progress value for the file
+        encoded = [0.0] * len(pieces)
+        lock = threading.Lock()
+        started = time.monotonic()
+
+        def chunk_progress(chunk_index):
+            def on_progress(info):
+                if not progress_callback:
+                    return
+                with lock:
+                    encoded[chunk_index] = info["out_time"]
+                    out_time = sum(encoded)
+                elapsed = time.monotonic() - started
+                progress_callback({
+                    "out_time": out_time,
+                    "duration": source["duration"],
+                    "fraction": min(1.0, out_time / source["duration"]),
+                    "fps": None,
+                    "speed": out_time / elapsed if elapsed > 0 else None,
+                })
+            return on_progress
+
+        print(f"Encoding {len(pieces)} chunks of {filename} with {workers} worker(s)...")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            if source["has_audio"]:
+                futures.append(executor.submit(run_ffmpeg, build_audio_command(file_path, audio_files, audio_bitrate), None, control))
+            for i, piece in enumerate(pieces):
+                chunk_outputs = {format_name: chunk_paths[format_name][i] for format_name in formats}
+                command = build_chunk_command(os.path.join(work_dir, piece), chunk_outputs, resolution, ogg_quality, webm_quality, threads, speed_profile)
+                futures.append(executor.submit(run_ffmpeg, command, chunk_progress(i), control))
+            for future in as_completed(futures):
+                future.result() # Re-raise the first failure; the executor finishes the rest
+
+        source_ends = stream_end_times(file_path, source["has_audio"])
+        for format_name in formats:
+            list_file = os.path.join(work_dir, f"chunks_{format_name.lower()}.txt")
+            with open(list_file, "w") as f:
+                for chunk_path in chunk_paths[format_name]:
+                    # Entries are resolved relative to the list file, which sits next to the chunks
+                    f.write(f"file '{os.path.basename(chunk_path)}'\n")
+            audio_file = audio_files[format_name] if source["has_audio"] else None
+            run_ffmpeg(build_concat_command(list_file, audio_file, output_files[format_name]), control=control)
+
+            problems = validate_output(source_ends, stream_end_times(output_files[format_name], source["has_audio"]))
+            if problems:
+                print(f"Segmented {format_name} output of {filename} failed validation: {'; '.join(problems)}")
+                return None
+        return formats
+    except subprocess.CalledProcessError as e:
+        print(f"Segmented encoding of {filename} failed, falling back to a single pass: {e.stderr}")
+        return None
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
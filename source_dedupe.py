@@ -0,0 +1,201 @@
+"""Content-addressed deduplication of sources within a batch.
+
+The same MP4 is often queued from several folders. Sources are grouped by
+size, then by a partial hash (size plus head and tail chunks), and candidates
+that still match are confirmed with a full hash read through mmap. Each group
+is encoded once, from its first queued file; the other files get their outputs
+as reflinks (copy-on-write clones, where the filesystem supports them) or hard
+links of the encoded ones, falling back to a copy across filesystems. Qt-free.
+"""
+import errno
+import hashlib
+import mmap
+import os
+import shutil
+
+from output_placement import output_folder
+
+DEDUPE_EDGE_BYTES = 1024 * 1024 # Head and tail bytes read by the partial hash
+DEDUPE_HASH_CHUNK = 8 * 1024 * 1024 # Bytes of the mapping hashed per update
+
+FICLONE = 0x40049409 # Linux ioctl that clones (reflinks) a whole file
+
+# Link methods, best first
+LINK_REFLINK = "reflink"
+LINK_HARDLINK = "hardlink"
+LINK_COPY = "copy"
+
+
+def partial_hash(path, edge_bytes=DEDUPE_EDGE_BYTES):
+    """Cheap fingerprint of a file: its size and first and last edge_bytes."""
+    digest = hashlib.blake2b()
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        digest.update(str(size).encode())
+        digest.update(f.read(edge_bytes))
+        if size > edge_bytes:
+            f.seek(max(edge_bytes, size - edge_bytes))
+            digest.update(f.read(edge_bytes))
+    return digest.hexdigest()
+
+
+def full_hash(path, chunk_size=DEDUPE_HASH_CHUNK):
+    """BLAKE2b of a file's whole content, read through a read-only memory map."""
+    digest = hashlib.blake2b()
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return digest.hexdigest() # An empty file cannot be mapped
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+                mapped.madvise(mmap.MADV_SEQUENTIAL) # Read ahead aggressively, drop pages behind
+            view = memoryview(mapped)
+            try:
+                for offset in range(0, size, chunk_size):
+                    digest.update(view[offset:offset + chunk_size])
+            finally:
+                view.release() # The map cannot close while a view exports it
+    return digest.hexdigest()
+
+
+def _split_by(paths, key):
+    """Groups of paths with an equal key(path); unreadable files are left out."""
+    groups = {}
+    for path in paths:
+        try:
+            groups.setdefault(key(path), []).append(path)
+        except OSError as e:
+            print(f"Dedupe: cannot read {path}: {e}")
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def find_duplicates(paths):
+    """Groups (in the order of paths) of files with identical content; files without a twin are left out.
+
+    Only files of equal size are hashed, and only those whose partial hashes
+    also match are read in full.
+    """
+    candidates = _split_by(paths, os.path.getsize)
+    candidates = [group for size_group in candidates for group in _split_by(size_group, partial_hash)]
+    groups = [group for partial_group in candidates for group in _split_by(partial_group, full_hash)]
+    order = {path: i for i, path in enumerate(paths)}
+    return sorted((sorted(group, key=order.get) for group in groups), key=lambda group: order[group[0]])
+
+
+def dedupe_tasks(tasks):
+    """Keep one task per group of identical sources.
+
+    Returns (tasks to encode, duplicates). The first queued file of a group is
+    encoded with every format any file of the group wants; duplicates maps its
+    path to {'formats': the formats it wanted itself, 'tasks': the other tasks}.
+    """
+    by_path = {item_data['path']: item_data for item_data in tasks}
+    groups = find_duplicates(list(by_path))
+    duplicates = {}
+    replaced = {}
+    for group in groups:
+        primary = by_path[group[0]]
+        others = [by_path[path] for path in group[1:]]
+        wanted = [format_name for format_name, flag in (("OGG", 'convert_ogg'), ("WebM", 'convert_webm')) if primary.get(flag)]
+        replaced[primary['path']] = dict(
+            primary,
+            convert_ogg=any(item_data.get('convert_ogg') for item_data in [primary] + others),
+            convert_webm=any(item_data.get('convert_webm') for item_data in [primary] + others),
+        )
+        duplicates[primary['path']] = {"formats": wanted, "tasks": others}
+    skipped = {item_data['path'] for info in duplicates.values() for item_data in info["tasks"]}
+    if skipped:
+        print(f"Dedupe: {len(skipped)} file(s) are copies of another queued file and will be linked, not encoded")
+    return [replaced.get(item_data['path'], item_data) for item_data in tasks if item_data['path'] not in skipped], duplicates
+
+
+def reflink(source, destination):
+    """Clone source to destination sharing its blocks (btrfs, XFS, ...). Raises OSError where unsupported."""
+    import fcntl # Not on Windows; the ImportError is reported as unsupported
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def link_output(source, destination):
+    """Make destination a reflink, hard link or (across filesystems) a copy of source. Returns the method used.
+
+    The link is made under a temporary name and renamed over destination.
+    """
+    folder, name = os.path.split(destination)
+    temp_path = os.path.join(folder, f".{name}.link")
+    for method in (LINK_REFLINK, LINK_HARDLINK, LINK_COPY):
+        try:
+            if os.path.lexists(temp_path):
+                os.remove(temp_path)
+            if method == LINK_REFLINK:
+                reflink(source, temp_path)
+            elif method == LINK_HARDLINK:
+                os.link(source, temp_path)
+            else:
+                shutil.copy2(source, temp_path)
+            os.replace(temp_path, destination)
+            return method
+        except (OSError, ImportError) as e:
+            if method == LINK_COPY or isinstance(e, OSError) and e.errno == errno.ENOENT:
+                if os.path.lexists(temp_path):
+                    os.remove(temp_path)
+                raise
+    return None # Not reached
+
+
+def link_duplicates(primary, result, info, output_root=None, source_root=None):
+    """Give each duplicate of primary its outputs from primary's convert_video result.
+
+    Each duplicate's outputs go where its own would (see output_placement.output_folder).
+    Formats primary only encoded for its duplicates are removed from primary's
+    outputs afterwards. Returns (duplicate result dicts, saved bytes), saved
+    bytes counting outputs shared through reflinks and hard links.
+    """
+    outputs = result.get("outputs") or {}
+    duplicate_results = []
+    saved_bytes = 0
+    for item_data in info["tasks"]:
+        path = item_data['path']
+        if result["status"] == "cancelled":
+            duplicate_results.append({"path": path, "status": "cancelled", "formats": [], "errors": []})
+            continue
+        duplicate_folder = output_folder(path, output_root, source_root)
+        formats = []
+        errors = []
+        linked = {}
+        for format_name, flag in (("OGG", 'convert_ogg'), ("WebM", 'convert_webm')):
+            if not item_data.get(flag):
+                continue
+            source_output = outputs.get(format_name)
+            if source_output is None:
+                errors.append(f"Failed to convert {os.path.basename(path)} to {format_name}: "
+                              f"its identical source {os.path.basename(primary['path'])} failed")
+                continue
+            destination = os.path.join(duplicate_folder, os.path.splitext(os.path.basename(path))[0] + os.path.splitext(source_output)[1])
+            try:
+                os.makedirs(duplicate_folder, exist_ok=True)
+                method = link_output(source_output, destination)
+            except OSError as e:
+                errors.append(f"Failed to link the {format_name} output of {os.path.basename(path)}: {e}")
+                continue
+            if method != LINK_COPY:
+                saved_bytes += os.path.getsize(destination)
+            formats.append(format_name)
+            linked[format_name] = destination
+        for error in errors:
+            print(error)
+        if formats:
+            print(f"Dedupe: {os.path.basename(path)} linked to the {' and '.join(formats)} output of {primary['path']}")
+        status = "error" if errors else "success"
+        duplicate_results.append({"path": path, "status": status, "formats": formats, "errors": errors,
+                                  "outputs": linked, "deduplicated_from": primary['path']})
+
+    for format_name in [format_name for format_name in outputs if format_name not in info["formats"]]:
+        try:
+            os.remove(outputs[format_name]) # Encoded only for the duplicates
+        except OSError:
+            pass
+        del outputs[format_name]
+        if format_name in result["formats"]:
+            result["formats"].remove(format_name)
+    return duplicate_results, saved_bytes
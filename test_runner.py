@@ -1,6 +1,10 @@
 import os
 import sys
 import shutil # For cleaning up test files/dirs
+import time
+import json
+import subprocess
+import threading
 from unittest.mock import MagicMock # MagicMock can be used if specific assertions on call counts etc. are needed later
 
 # Attempt to ensure system PyQt5 modules are found
@@ -86,7 +90,8 @@ import multiple_videos_convert
 multiple_videos_convert.QMessageBox = MockQMessageBox
 
 # Now import the specific classes needed from the module
-from multiple_videos_convert import VideoConverterApp, QApplication
+from multiple_videos_convert import VideoConverterApp, QApplication, Qt
+import conversion_engine
 
 
 # --- Test Helper Functions ---
@@ -120,6 +125,24 @@ def cleanup_test_environment():
         shutil.rmtree(get_abs_path("test_files"))
     print("Test environment cleanup complete.")
 
+def run_conversion_and_wait(app_window, timeout=300):
+    """Start convert_videos() and pump the Qt event loop until the background batch finishes."""
+    app_window.convert_videos()
+    deadline = time.monotonic() + timeout
+    while app_window.is_converting() and time.monotonic() < deadline:
+        QApplication.processEvents()
+        time.sleep(0.01)
+    QApplication.processEvents()
+
+def add_folder_and_wait(app_window, folder, timeout=60):
+    """Start add_folder() and pump the Qt event loop until the background scan finishes."""
+    app_window.add_folder(test_folder=folder)
+    deadline = time.monotonic() + timeout
+    while app_window.is_scanning() and time.monotonic() < deadline:
+        QApplication.processEvents()
+        time.sleep(0.01)
+    QApplication.processEvents()
+
 def print_test_result(test_name, passed, details=""):
     status = "PASSED" if passed else "FAILED"
     print(f"Test: {test_name} - {status}")
@@ -133,8 +156,7 @@ def test_case_1_ui_interaction_file_addition(app_window):
     test_name = "Test Case 1: UI Interaction & File Addition"
     print(f"\n--- Running {test_name} ---")
     MockQMessageBox.reset_calls()
-    app_window.files_to_process = [] # Reset file list
-    app_window.file_list_widget.clear() # Clear UI list
+    app_window.clear_files() # Reset file list and UI list
     app_window.update_convert_button_state()
 
     initial_button_state = app_window.convert_button.isEnabled()
@@ -145,29 +167,28 @@ def test_case_1_ui_interaction_file_addition(app_window):
     app_window.add_files(test_files=[video1_path, video2_path])
     
     passed_add_files = len(app_window.files_to_process) == 2 and \
-                       app_window.files_to_process[0]['path'] == video1_path and \
-                       app_window.files_to_process[1]['path'] == video2_path and \
-                       app_window.files_to_process[0]['convert_ogg'] and app_window.files_to_process[0]['convert_webm'] and \
-                       app_window.files_to_process[1]['convert_ogg'] and app_window.files_to_process[1]['convert_webm']
+                       app_window.files_to_process[0].path == video1_path and \
+                       app_window.files_to_process[1].path == video2_path and \
+                       app_window.files_to_process[0].convert_ogg and app_window.files_to_process[0].convert_webm and \
+                       app_window.files_to_process[1].convert_ogg and app_window.files_to_process[1].convert_webm
     print_test_result(f"{test_name} - Add Files (video1, video2)", passed_add_files, f"Files in list: {len(app_window.files_to_process)}")
 
     button_state_after_add = app_window.convert_button.isEnabled()
     print_test_result(f"{test_name} - Convert Button Enabled After Add", button_state_after_add, f"Button state: {button_state_after_add}")
 
     dir1_path = get_abs_path("test_files/dir1")
-    app_window.add_folder(test_folder=dir1_path)
+    add_folder_and_wait(app_window, dir1_path)
     passed_add_folder_no_dupes = len(app_window.files_to_process) == 2
     print_test_result(f"{test_name} - Add Folder (dir1, no duplicates)", passed_add_folder_no_dupes, f"Files in list: {len(app_window.files_to_process)}")
 
     video3_path = get_abs_path("test_files/dir2/test_video3.mp4")
     dir2_path = get_abs_path("test_files/dir2")
-    app_window.add_folder(test_folder=dir2_path)
+    add_folder_and_wait(app_window, dir2_path)
     passed_add_folder_video3 = len(app_window.files_to_process) == 3 and \
-                               any(f['path'] == video3_path for f in app_window.files_to_process)
+                               any(f.path == video3_path for f in app_window.files_to_process)
     print_test_result(f"{test_name} - Add Folder (dir2, adds video3)", passed_add_folder_video3, f"Files in list: {len(app_window.files_to_process)}")
     
-    app_window.files_to_process = []
-    app_window.file_list_widget.clear()
+    app_window.clear_files()
     app_window.update_convert_button_state()
     final_button_state = app_window.convert_button.isEnabled()
     print_test_result(f"{test_name} - Convert Button Disabled After Clear", not final_button_state, f"Button state: {final_button_state}")
@@ -186,14 +207,13 @@ def test_case_2_format_selection_conversion(app_window):
     MockQMessageBox.reset_calls()
     cleanup_test_environment() 
     setup_test_environment() 
-    app_window.files_to_process = []
-    app_window.file_list_widget.clear()
+    app_window.clear_files()
     app_window.add_files(test_files=[video1_path, video2_path])
     app_window.update_conversion_choice(video1_path, 'webm', False) 
     app_window.update_conversion_choice(video2_path, 'ogg', False) 
     
-    print(f"  Pre-conversion files_to_process for Scenario 1: {app_window.files_to_process}")
-    app_window.convert_videos()
+    print(f"  Pre-conversion files_to_process for Scenario 1: {list(app_window.files_to_process)}")
+    run_conversion_and_wait(app_window)
 
     video1_ogg_exists = os.path.exists(get_abs_path("test_files/dir1/converted/test_video1.ogg"))
     video1_webm_exists = os.path.exists(get_abs_path("test_files/dir1/converted/test_video1.webm"))
@@ -214,14 +234,13 @@ def test_case_2_format_selection_conversion(app_window):
     MockQMessageBox.reset_calls()
     cleanup_test_environment() 
     setup_test_environment()   
-    app_window.files_to_process = []
-    app_window.file_list_widget.clear()
+    app_window.clear_files()
     app_window.add_files(test_files=[video1_path, video2_path])
     app_window.update_conversion_choice(video2_path, 'ogg', False)
     app_window.update_conversion_choice(video2_path, 'webm', False)
     
-    print(f"  Pre-conversion files_to_process for Scenario 2: {app_window.files_to_process}")
-    app_window.convert_videos()
+    print(f"  Pre-conversion files_to_process for Scenario 2: {list(app_window.files_to_process)}")
+    run_conversion_and_wait(app_window)
 
     video1_ogg_exists_s2 = os.path.exists(get_abs_path("test_files/dir1/converted/test_video1.ogg"))
     video1_webm_exists_s2 = os.path.exists(get_abs_path("test_files/dir1/converted/test_video1.webm"))
@@ -253,13 +272,12 @@ def test_case_2_format_selection_conversion(app_window):
         with open(get_abs_path("test_files/dir2/test_video3.mp4"), "w") as f:
             f.write("This is dummy MP4 content for video 3.")
 
-    app_window.files_to_process = [] 
-    app_window.file_list_widget.clear()
+    app_window.clear_files()
     app_window.add_files(test_files=[video3_path])
     app_window.update_conversion_choice(video3_path, 'webm', False)
     
-    print(f"  Pre-conversion files_to_process for Scenario 3: {app_window.files_to_process}")
-    app_window.convert_videos()
+    print(f"  Pre-conversion files_to_process for Scenario 3: {list(app_window.files_to_process)}")
+    run_conversion_and_wait(app_window)
 
     video3_ogg_exists_s3 = os.path.exists(get_abs_path("test_files/dir2/converted/test_video3.ogg"))
     video3_webm_exists_s3 = os.path.exists(get_abs_path("test_files/dir2/converted/test_video3.webm"))
@@ -279,13 +297,16 @@ def test_case_3_output_reporting(app_window):
     setup_test_environment()   
 
     video1_path = get_abs_path("test_files/dir1/test_video1.mp4")
-    app_window.files_to_process = []
-    app_window.file_list_widget.clear()
+    app_window.clear_files()
     app_window.add_files(test_files=[video1_path])
     # video1 has OGG=True, WebM=True by default
     
-    print(f"  Pre-conversion files_to_process for Reporting Test: {app_window.files_to_process}")
-    app_window.convert_videos() 
+    print(f"  Pre-conversion files_to_process for Reporting Test: {list(app_window.files_to_process)}")
+    app_window.preflight_checkbox.setChecked(False) # Let FFmpeg itself reject the dummy file
+    try:
+        run_conversion_and_wait(app_window)
+    finally:
+        app_window.preflight_checkbox.setChecked(True)
     
     reported_correctly = False
     if MockQMessageBox.calls:
@@ -303,6 +324,1630 @@ def test_case_3_output_reporting(app_window):
     
     print_test_result(f"{test_name} - Error Reporting for Dummy Files", reported_correctly)
 
+def test_case_4_single_decode_command(app_window):
+    test_name = "Test Case 4: Single-Decode OGG + WebM Command"
+    print(f"\n--- Running {test_name} ---")
+    video1_path = get_abs_path("test_files/dir1/test_video1.mp4")
+
+    command = conversion_engine.build_single_decode_command(
+        video1_path, "out.ogg", "out.webm", "scale=-2:720", "128k", 5, 30, 2
+    )
+    print(f"  Command: {' '.join(command)}")
+    passed_single_input = command.count("-i") == 1 and command[-1] == "out.webm" and "out.ogg" in command
+    print_test_result(f"{test_name} - One Input, Two Outputs", passed_single_input)
+
+    filter_graph = command[command.index("-filter_complex") + 1] if "-filter_complex" in command else ""
+    passed_scale_once = filter_graph.count("scale=-2:720") == 1 and "split=2" in filter_graph
+    print_test_result(f"{test_name} - Scale Applied Once Then Split", passed_scale_once, filter_graph)
+
+    ogg_args = command[:command.index("out.ogg")]
+    webm_args = command[command.index("out.ogg"):]
+    passed_codecs = "libtheora" in ogg_args and "libvorbis" in ogg_args and \
+                    "libvpx-vp9" in webm_args and "libopus" in webm_args
+    print_test_result(f"{test_name} - Per-Output Codecs", passed_codecs)
+
+    command_no_scale = conversion_engine.build_single_decode_command(
+        video1_path, "out.ogg", "out.webm", None, None, 5, 30, 2
+    )
+    passed_no_filter = "-filter_complex" not in command_no_scale and command_no_scale.count("0:v:0") == 2
+    print_test_result(f"{test_name} - Original Resolution Maps Decoded Stream Twice", passed_no_filter)
+
+def test_case_5_background_conversion(app_window):
+    test_name = "Test Case 5: Conversion Runs Off the GUI Thread"
+    print(f"\n--- Running {test_name} ---")
+    MockQMessageBox.reset_calls()
+    cleanup_test_environment()
+    setup_test_environment()
+
+    video1_path = get_abs_path("test_files/dir1/test_video1.mp4")
+    app_window.clear_files()
+    app_window.add_files(test_files=[video1_path])
+
+    app_window.convert_videos()
+    started_in_background = app_window.is_converting() and not app_window.convert_button.isEnabled()
+    print_test_result(f"{test_name} - convert_videos Returns While Batch Runs", started_in_background)
+
+    deadline = time.monotonic() + 300
+    while app_window.is_converting() and time.monotonic() < deadline:
+        QApplication.processEvents()
+        time.sleep(0.01)
+    QApplication.processEvents()
+
+    reported = any(call.get('title') == "Conversion Complete" for call in MockQMessageBox.calls)
+    passed_finish = reported and not app_window.is_converting() and app_window.convert_button.isEnabled() and \
+                    app_window.progress_bar.value() == app_window.progress_bar.maximum()
+    print_test_result(f"{test_name} - Summary Delivered Via Signals", passed_finish, f"Progress: {app_window.progress_bar.value()}")
+
+    # An exception from the engine is reported and the window is usable again (not an aborted app)
+    MockQMessageBox.reset_calls()
+    original_run = multiple_videos_convert.BatchRunner.run
+    def failing_run(runner):
+        raise RuntimeError("engine failure")
+    multiple_videos_convert.BatchRunner.run = failing_run
+    try:
+        app_window.convert_videos()
+        deadline = time.monotonic() + 30
+        while app_window.is_converting() and time.monotonic() < deadline:
+            QApplication.processEvents()
+            time.sleep(0.01)
+        QApplication.processEvents()
+    finally:
+        multiple_videos_convert.BatchRunner.run = original_run
+    failure = next((call for call in MockQMessageBox.calls if call.get('title') == "Conversion Failed"), {})
+    states = [job.state for job in app_window.job_store]
+    passed_failure = "engine failure" in failure.get('message', "") and not app_window.is_converting() and \
+                     app_window.convert_button.isEnabled() and multiple_videos_convert.JOB_RUNNING not in states
+    print_test_result(f"{test_name} - Engine Exception Reported, Window Reset", passed_failure, f"States: {states}")
+
+def test_case_6_concurrency_planning(app_window):
+    test_name = "Test Case 6: CPU-Aware Worker/Thread Scheduling"
+    print(f"\n--- Running {test_name} ---")
+    plan = conversion_engine.plan_concurrency
+
+    webm_8 = plan(["OGG", "WebM"], 100, cpu_count=8)
+    print_test_result(f"{test_name} - 8 CPUs Not Oversubscribed", webm_8[0] * webm_8[1] <= 8, f"Plan: {webm_8}")
+
+    webm_64 = plan(["WebM"], 100, cpu_count=64)
+    passed_64 = webm_64[1] <= conversion_engine.CODEC_THREAD_PROFILE["WebM"][1] and webm_64[0] * webm_64[1] <= 64
+    print_test_result(f"{test_name} - 64 CPUs Use More Jobs, Not More Threads", passed_64, f"Plan: {webm_64}")
+
+    ogg_8 = plan(["OGG"], 100, cpu_count=8)
+    print_test_result(f"{test_name} - Theora Runs More Concurrent Jobs Than VP9", ogg_8[0] > webm_8[0], f"OGG: {ogg_8}, WebM: {webm_8}")
+
+    tail = plan(["WebM"], 1, cpu_count=8)
+    print_test_result(f"{test_name} - Last Job Gets More Threads", tail[0] == 1 and tail[1] > webm_8[1], f"Plan: {tail}")
+
+    fixed = plan(["WebM"], 100, workers_setting=3, threads_setting=2, cpu_count=8)
+    print_test_result(f"{test_name} - Fixed Settings Respected", fixed == (3, 2), f"Plan: {fixed}")
+
+def test_case_7_incremental_manifest(app_window):
+    test_name = "Test Case 7: Incremental Manifest"
+    print(f"\n--- Running {test_name} ---")
+    cleanup_test_environment()
+    setup_test_environment()
+
+    dir1_path = get_abs_path("test_files/dir1")
+    video1_path = get_abs_path("test_files/dir1/test_video1.mp4")
+    converted_dir = os.path.join(dir1_path, "converted")
+    os.makedirs(converted_dir, exist_ok=True)
+    outputs = {}
+    for format_name, extension in (("OGG", ".ogg"), ("WebM", ".webm")):
+        outputs[format_name] = os.path.join(converted_dir, "test_video1" + extension)
+        with open(outputs[format_name], "w") as f:
+            f.write("dummy output")
+
+    options = {"resolution": "scale=-2:720", "audio_bitrate": "128k", "ogg_quality": 5, "webm_quality": 30}
+    manifest = conversion_engine.ConversionManifest(dir1_path)
+    manifest.record(video1_path, outputs, options)
+    manifest.save()
+
+    reloaded = conversion_engine.ConversionManifest(dir1_path)
+    stale_same = reloaded.formats_to_convert(video1_path, ["OGG", "WebM"], options)
+    print_test_result(f"{test_name} - Unchanged Source and Settings Skipped", stale_same == [], f"Stale: {stale_same}")
+
+    stale_crf = reloaded.formats_to_convert(video1_path, ["OGG", "WebM"], dict(options, webm_quality=20))
+    print_test_result(f"{test_name} - WebM Setting Change Re-encodes WebM Only", stale_crf == ["WebM"], f"Stale: {stale_crf}")
+
+    os.remove(outputs["OGG"])
+    stale_missing = reloaded.formats_to_convert(video1_path, ["OGG", "WebM"], options)
+    print_test_result(f"{test_name} - Missing Output Re-encoded", stale_missing == ["OGG"], f"Stale: {stale_missing}")
+
+    with open(video1_path, "a") as f:
+        f.write(" changed")
+    stale_changed = reloaded.formats_to_convert(video1_path, ["OGG", "WebM"], options)
+    print_test_result(f"{test_name} - Changed Source Re-encoded", stale_changed == ["OGG", "WebM"], f"Stale: {stale_changed}")
+
+def test_case_8_headless_cli(app_window):
+    test_name = "Test Case 8: Headless CLI"
+    print(f"\n--- Running {test_name} ---")
+    cleanup_test_environment()
+    setup_test_environment()
+    repo_dir = os.path.dirname(os.path.abspath(multiple_videos_convert.__file__))
+
+    no_qt = subprocess.run(
+        [sys.executable, "-c", "import sys, convert_cli; sys.exit(1 if 'PyQt5' in sys.modules else 0)"],
+        cwd=repo_dir
+    )
+    print_test_result(f"{test_name} - CLI Does Not Import PyQt5", no_qt.returncode == 0)
+
+    cli = subprocess.run(
+        [sys.executable, "-m", "convert_cli", get_abs_path("test_files/dir1"), "--formats", "ogg", "--json"],
+        cwd=repo_dir, capture_output=True, text=True
+    )
+    try:
+        summary = json.loads(cli.stdout)
+    except ValueError:
+        summary = {}
+    passed_json = cli.returncode == 1 and summary.get("total") == 2 and summary.get("files_with_errors") == 2 and \
+                  all(result["status"] == "error" for result in summary.get("results", []))
+    print_test_result(f"{test_name} - JSON Summary and Error Exit Code for Dummy Files", passed_json, f"Exit code: {cli.returncode}")
+
+    missing_preset = subprocess.run(
+        [sys.executable, "-m", "convert_cli", get_abs_path("test_files/dir1"), "--preset", "does-not-exist",
+         "--presets-file", get_abs_path("test_files/presets.json")],
+        cwd=repo_dir, capture_output=True, text=True
+    )
+    print_test_result(f"{test_name} - Unknown Preset Is a Usage Error", missing_preset.returncode == 2, f"Exit code: {missing_preset.returncode}")
+
+def test_case_9_recursive_scanner(app_window):
+    test_name = "Test Case 9: Recursive Folder Scanning"
+    print(f"\n--- Running {test_name} ---")
+    cleanup_test_environment()
+    setup_test_environment()
+    import file_scanner
+
+    nested_dir = get_abs_path("test_files/dir2/season1/disc1")
+    os.makedirs(nested_dir, exist_ok=True)
+    nested_video = os.path.join(nested_dir, "test_video4.mp4")
+    with open(nested_video, "w") as f:
+        f.write("This is dummy MP4 content for video 4.")
+    os.makedirs(get_abs_path("test_files/dir2/converted"), exist_ok=True)
+    with open(get_abs_path("test_files/dir2/converted/old_output.mp4"), "w") as f:
+        f.write("Not a source.")
+    os.symlink(get_abs_path("test_files/dir2"), get_abs_path("test_files/dir2/season1/loop"))
+
+    scanned = [path for batch in file_scanner.scan_media_files([get_abs_path("test_files")], follow_symlinks=True, batch_size=1) for path in batch]
+    unique = {file_scanner.normalize_path(path) for path in scanned}
+    passed_scan = len(scanned) == 4 and len(unique) == 4 and nested_video in scanned
+    print_test_result(f"{test_name} - Nested Files Found, Symlink Loop and converted/ Skipped", passed_scan, f"Found: {len(scanned)}")
+
+    top_level = [path for batch in file_scanner.scan_media_files([get_abs_path("test_files/dir2")], recursive=False) for path in batch]
+    print_test_result(f"{test_name} - Non-Recursive Scan", top_level == [get_abs_path("test_files/dir2/test_video3.mp4")], f"Found: {top_level}")
+
+    app_window.clear_files()
+    app_window.add_files(test_files=[get_abs_path("test_files/dir2/season1/loop/test_video3.mp4")])
+    add_folder_and_wait(app_window, get_abs_path("test_files/dir2"))
+    passed_realpath_dedupe = len(app_window.files_to_process) == 2
+    print_test_result(f"{test_name} - Symlinked Path Deduplicated by Real Path", passed_realpath_dedupe, f"Files in list: {len(app_window.files_to_process)}")
+    app_window.clear_files()
+
+def test_case_10_job_store(app_window):
+    test_name = "Test Case 10: Job Store"
+    print(f"\n--- Running {test_name} ---")
+    cleanup_test_environment()
+    setup_test_environment()
+    import job_store
+
+    video1_path = get_abs_path("test_files/dir1/test_video1.mp4")
+    video2_path = get_abs_path("test_files/dir1/test_video2.mp4")
+    video3_path = get_abs_path("test_files/dir2/test_video3.mp4")
+
+    store = job_store.JobStore()
+    job1 = store.add(video1_path)
+    job2 = store.add(video2_path, convert_ogg=False)
+    duplicate = store.add(get_abs_path("test_files/dir1/../dir1/test_video1.mp4"))
+    passed_lookup = duplicate is None and len(store) == 2 and job1.id != job2.id and \
+                    store.get(job2.id) is job2 and store.find(video1_path) is job1 and store.row_of(job2) == 1
+    print_test_result(f"{test_name} - Lookup by ID and Path, Duplicates Rejected", passed_lookup, f"Jobs: {list(store)}")
+    print_test_result(f"{test_name} - Jobs Use __slots__", not hasattr(job1, "__dict__"))
+
+    changed = store.set_format_all("ogg", True)
+    print_test_result(f"{test_name} - Select All OGG", changed == 1 and all(job.convert_ogg for job in store), f"Changed: {changed}")
+
+    store.mark_running(job1)
+    store.finish(job1, {"path": video1_path, "status": "error", "formats": [], "errors": ["boom"]})
+    store.finish(job2, {"path": video2_path, "status": "up_to_date", "formats": [], "errors": []})
+    job3 = store.add(video3_path)
+    passed_states = job1.state == job_store.JOB_FAILED and job1.errors == ["boom"] and job1.elapsed is not None and \
+                    job2.state == job_store.JOB_SKIPPED and job3.state == job_store.JOB_QUEUED
+    print_test_result(f"{test_name} - Result Statuses Map to Job States", passed_states, f"Jobs: {list(store)}")
+
+    removed = store.remove_finished()
+    passed_clear_finished = removed == 2 and list(store) == [job3] and store.row_of(job3) == 0 and \
+                            store.find(video1_path) is None and store.add(video1_path) is not None
+    print_test_result(f"{test_name} - Clear Finished Keeps Queued Jobs", passed_clear_finished, f"Removed: {removed}, Jobs: {list(store)}")
+
+    # Views see the old row count until beginInsertRows, and the announced rows are exactly the new jobs
+    import queue_model
+    model = queue_model.FileQueueModel()
+    model.add_paths([video1_path])
+    inserts = []
+    model.rowsAboutToBeInserted.connect(lambda parent, first, last: inserts.append(("before", model.rowCount(), first, last)))
+    model.rowsInserted.connect(lambda parent, first, last: inserts.append(("after", model.rowCount(), first, last)))
+    added = model.add_paths([video2_path, get_abs_path("test_files/dir1/../dir1/test_video1.mp4"), video3_path, video2_path])
+    nothing_added = model.add_paths([video1_path, video3_path])
+    passed_insert = [job.path for job in added] == [video2_path, video3_path] and nothing_added == [] and \
+                    inserts == [("before", 1, 1, 2), ("after", 3, 1, 2)]
+    print_test_result(f"{test_name} - Rows Announced Before the Store Grows, Duplicates Left Out", passed_insert, f"Inserts: {inserts}")
+
+    app_window.clear_files()
+    app_window.add_files(test_files=[video1_path, video2_path, video3_path])
+    app_window.select_all_format('webm', False)
+    app_window.update_conversion_choice(video2_path, 'webm', Qt.Checked)
+    webm_flags = [job.convert_webm for job in app_window.files_to_process]
+    print_test_result(f"{test_name} - GUI Bulk Selection Uses the Store", webm_flags == [False, True, False], f"WebM flags: {webm_flags}")
+
+    app_window.update_conversion_choice(video1_path, 'ogg', Qt.Unchecked)
+    app_window.update_conversion_choice(video3_path, 'ogg', Qt.Unchecked)
+    run_conversion_and_wait(app_window)
+    states = [job.state for job in app_window.files_to_process]
+    app_window.clear_finished()
+    passed_gui_clear = states == [job_store.JOB_QUEUED, job_store.JOB_FAILED, job_store.JOB_QUEUED] and \
+                       [job.path for job in app_window.files_to_process] == [video1_path, video3_path]
+    print_test_result(f"{test_name} - GUI Clear Finished", passed_gui_clear, f"States before clear: {states}")
+    app_window.clear_files()
+
+def test_case_11_segmented_encoding(app_window):
+    test_name = "Test Case 11: Segmented Encoding"
+    print(f"\n--- Running {test_name} ---")
+    cleanup_test_environment()
+    setup_test_environment()
+    import segmented
+
+    cut_points = segmented.choose_cut_points(100.0, 4, [0.0, 9.0, 24.0, 31.0, 52.0, 70.0, 77.0, 98.0])
+    print_test_result(f"{test_name} - Cut Points Snap to Nearest Keyframes", cut_points == [24.0, 52.0, 77.0], f"Cut points: {cut_points}")
+    print_test_result(f"{test_name} - Cut Points Without Keyframes", segmented.choose_cut_points(90.0, 3) == [30.0, 60.0])
+
+    chunk_command = segmented.build_chunk_command("piece.mkv", {"OGG": "c.ogg", "WebM": "c.webm"}, "scale=-2:480", 5, 30, 2)
+    passed_chunk = chunk_command.count("-i") == 1 and chunk_command.count("-an") == 2 and \
+                   "libvorbis" not in chunk_command and "libopus" not in chunk_command and \
+                   "split=2[v0][v1]" in chunk_command[chunk_command.index("-filter_complex") + 1]
+    print_test_result(f"{test_name} - Chunks Are Video Only, Decoded Once", passed_chunk, " ".join(chunk_command))
+
+    concat_command = segmented.build_concat_command("list.txt", "audio.mka", "out.ogg")
+    passed_concat = concat_command[concat_command.index("-c") + 1] == "copy" and "concat" in concat_command
+    print_test_result(f"{test_name} - Chunks Joined Without Re-encoding", passed_concat, " ".join(concat_command))
+
+    source_ends = {"v": 60.0, "a": 60.02}
+    passed_validation = segmented.validate_output(source_ends, {"v": 60.0, "a": 60.04}) == [] and \
+                        len(segmented.validate_output(source_ends, {"v": 60.0, "a": 60.5})) == 1 and \
+                        len(segmented.validate_output(source_ends, {"v": 58.0, "a": 58.02})) == 1
+    print_test_result(f"{test_name} - Duration and A/V Sync Validation", passed_validation)
+
+    # Chunk encoders come out of the batch's worker budget instead of multiplying it
+    shares = []
+    def recording_convert(path, convert_ogg, convert_webm, resolution, audio_bitrate, ogg_quality, webm_quality, threads,
+                          single_decode, progress_callback, segment_workers, **kwargs):
+        shares.append(segment_workers)
+        return {"path": path, "status": "success", "formats": ["OGG"], "errors": [], "outputs": {}}
+    options = conversion_engine.options_from_settings({"segmented": True, "preflight": False, "workers": "3", "threads": "1"})
+    all_tasks = [{'path': get_abs_path(f"test_files/dir1/test_video{i}.mp4"), 'convert_ogg': True, 'convert_webm': False} for i in (1, 2)] + \
+                [{'path': get_abs_path("test_files/dir2/test_video3.mp4"), 'convert_ogg': True, 'convert_webm': False}]
+    for tasks in (all_tasks, all_tasks[:1]):
+        conversion_engine.BatchRunner(tasks, options, recording_convert).run()
+    print_test_result(f"{test_name} - Chunk Workers Share the Batch Worker Budget", shares == [1, 1, 1, 3], f"Shares: {shares}")
+
+    video1_path = get_abs_path("test_files/dir1/test_video1.mp4")
+    print_test_result(f"{test_name} - Unreadable Input Falls Back to Single Pass",
+                      segmented.convert_segmented(video1_path, {"OGG": get_abs_path("test_files/dir1/x.ogg")}, None, None, 5, 30, 2) is None)
+
+    if not shutil.which("ffmpeg"):
+        print("  FFmpeg not found; skipping the segmented round trip.")
+        return
+    clip_path = get_abs_path("test_files/dir1/clip.mp4")
+    subprocess.run(
+        ["ffmpeg", "-v", "error", "-y", "-f", "lavfi", "-i", "testsrc2=size=160x90:rate=25", "-f", "lavfi",
+         "-i", "sine=frequency=440:sample_rate=48000", "-t", "8", "-c:v", "libx264", "-g", "25", "-c:a", "aac", "-shortest", clip_path],
+        check=True
+    )
+    output_folder = get_abs_path("test_files/dir1/converted")
+    os.makedirs(output_folder, exist_ok=True)
+    outputs = {"OGG": os.path.join(output_folder, "clip.ogg"), "WebM": os.path.join(output_folder, "clip.webm")}
+    progress = []
+    formats = segmented.convert_segmented(clip_path, outputs, None, "64k", 5, 50, 2, progress.append, min_duration=4, min_chunk_seconds=2)
+    source_ends = segmented.stream_end_times(clip_path)
+    output_ok = formats == ["OGG", "WebM"] and all(
+        not segmented.validate_output(source_ends, segmented.stream_end_times(path)) for path in outputs.values()
+    )
+    leftovers = [name for name in os.listdir(output_folder) if name.startswith(".")]
+    print_test_result(f"{test_name} - Round Trip Matches Source Duration and Sync", output_ok and not leftovers and bool(progress),
+                      f"Formats: {formats}, Leftovers: {leftovers}")
+
+def test_case_12_speed_profiles(app_window):
+    test_name = "Test Case 12: Encoder Speed Profiles"
+    print(f"\n--- Running {test_name} ---")
+
+    webm_args = conversion_engine.webm_video_args(30, 4, "balanced", "scale=-2:720")
+    passed_constant_quality = webm_args[webm_args.index("-b:v") + 1] == "0" and webm_args[webm_args.index("-row-mt") + 1] == "1"
+    print_test_result(f"{test_name} - Constant Quality and Row Multithreading", passed_constant_quality, " ".join(webm_args))
+
+    tiles = [conversion_engine.vp9_tile_columns(height) for height in (240, 480, 720, 1080, 2160)]
+    print_test_result(f"{test_name} - Tile Columns Follow Resolution", tiles == [0, 1, 2, 2, 3], f"Tiles: {tiles}")
+
+    realtime = conversion_engine.vp9_speed_args("realtime", 480)
+    archival = conversion_engine.vp9_speed_args("archival", 480)
+    passed_profiles = realtime[realtime.index("-deadline") + 1] == "realtime" and \
+                      int(realtime[realtime.index("-cpu-used") + 1]) > int(archival[archival.index("-cpu-used") + 1])
+    print_test_result(f"{test_name} - Realtime Faster Than Archival", passed_profiles, f"Realtime: {realtime}, Archival: {archival}")
+
+    ogg_args = conversion_engine.ogg_video_args(5, 2, "fast")
+    print_test_result(f"{test_name} - Theora Keyframe Interval From Profile", ogg_args[ogg_args.index("-g") + 1] == "64", " ".join(ogg_args))
+
+    options = conversion_engine.options_from_settings({"speed_profile": "no-such-profile"})
+    print_test_result(f"{test_name} - Unknown Profile Falls Back to Balanced", options["speed_profile"] == "balanced")
+
+    app_window.speed_profile_dropdown.setCurrentText("fast")
+    settings = app_window._get_current_quality_settings()
+    app_window.speed_profile_dropdown.setCurrentText("balanced")
+    print_test_result(f"{test_name} - Profile Saved With Presets", settings.get("speed_profile") == "fast", f"Settings: {settings}")
+
+def test_case_13_two_pass_webm(app_window):
+    test_name = "Test Case 13: Two-Pass WebM and First-Pass Cache"
+    print(f"\n--- Running {test_name} ---")
+    cleanup_test_environment()
+    setup_test_environment()
+    import firstpass_cache
+
+    video1_path = get_abs_path("test_files/dir1/test_video1.mp4")
+    cache_dir = get_abs_path("test_files/firstpass")
+    cache = firstpass_cache.FirstPassCache(cache_dir, max_bytes=8) # Room for one 5-byte log
+    key_480 = cache.key(video1_path, "scale=-2:480")
+    passed_key = key_480 != cache.key(video1_path, "scale=-2:720") and key_480 == cache.key(video1_path, "scale=-2:480")
+    print_test_result(f"{test_name} - Key Depends on Source and Scale Filter", passed_key)
+
+    miss = cache.lookup(key_480)
+    temp_prefix = cache.temp_prefix(key_480)
+    with open(temp_prefix + firstpass_cache.PASSLOG_SUFFIX, "w") as f:
+        f.write("stats")
+    cache.store(temp_prefix, key_480)
+    hit = cache.lookup(key_480)
+    print_test_result(f"{test_name} - Miss, Store, Hit", miss is None and hit == cache.prefix(key_480) and (cache.hits, cache.misses) == (1, 1),
+                      f"Hits: {cache.hits}, Misses: {cache.misses}")
+
+    old_log = cache.prefix(key_480) + firstpass_cache.PASSLOG_SUFFIX
+    os.utime(old_log, (1, 1)) # Least recently used
+    key_720 = cache.key(video1_path, "scale=-2:720")
+    temp_prefix = cache.temp_prefix(key_720)
+    with open(temp_prefix + firstpass_cache.PASSLOG_SUFFIX, "w") as f:
+        f.write("stats")
+    cache.store(temp_prefix, key_720)
+    passed_lru = not os.path.exists(old_log) and os.path.exists(cache.prefix(key_720) + firstpass_cache.PASSLOG_SUFFIX)
+    print_test_result(f"{test_name} - Least Recently Used Log Evicted Over Size Limit", passed_lru, f"Cache: {os.listdir(cache_dir)}")
+
+    firstpass = conversion_engine.build_firstpass_command(video1_path, "scale=-2:480", 30, 2, "balanced", "1M", "/tmp/log")
+    passed_firstpass = firstpass[firstpass.index("-pass") + 1] == "1" and firstpass[-1] == os.devnull and "-an" in firstpass and \
+                       firstpass[firstpass.index("-b:v") + 1] == "1M"
+    print_test_result(f"{test_name} - Pass 1 Writes Only the Log", passed_firstpass, " ".join(firstpass))
+
+    pass2 = conversion_engine.build_single_decode_command(
+        video1_path, "out.ogg", "out.webm", "scale=-2:480", "64k", 5, 30, 2, webm_extra_args=conversion_engine.webm_pass_args(2, "/tmp/log")
+    )
+    print_test_result(f"{test_name} - Pass-2 WebM Output Comes First", pass2.index("out.webm") < pass2.index("out.ogg"), " ".join(pass2))
+
+    options = conversion_engine.options_from_settings({"webm_two_pass": True, "webm_bitrate": "fast please"})
+    print_test_result(f"{test_name} - Malformed Bitrate Means Constant Quality", options["webm_bitrate"] is None)
+
+    if not shutil.which("ffmpeg"):
+        print("  FFmpeg not found; skipping the two-pass round trip.")
+        return
+    clip_path = get_abs_path("test_files/dir1/clip.mp4")
+    subprocess.run(
+        ["ffmpeg", "-v", "error", "-y", "-f", "lavfi", "-i", "testsrc2=size=160x90:rate=25", "-f", "lavfi",
+         "-i", "sine=frequency=440:sample_rate=48000", "-t", "2", "-c:v", "libx264", "-c:a", "aac", "-shortest", clip_path],
+        check=True
+    )
+    default_cache_dir = firstpass_cache.FIRSTPASS_CACHE_DIR
+    firstpass_cache.FIRSTPASS_CACHE_DIR = os.path.join(cache_dir, "batch")
+    try:
+        summaries = []
+        for bitrate in ("100k", "50k"):
+            options = conversion_engine.options_from_settings({"resolution": "Original", "webm_two_pass": True, "webm_bitrate": bitrate,
+                                                               "speed_profile": "realtime"})
+            tasks = [{'path': clip_path, 'convert_ogg': True, 'convert_webm': True}]
+            summaries.append(conversion_engine.BatchRunner(tasks, options).run())
+    finally:
+        firstpass_cache.FIRSTPASS_CACHE_DIR = default_cache_dir
+    counts = [(summary["firstpass_cache_hits"], summary["firstpass_cache_misses"]) for summary in summaries]
+    passed_round_trip = counts == [(0, 1), (1, 0)] and all(summary["successful_webm"] == 1 for summary in summaries)
+    print_test_result(f"{test_name} - Second Bitrate Reuses Pass 1", passed_round_trip, f"(hits, misses) per batch: {counts}")
+
+    # A pass-1 log that cannot be cached is used for the file alone instead of failing the WebM output
+    class UnwritableCache(firstpass_cache.FirstPassCache):
+        def store(self, temp_prefix, key):
+            raise OSError(28, "No space left on device")
+    not_a_folder = os.path.join(cache_dir, "not_a_folder")
+    with open(not_a_folder, "w") as f:
+        f.write("")
+    results = [conversion_engine.convert_video(clip_path, False, True, None, "64k", 5, 40, 1, speed_profile="realtime", two_pass=True,
+                                               webm_bitrate="50k", firstpass_cache=cache)
+               for cache in (UnwritableCache(os.path.join(cache_dir, "full")), firstpass_cache.FirstPassCache(not_a_folder))]
+    converted_dir = os.path.join(os.path.dirname(clip_path), "converted")
+    leftovers = [name for name in os.listdir(converted_dir) if name.startswith(".")] + \
+                [name for name in os.listdir(os.path.join(cache_dir, "full")) if firstpass_cache.PASSLOG_SUFFIX in name]
+    passed_uncached = all(result["status"] == "success" and result["formats"] == ["WebM"] for result in results) and not leftovers
+    print_test_result(f"{test_name} - Uncacheable Pass-1 Log Used Uncached", passed_uncached, f"Results: {results}, leftovers: {leftovers}")
+
+def test_case_14_preflight_planner(app_window):
+    test_name = "Test Case 14: Pre-flight Media Inspection"
+    print(f"\n--- Running {test_name} ---")
+    MockQMessageBox.reset_calls()
+    cleanup_test_environment()
+    setup_test_environment()
+    import media_probe
+
+    small_video = {"duration": 5.0, "video": {"codec": "h264", "width": 640, "height": 480}, "audio": None}
+    task = {'path': "small.mp4", 'convert_ogg': True, 'convert_webm': True}
+    planned = media_probe.plan_task(task, small_video, "scale=-2:1080")
+    passed_no_upscale = planned["resolution"] is None and planned["has_audio"] is False and \
+                        media_probe.plan_task(task, small_video, "scale=-2:480")["resolution"] is None and \
+                        media_probe.plan_task(task, small_video, "scale=-2:360")["resolution"] == "scale=-2:360"
+    print_test_result(f"{test_name} - No Upscale, No-Op Scale Dropped, Absent Audio Dropped", passed_no_upscale, f"Planned: {planned}")
+    print_test_result(f"{test_name} - Audio-Only File Is Unreadable",
+                      media_probe.plan_task(task, {"duration": 5.0, "video": None, "audio": {"codec": "aac"}}, None) is None)
+
+    saved_path = os.environ.get("PATH", "")
+    os.environ["PATH"] = get_abs_path("test_files/empty-path") # Neither ffprobe nor ffmpeg can be run
+    try:
+        dummy_task = {'path': get_abs_path("test_files/dir1/test_video1.mp4"), 'convert_ogg': True, 'convert_webm': False}
+        no_ffmpeg_index = media_probe.ProbeIndex(get_abs_path("test_files/no-ffmpeg-index.json"))
+        unprobed, rejected = media_probe.preflight([dummy_task], "scale=-2:480", no_ffmpeg_index)
+        options = conversion_engine.options_from_settings({"workers": "1", "threads": "1"})
+        summary = conversion_engine.BatchRunner([dummy_task], options).run()
+    finally:
+        os.environ["PATH"] = saved_path
+    passed_missing = unprobed == [dummy_task] and rejected == [] and not no_ffmpeg_index.entries and \
+                     summary["ffmpeg_missing"] and summary["files_with_errors"] == 1 and \
+                     summary["error_details"][0] == "FFmpeg not found: install it or add it to PATH"
+    print_test_result(f"{test_name} - Missing FFmpeg Fails Each File, Reported Once", passed_missing,
+                      f"Errors: {summary['error_details']}")
+
+    if not shutil.which("ffmpeg"):
+        print("  FFmpeg not found; skipping the probe tests.")
+        return
+    short_clip = get_abs_path("test_files/dir1/short.mp4")
+    long_clip = get_abs_path("test_files/dir1/long.mp4")
+    for clip_path, seconds in ((short_clip, "1"), (long_clip, "2")):
+        subprocess.run(
+            ["ffmpeg", "-v", "error", "-y", "-f", "lavfi", "-i", "testsrc2=size=160x90:rate=25", "-t", seconds,
+             "-c:v", "libx264", clip_path],
+            check=True
+        )
+    index_path = get_abs_path("test_files/media-index.json")
+    index = media_probe.ProbeIndex(index_path)
+    info = index.probe(long_clip)
+    index.probe(long_clip)
+    index.save()
+    reloaded = media_probe.ProbeIndex(index_path)
+    passed_index = info is not None and info["video"]["height"] == 90 and info["audio"] is None and \
+                   (index.hits, index.misses) == (1, 1) and reloaded.probe(long_clip) == info and reloaded.hits == 1
+    print_test_result(f"{test_name} - Probe Results Cached on Disk", passed_index, f"Info: {info}")
+
+    # Vanished files and the least recently used entries over the cap are dropped when the index is saved
+    pruned_path = get_abs_path("test_files/pruned-index.json")
+    pruned = media_probe.ProbeIndex(pruned_path, max_entries=2)
+    pruned.entries["/no/such/video.mp4"] = {"size": 1, "mtime_ns": 1, "info": None, "used": time.time() + 60}
+    for clip_path in (short_clip, long_clip, get_abs_path("test_files/dir1/test_video1.mp4")):
+        pruned.probe(clip_path)
+        time.sleep(0.01)
+    pruned.probe(short_clip) # Used again: more recent than long_clip
+    pruned.save()
+    kept = sorted(media_probe.ProbeIndex(pruned_path).entries)
+    leftovers = [name for name in os.listdir(get_abs_path("test_files")) if ".tmp" in name]
+    passed_prune = kept == sorted([os.path.realpath(short_clip), os.path.realpath(get_abs_path("test_files/dir1/test_video1.mp4"))]) and \
+                   not leftovers and media_probe.shared_probe_index() is media_probe.shared_probe_index()
+    print_test_result(f"{test_name} - Index Pruned and Capped on Save, One Index per Process", passed_prune,
+                      f"Kept: {kept}, leftovers: {leftovers}")
+
+    dummy_path = get_abs_path("test_files/dir1/test_video1.mp4")
+    tasks = [{'path': path, 'convert_ogg': True, 'convert_webm': False} for path in (short_clip, dummy_path, long_clip)]
+    planned, unreadable = media_probe.preflight(tasks, "scale=-2:480", media_probe.ProbeIndex(index_path))
+    passed_plan = [t['path'] for t in planned] == [short_clip, long_clip] and [t['path'] for t in unreadable] == [dummy_path] and \
+                  [t['duration'] for t in planned] == [1.0, 2.0] and all(t['height'] == 90 for t in planned)
+    print_test_result(f"{test_name} - Unreadable Files Rejected, Durations Planned", passed_plan,
+                      f"Planned: {[(os.path.basename(t['path']), t['duration']) for t in planned]}")
+
+    default_index_file = media_probe.PROBE_INDEX_FILE
+    media_probe.PROBE_INDEX_FILE = index_path
+    try:
+        app_window.clear_files()
+        app_window.add_files(test_files=[dummy_path, short_clip])
+        app_window.select_all_format("ogg", True)
+        app_window.select_all_format("webm", False)
+        run_conversion_and_wait(app_window)
+    finally:
+        media_probe.PROBE_INDEX_FILE = default_index_file
+    message = MockQMessageBox.calls[-1]['message'] if MockQMessageBox.calls else ""
+    output_info = media_probe.probe_media(os.path.join(os.path.dirname(short_clip), "converted", "short.ogg"))
+    passed_gui = "Successfully converted to OGG: 1 file(s)" in message and "test_video1.mp4: not a readable video" in message and \
+                 output_info is not None and output_info["video"]["height"] == 90 and output_info["audio"] is None
+    print_test_result(f"{test_name} - Batch Skips Unreadable File, Keeps Source Size, No Audio", passed_gui,
+                      f"Message: {message}\n  Output: {output_info}")
+
+def test_case_15_lpt_scheduling(app_window):
+    test_name = "Test Case 15: Longest-Job-First Scheduling"
+    print(f"\n--- Running {test_name} ---")
+    cleanup_test_environment()
+    setup_test_environment()
+    import queue_model
+    import scheduler
+
+    def task(name, duration, ogg=True, webm=False, **extra):
+        return dict({'path': name, 'convert_ogg': ogg, 'convert_webm': webm, 'duration': duration}, **extra)
+
+    cost = scheduler.estimate_cost
+    passed_cost = cost(task("a", 60, ogg=False, webm=True), None) > cost(task("a", 60), None) and \
+                  cost(task("a", 120), None) > cost(task("a", 60), None) and \
+                  cost(task("a", 60), "scale=-2:1080") > cost(task("a", 60), "scale=-2:480") and \
+                  cost(task("a", 60, resolution=None, height=480), "scale=-2:1080") < cost(task("a", 60), "scale=-2:1080")
+    print_test_result(f"{test_name} - Cost From Duration, Resolution and Codec", passed_cost)
+
+    video1_path = get_abs_path("test_files/dir1/test_video1.mp4")
+    size_only = {'path': video1_path, 'convert_ogg': True, 'convert_webm': False}
+    print_test_result(f"{test_name} - Cost From File Size Without a Probe",
+                      cost(size_only, None) == os.path.getsize(video1_path) / scheduler.FALLBACK_BYTES_PER_SECOND)
+
+    queue = scheduler.JobScheduler()
+    for name, estimate, priority in (("short", 1, 0), ("long", 5, 0), ("medium", 3, 0), ("urgent", 0.5, 2)):
+        queue.push({'path': name}, estimate, priority)
+    queue.set_priority("medium", 1)
+    order = [queue.pop()['path'] for _ in range(4)]
+    passed_order = order == ["urgent", "medium", "long", "short"] and queue.pop() is None and not queue.set_priority("long", 9)
+    print_test_result(f"{test_name} - Priority, Then Longest First", passed_order, f"Order: {order}")
+
+    passed_bound = scheduler.makespan_lower_bound([4, 1, 1], 2) == 4 and scheduler.makespan_lower_bound([2, 2, 2, 2], 2) == 4 and \
+                   scheduler.makespan_lower_bound([], 4) == 0.0
+    print_test_result(f"{test_name} - Makespan Lower Bound", passed_bound)
+
+    def fake_convert(path, convert_ogg, convert_webm, *args, **kwargs):
+        time.sleep(durations[path])
+        return {"path": path, "status": "success", "formats": ["OGG"], "errors": []}
+
+    # FIFO would run "huge" last: 0.2s of short jobs, then 0.6s alone
+    durations = {"s1": 0.1, "s2": 0.1, "s3": 0.1, "s4": 0.1, "huge": 0.6}
+    tasks = [task(name, seconds * 100) for name, seconds in durations.items()]
+    options = conversion_engine.options_from_settings({"workers": "2", "threads": "1", "preflight": False})
+    started = []
+    summary = conversion_engine.BatchRunner(tasks, options, fake_convert, on_file_started=started.append).run()
+    passed_lpt = started[0] == "huge" and summary["workers"] == 2 and \
+                 summary["makespan_lower_bound_seconds"] >= 0.6 and summary["makespan_seconds"] < 0.75
+    print_test_result(f"{test_name} - Longest Job Dispatched First, Makespan Reported", passed_lpt,
+                      f"Started: {started}, makespan {summary['makespan_seconds']:.2f}s, bound {summary['makespan_lower_bound_seconds']:.2f}s")
+
+    durations = {"first": 0.05, "second": 0.01, "third": 0.01}
+    tasks = [task("first", 3), task("second", 2), task("third", 1)]
+    options = conversion_engine.options_from_settings({"workers": "1", "threads": "1", "preflight": False})
+    started = []
+    runner = conversion_engine.BatchRunner(tasks, options, fake_convert)
+
+    def on_started(path):
+        started.append(path)
+        if path == "first":
+            runner.set_priority("third", 5) # Reorder while queued
+    runner.on_file_started = on_started
+    runner.run()
+    print_test_result(f"{test_name} - Pending Job Reprioritized During Batch", started == ["first", "third", "second"], f"Started: {started}")
+
+    app_window.clear_files()
+    paths = [get_abs_path("test_files/dir1/test_video1.mp4"), get_abs_path("test_files/dir1/test_video2.mp4"),
+             get_abs_path("test_files/dir2/test_video3.mp4")]
+    app_window.add_files(test_files=paths)
+    app_window.file_view.selectRow(2)
+    app_window.prioritize_selected(True)
+    app_window.file_view.selectRow(0)
+    app_window.prioritize_selected(False)
+    priorities = [task['priority'] for task in app_window.job_store.tasks()]
+    model = app_window.file_model
+    shown = [model.data(model.index(row, queue_model.COLUMN_PRIORITY)) for row in range(3)]
+    print_test_result(f"{test_name} - GUI Run First / Run Last Set Priorities", priorities == [-1, 0, 1] and shown == priorities,
+                      f"Priorities: {priorities}, shown: {shown}")
+    app_window.clear_files()
+
+def test_case_16_cancel_pause_resume(app_window):
+    test_name = "Test Case 16: Cancel, Pause and Resumable Batches"
+    print(f"\n--- Running {test_name} ---")
+    MockQMessageBox.reset_calls()
+    cleanup_test_environment()
+    setup_test_environment()
+    import batch_control
+    import batch_journal
+
+    partial = conversion_engine.partial_output_path("/videos/converted/clip.webm")
+    print_test_result(f"{test_name} - Partial Output Is Hidden and Keeps Its Extension", partial == "/videos/converted/.clip.partial.webm", partial)
+
+    if batch_control.PAUSE_SUPPORTED and os.path.exists("/proc/self/stat"):
+        def process_state(process):
+            with open(f"/proc/{process.pid}/stat") as f:
+                return f.read().rsplit(")", 1)[1].split()[0]
+        process = subprocess.Popen(["sleep", "30"])
+        control = batch_control.JobControl()
+        control.attach(process)
+        control.pause()
+        time.sleep(0.2)
+        paused_state = process_state(process)
+        control.resume()
+        time.sleep(0.2)
+        resumed_state = process_state(process)
+        control.pause()
+        control.cancel() # Terminating a stopped process continues it so it can exit
+        returncode = process.wait(timeout=5)
+        print_test_result(f"{test_name} - Processes Stopped, Continued and Terminated", paused_state == "T" and resumed_state == "S" and returncode != 0,
+                          f"States: {paused_state} -> {resumed_state}, exit {returncode}")
+
+    def fake_convert(path, convert_ogg, convert_webm, *args, control=None, **kwargs):
+        time.sleep(0.1)
+        return {"path": path, "status": "success", "formats": ["OGG"], "errors": []}
+
+    def task(name, duration):
+        return {'path': name, 'convert_ogg': True, 'convert_webm': False, 'duration': duration}
+
+    options = conversion_engine.options_from_settings({"workers": "1", "threads": "1", "preflight": False})
+    started = []
+    runner = conversion_engine.BatchRunner([task("a", 3), task("b", 2), task("c", 1)], options, fake_convert)
+
+    def on_started(path):
+        started.append(path)
+        if path == "a":
+            runner.cancel_job("b")
+    runner.on_file_started = on_started
+    summary = runner.run()
+    statuses = {result['path']: result['status'] for result in summary['results']}
+    print_test_result(f"{test_name} - Queued Job Cancelled Before It Starts",
+                      started == ["a", "c"] and statuses["b"] == "cancelled" and summary['cancelled'] == 1, f"Started: {started}")
+
+    started = []
+    runner = conversion_engine.BatchRunner([task("a", 2), task("b", 1)], options, fake_convert)
+    runner.on_file_started = lambda path: (started.append(path), runner.pause() if path == "a" else None)
+    batch = threading.Thread(target=runner.run)
+    batch.start()
+    time.sleep(0.5)
+    held = list(started)
+    runner.resume()
+    batch.join(10)
+    print_test_result(f"{test_name} - Paused Batch Holds Back Queued Jobs", held == ["a"] and started == ["a", "b"], f"While paused: {held}")
+
+    journal_dir = get_abs_path("test_files/journal")
+    journal = batch_journal.BatchJournal("test", journal_dir)
+    tasks = [task("a", 2), task("b", 1), task("c", 1), task("e", 1)]
+    journal.start(tasks, options)
+    journal.record({"path": "a", "status": "success"})
+    journal.record({"path": "b", "status": "error"})
+    journal.record({"path": "e", "status": "cancelled"}) # Cancelled on its own, or stopped by the crash
+    with open(journal.path, "a") as f:
+        f.write('{"event": "file", "path": "c", "sta') # Torn write at the moment of the crash
+
+    # An overlapping batch gets its own journal, and a running batch's journal is not offered for resume
+    other = batch_journal.BatchJournal("test", journal_dir)
+    other.start([task("d", 1)], options)
+    running_hidden = [j.path for j in batch_journal.interrupted_journals("test", journal_dir)] == []
+    journal.close() # The first batch's process dies
+    found = batch_journal.interrupted_journals("test", journal_dir)
+    other.finish()
+    passed_overlap = other.path != journal.path and running_hidden and [j.path for j in found] == [journal.path] and \
+                     os.path.exists(journal.path) and not os.path.exists(other.path)
+    print_test_result(f"{test_name} - Overlapping Batches Keep Separate Journals", passed_overlap,
+                      f"Interrupted: {[j.path for j in found]}")
+
+    resumed = found[0] if found else batch_journal.BatchJournal("test", journal_dir)
+    interrupted = resumed.load()
+    passed_load = interrupted is not None and [t['path'] for t in interrupted['tasks']] == ["b", "c", "e"] and \
+                  interrupted['finished'] == 1 and interrupted['options'] == options
+    print_test_result(f"{test_name} - Journal Resumes Unfinished, Failed and Cancelled Files", passed_load, f"Loaded: {interrupted}")
+
+    if interrupted is not None:
+        conversion_engine.BatchRunner(interrupted['tasks'], interrupted['options'], fake_convert, journal=resumed).run()
+    print_test_result(f"{test_name} - Journal Removed When the Batch Ends", not os.path.exists(journal.path))
+
+    if not shutil.which("ffmpeg"):
+        print("  FFmpeg not found; skipping the GUI cancel and resume tests.")
+        return
+    clip_path = get_abs_path("test_files/dir1/long_clip.mp4")
+    short_path = get_abs_path("test_files/dir2/short_clip.mp4")
+    for path, seconds in ((clip_path, "60"), (short_path, "1")):
+        subprocess.run(
+            ["ffmpeg", "-v", "error", "-y", "-f", "lavfi", "-i", "testsrc2=size=320x180:rate=25", "-t", seconds,
+             "-c:v", "libx264", path],
+            check=True
+        )
+    default_journal_dir = batch_journal.JOURNAL_DIR
+    batch_journal.JOURNAL_DIR = journal_dir
+    try:
+        app_window.clear_files()
+        app_window.add_files(test_files=[clip_path])
+        app_window.convert_videos()
+        job = app_window.job_store.find(clip_path)
+        deadline = time.monotonic() + 30
+        while job.progress <= 0 and time.monotonic() < deadline:
+            QApplication.processEvents()
+            time.sleep(0.01)
+        app_window.cancel_conversion()
+        deadline = time.monotonic() + 60
+        while app_window.is_converting() and time.monotonic() < deadline:
+            QApplication.processEvents()
+            time.sleep(0.01)
+        QApplication.processEvents()
+        message = MockQMessageBox.calls[-1]['message'] if MockQMessageBox.calls else ""
+        converted_dir = os.path.join(os.path.dirname(clip_path), "converted")
+        leftovers = os.listdir(converted_dir) if os.path.isdir(converted_dir) else []
+        print_test_result(f"{test_name} - GUI Cancel Stops FFmpeg and Leaves No Partial Files",
+                          "Cancelled: 1 file(s)" in message and job.state == "cancelled" and not leftovers,
+                          f"State: {job.state}, converted/: {leftovers}")
+
+        # A crash mid-batch leaves the journal behind
+        crashed = batch_journal.BatchJournal("gui")
+        crashed.start([{'path': clip_path, 'convert_ogg': True, 'convert_webm': False},
+                       {'path': short_path, 'convert_ogg': True, 'convert_webm': False}], options)
+        crashed.record({"path": clip_path, "status": "success"})
+        crashed.close()
+        app_window.clear_files()
+        resume_enabled = app_window.resume_batch_button.isEnabled()
+        app_window.resume_interrupted_batch()
+        deadline = time.monotonic() + 120
+        while app_window.is_converting() and time.monotonic() < deadline:
+            QApplication.processEvents()
+            time.sleep(0.01)
+        QApplication.processEvents()
+        queued = [job.path for job in app_window.files_to_process]
+        short_output = os.path.join(os.path.dirname(short_path), "converted", "short_clip.ogg")
+        print_test_result(f"{test_name} - GUI Resumes Only Unfinished Files",
+                          resume_enabled and queued == [short_path] and os.path.exists(short_output) and
+                          not app_window.resume_batch_button.isEnabled(), f"Queued: {queued}")
+    finally:
+        batch_journal.JOURNAL_DIR = default_journal_dir
+        app_window.clear_files()
+
+def test_case_17_benchmark_suite(app_window):
+    test_name = "Test Case 17: Benchmark Suite"
+    print(f"\n--- Running {test_name} ---")
+    cleanup_test_environment()
+    setup_test_environment()
+    import benchmark
+
+    configs = benchmark.benchmark_matrix(["480p", "720p"], [1, 2], [1, "auto"], ["fast", "balanced"], ["ogg"], seconds=1)
+    passed_matrix = len(configs) == 16 and all(config["jobs"] == 2 for config in configs) and \
+                    {config["threads"] for config in configs} == {1, "auto"}
+    print_test_result(f"{test_name} - Resolution x Workers x Threads x Profile Matrix", passed_matrix, f"{len(configs)} configurations")
+
+    bench_dir = get_abs_path("test_files/bench")
+    configs = benchmark.benchmark_matrix(["480p"], [1], [1], ["realtime"], ["ogg"], seconds=1)
+    results = benchmark.run_benchmark(configs, os.path.join(bench_dir, "clips"), progress=lambda message: None)
+    result = results[0]
+    passed_run = result.get("errors") == 0 and result["wall_seconds"] > 0 and result["output_bytes"] > 0 and \
+                 result["speed_factor"] > 0 and result["cpu_seconds"] > 0 and result["peak_rss_kb"] > 0 and \
+                 os.path.exists(os.path.join(bench_dir, "clips", "bench_480p_1s.mp4"))
+    print_test_result(f"{test_name} - Synthetic Clip Converted and Measured", passed_run, f"Result: {result}")
+
+    json_path, csv_path = benchmark.write_results(results, os.path.join(bench_dir, "out"))
+    with open(json_path, "r") as f:
+        written = json.load(f)
+    with open(csv_path, "r") as f:
+        csv_lines = f.read().splitlines()
+    passed_files = written["results"] == results and "480p ogg" in written["best"] and written["machine"]["cpu_count"] and \
+                   csv_lines[0] == ",".join(benchmark.RESULT_FIELDS) and len(csv_lines) == 2
+    print_test_result(f"{test_name} - Results Written as JSON and CSV", passed_files)
+
+    slow = dict(result, workers=2, speed_factor=result["speed_factor"] / 2)
+    fast = dict(result, workers=3, speed_factor=result["speed_factor"] * 2)
+    best = benchmark.best_configs([result, slow, fast, dict(fast, workers=4, errors=1, speed_factor=100.0)])
+    passed_best = best["480p ogg"]["workers"] == 3
+    print_test_result(f"{test_name} - Best Configuration Per Resolution", passed_best)
+
+    baseline = [dict(result, speed_factor=result["speed_factor"] * 1.05), dict(slow, speed_factor=result["speed_factor"])]
+    regressions = benchmark.find_regressions([result, slow], baseline)
+    passed_regressions = [entry["workers"] for entry, _ in regressions] == [2]
+    print_test_result(f"{test_name} - Slower Configurations Reported as Regressions", passed_regressions, f"Regressions: {regressions}")
+
+    with open(os.path.join(bench_dir, "baseline.json"), "w") as f:
+        json.dump({"results": [dict(result, speed_factor=1000.0)]}, f)
+    cli = subprocess.run(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark.py"),
+         "--resolutions", "480p", "--workers", "1", "--threads", "1", "--profiles", "realtime", "--formats", "ogg",
+         "--seconds", "1", "--clip-dir", os.path.join(bench_dir, "clips"), "--output-dir", os.path.join(bench_dir, "cli"),
+         "--compare", os.path.join(bench_dir, "baseline.json")],
+        capture_output=True, text=True
+    )
+    passed_cli = cli.returncode == 1 and "Regression: 480p ogg" in cli.stdout and \
+                 os.path.exists(os.path.join(bench_dir, "cli", "benchmark.csv"))
+    print_test_result(f"{test_name} - CLI Fails on Regression", passed_cli, f"Exit code {cli.returncode}: {cli.stdout[-300:]}{cli.stderr[-300:]}")
+
+def test_case_18_job_metrics(app_window):
+    test_name = "Test Case 18: Per-Job Resource Metrics"
+    print(f"\n--- Running {test_name} ---")
+    cleanup_test_environment()
+    setup_test_environment()
+    import job_metrics
+
+    process = subprocess.Popen(
+        [sys.executable, "-c", "import sys; sum(range(3000000)); sys.stdout.write('x' * 100000); sys.exit(3)"],
+        stdout=subprocess.DEVNULL
+    )
+    returncode, usage = job_metrics.wait_with_usage(process)
+    passed_wait = returncode == 3 and process.returncode == 3 and usage["user_cpu"] + usage["system_cpu"] > 0 and \
+                  usage["peak_rss_kb"] > 0 and usage["written_bytes"] >= 100000 and usage["read_bytes"] > 0
+    print_test_result(f"{test_name} - CPU, Peak RSS and I/O of a Reaped Process", passed_wait, f"Exit {returncode}, usage {usage}")
+
+    job_usage = job_metrics.JobUsage()
+    job_usage.add({"user_cpu": 1.0, "system_cpu": 0.5, "peak_rss_kb": 100, "read_bytes": 10, "written_bytes": None})
+    job_usage.add({"user_cpu": 2.0, "system_cpu": 0.5, "peak_rss_kb": 300, "read_bytes": 5, "written_bytes": 7})
+    job_usage.add(None)
+    totals = job_usage.as_dict()
+    passed_sum = totals == {"processes": 2, "user_cpu_seconds": 3.0, "system_cpu_seconds": 1.0, "peak_rss_kb": 300,
+                            "read_bytes": 15, "written_bytes": 7}
+    print_test_result(f"{test_name} - Usage Summed Over a Job's Processes", passed_sum, f"Totals: {totals}")
+
+    # Ctrl+C while two jobs run: the running gauge drops back to 0 instead of staying at 2
+    interrupted_prometheus = get_abs_path("test_files/interrupted.prom")
+    recorder = job_metrics.MetricsRecorder(get_abs_path("test_files/interrupted.jsonl"), interrupted_prometheus)
+    release = threading.Event()
+    def blocking_convert(path, *args, **kwargs):
+        release.wait(10)
+        return {"path": path, "status": "cancelled", "formats": [], "errors": []}
+    started = []
+    def interrupt_second(path):
+        started.append(path)
+        if len(started) == 2:
+            release.set()
+            raise KeyboardInterrupt
+    options = conversion_engine.options_from_settings({"workers": "2", "threads": "1", "preflight": False})
+    tasks = [{'path': get_abs_path(f"test_files/dir1/test_video{i}.mp4"), 'convert_ogg': True, 'convert_webm': False} for i in (1, 2)]
+    interrupted = False
+    try:
+        conversion_engine.BatchRunner(tasks, options, blocking_convert, on_file_started=interrupt_second, metrics=recorder).run()
+    except KeyboardInterrupt:
+        interrupted = True
+    with open(interrupted_prometheus, "r") as f:
+        exported = f.read().splitlines()
+    with open(get_abs_path("test_files/interrupted.jsonl"), "r") as f:
+        kinds = [json.loads(line)["event"] for line in f]
+    passed_interrupted = interrupted and recorder.running == 0 and "mp4_converter_jobs_running 0" in exported and \
+                         kinds == ["job_started", "job_started", "job_abandoned", "job_abandoned"]
+    print_test_result(f"{test_name} - Interrupted Batch Leaves No Running Jobs in the Textfile", passed_interrupted,
+                      f"Running: {recorder.running}, events: {kinds}")
+
+    if not shutil.which("ffmpeg"):
+        print("  FFmpeg not found; skipping the metrics export tests.")
+        return
+    clip_path = get_abs_path("test_files/dir1/metrics_clip.mp4")
+    subprocess.run(
+        ["ffmpeg", "-v", "error", "-y", "-f", "lavfi", "-i", "testsrc2=size=160x90:rate=25", "-f", "lavfi",
+         "-i", "sine=frequency=440", "-t", "2", "-c:v", "libx264", "-c:a", "aac", "-shortest", clip_path],
+        check=True
+    )
+    events_path = get_abs_path("test_files/metrics.jsonl")
+    prometheus_path = get_abs_path("test_files/converter.prom")
+    recorder = job_metrics.MetricsRecorder(events_path, prometheus_path, progress_interval=0)
+    options = conversion_engine.options_from_settings({"workers": "1", "threads": "1", "speed_profile": "realtime"})
+    tasks = [{'path': clip_path, 'convert_ogg': True, 'convert_webm': False, 'job_id': 7}]
+    summary = conversion_engine.BatchRunner(tasks, options, metrics=recorder).run()
+    with open(events_path, "r") as f:
+        events = [json.loads(line) for line in f]
+    kinds = [event["event"] for event in events]
+    finished = events[-1]
+    passed_events = kinds[0] == "job_started" and "job_progress" in kinds and kinds[-1] == "job_finished" and \
+                    finished["job_id"] == 7 and finished["status"] == "success" and finished["processes"] == 1 and \
+                    finished["user_cpu_seconds"] > 0 and finished["peak_rss_kb"] > 0 and \
+                    finished["read_bytes"] >= os.path.getsize(clip_path) and finished["written_bytes"] > 0 and \
+                    finished["output_bytes"] > 0 and abs(finished["media_seconds"] - 2) < 0.2 and finished["speed"] > 0 and \
+                    summary["cpu_seconds"] > 0 and summary["peak_rss_kb"] == finished["peak_rss_kb"]
+    print_test_result(f"{test_name} - Job Started, Progress and Finished Events", passed_events, f"Events: {kinds}, finished: {finished}")
+
+    with open(prometheus_path, "r") as f:
+        exported = f.read().splitlines()
+    passed_prometheus = 'mp4_converter_jobs_total{status="success"} 1' in exported and \
+                        "# TYPE mp4_converter_cpu_seconds_total counter" in exported and \
+                        "mp4_converter_jobs_running 0" in exported and \
+                        any(line.startswith("mp4_converter_encoded_media_seconds_total 2") for line in exported) and \
+                        not os.path.exists(prometheus_path + ".tmp")
+    print_test_result(f"{test_name} - Prometheus Textfile Written", passed_prometheus, "\n".join(exported))
+
+    cli_events_path = get_abs_path("test_files/cli_metrics.jsonl")
+    cli = subprocess.run(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "convert_cli.py"),
+         get_abs_path("test_files/dir1/test_video1.mp4"), "--no-preflight", "--formats", "ogg", "--json",
+         "--metrics-log", cli_events_path],
+        capture_output=True, text=True
+    )
+    with open(cli_events_path, "r") as f:
+        cli_events = [json.loads(line) for line in f]
+    passed_cli = cli.returncode == 1 and [event["event"] for event in cli_events] == ["job_started", "job_finished"] and \
+                 cli_events[-1]["status"] == "error"
+    print_test_result(f"{test_name} - CLI --metrics-log", passed_cli, f"Exit code {cli.returncode}, events: {cli_events}")
+    print_test_result(f"{test_name} - No Export Unless Configured",
+                      job_metrics.MetricsRecorder.from_environment() is None or
+                      os.environ.get(job_metrics.METRICS_LOG_ENV) or os.environ.get(job_metrics.PROMETHEUS_FILE_ENV))
+
+def test_case_19_watch_folder(app_window):
+    test_name = "Test Case 19: Watch-Folder Mode"
+    print(f"\n--- Running {test_name} ---")
+    cleanup_test_environment()
+    setup_test_environment()
+    import queue
+    import folder_watch
+
+    watch_dir = get_abs_path("test_files/watch")
+    os.makedirs(os.path.join(watch_dir, "sub"))
+    default_tick = folder_watch.WATCH_TICK
+    folder_watch.WATCH_TICK = 0.1
+
+    def start_watcher(watcher, enqueue):
+        stop_event = threading.Event()
+        thread = threading.Thread(target=watcher.run, args=(enqueue, stop_event), daemon=True)
+        thread.start()
+        return stop_event, thread
+
+    def wait_for(condition, timeout=10):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return condition()
+
+    try:
+        for use_inotify in (True, False):
+            mode = "inotify" if use_inotify else "Polling"
+            handed_on = []
+            watcher = folder_watch.FolderWatcher([watch_dir], recursive=True, settle_seconds=0.6, poll_interval=0.2,
+                                                 use_inotify=use_inotify)
+            stop_event, thread = start_watcher(watcher, lambda path: handed_on.append(path) or True)
+            upload = os.path.join(watch_dir, "sub", f"upload_{mode}.mp4")
+            with open(upload, "wb") as f:
+                for _ in range(10): # A slow copy: 1s of writes
+                    f.write(b"x" * 1000)
+                    f.flush()
+                    time.sleep(0.1)
+                during_copy = list(handed_on)
+            settled = wait_for(lambda: handed_on == [upload], timeout=5)
+            new_dir = os.path.join(watch_dir, f"new_{mode}")
+            os.makedirs(new_dir)
+            late = os.path.join(new_dir, "late.mp4")
+            with open(late, "wb") as f:
+                f.write(b"late")
+            with open(os.path.join(watch_dir, "notes.txt"), "w") as f:
+                f.write("not a video")
+            found_late = wait_for(lambda: late in handed_on, timeout=5)
+            time.sleep(1.0)
+            passed_settle = during_copy == [] and settled and found_late and len(handed_on) == 2 and \
+                            (watcher.inotify is not None) == (use_inotify and sys.platform.startswith("linux"))
+            print_test_result(f"{test_name} - {mode}: Files Handed On Once, After Upload Settles", passed_settle,
+                              f"During copy: {during_copy}, handed on: {handed_on}")
+
+            os.remove(upload)
+            os.remove(late)
+            forgotten = wait_for(lambda: not watcher.handed_on, timeout=5) if not use_inotify else \
+                        wait_for(lambda: upload not in watcher.handed_on and late not in watcher.handed_on, timeout=5)
+            stop_event.set()
+            thread.join(5)
+            print_test_result(f"{test_name} - {mode}: Deleted Files Forgotten, Watcher Stops", forgotten and not thread.is_alive(),
+                              f"Remembered: {watcher.handed_on}")
+
+        # Backpressure: nobody consumes the queue, so the watcher stops handing on files at its size
+        work = queue.Queue(maxsize=1)
+
+        def bounded_enqueue(path):
+            while not stop_event.is_set():
+                try:
+                    work.put(path, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        burst = [os.path.join(watch_dir, f"burst_{i}.mp4") for i in range(3)]
+        for path in burst:
+            with open(path, "wb") as f:
+                f.write(b"burst")
+        watcher = folder_watch.FolderWatcher([watch_dir], settle_seconds=0.2)
+        stop_event, thread = start_watcher(watcher, bounded_enqueue)
+        time.sleep(1.0)
+        blocked = work.qsize() == 1 and len(watcher.handed_on) == 1
+        received = []
+        while len(received) < 3:
+            try:
+                received.append(work.get(timeout=5))
+            except queue.Empty:
+                break
+        stop_event.set()
+        thread.join(5)
+        print_test_result(f"{test_name} - Bounded Queue Holds Back the Watcher", blocked and sorted(received) == burst,
+                          f"Received: {received}")
+        for path in burst:
+            os.remove(path)
+
+        if not shutil.which("ffmpeg"):
+            print("  FFmpeg not found; skipping the watch-and-convert test.")
+            return
+        clip_path = os.path.join(watch_dir, "dropped.mp4")
+        subprocess.run(
+            ["ffmpeg", "-v", "error", "-y", "-f", "lavfi", "-i", "testsrc2=size=160x90:rate=25", "-t", "1",
+             "-c:v", "libx264", clip_path],
+            check=True
+        )
+        summaries = []
+        stop_event = threading.Event()
+
+        def on_batch_finished(summary):
+            summaries.append(summary)
+            stop_event.set()
+        options = conversion_engine.options_from_settings({"workers": "1", "threads": "1", "incremental": True})
+        watcher_thread = threading.Thread(
+            target=folder_watch.watch_and_convert,
+            args=([watch_dir], options, True, False),
+            kwargs={"recursive": True, "stop_event": stop_event, "on_batch_finished": on_batch_finished, "settle_seconds": 0.3},
+            daemon=True
+        )
+        watcher_thread.start()
+        watcher_thread.join(60)
+        converted = os.path.join(watch_dir, "converted", "dropped.ogg")
+        passed_convert = not watcher_thread.is_alive() and len(summaries) == 1 and summaries[0]["successful_ogg"] == 1 and \
+                         os.path.exists(converted)
+        print_test_result(f"{test_name} - Dropped File Converted, Outputs Not Watched", passed_convert, f"Summaries: {summaries}")
+    finally:
+        folder_watch.WATCH_TICK = default_tick
+
+def test_case_20_distributed_workers(app_window):
+    test_name = "Test Case 20: Distributed Coordinator and Workers"
+    print(f"\n--- Running {test_name} ---")
+    cleanup_test_environment()
+    setup_test_environment()
+    import signal
+    import urllib.error
+    import distributed
+    import job_broker
+
+    def task(path, duration, webm=False):
+        return {'path': path, 'convert_ogg': True, 'convert_webm': webm, 'duration': duration}
+
+    broker = job_broker.JobBroker(":memory:", lease_seconds=0.2, max_attempts=2)
+    broker.submit([task("short", 10), task("long", 100), task("webm", 10, webm=True)], {"resolution": None})
+    order = [broker.claim("w1")["task"]["path"] for _ in range(3)]
+    print_test_result(f"{test_name} - Jobs Claimed Longest First", order == ["long", "webm", "short"] and broker.claim("w1") is None,
+                      f"Order: {order}")
+
+    broker = job_broker.JobBroker(":memory:", lease_seconds=0.2, max_attempts=2)
+    job_id = broker.submit([task("a", 10)], {"resolution": None})[0]
+    broker.claim("dead")
+    time.sleep(0.3)
+    requeued = broker.claim("alive")
+    stale_rejected = not broker.complete("dead", job_id, {"status": "success"}) and not broker.heartbeat("dead", job_id)
+    kept_alive = broker.heartbeat("alive", job_id)
+    time.sleep(0.3)
+    lost_twice = broker.requeue_expired() == 1
+    failed = broker.jobs([job_id])[0]
+    passed_lease = requeued is not None and requeued["id"] == job_id and stale_rejected and kept_alive and lost_twice and \
+                   failed["state"] == job_broker.BROKER_FINISHED and failed["result"]["status"] == "error" and \
+                   broker.status()["results"] == {"error": 1}
+    print_test_result(f"{test_name} - Expired Lease Requeued, Stale Worker Rejected, Attempts Limited", passed_lease, f"Job: {failed}")
+
+    # Without a token the coordinator only listens on loopback, and workers only write under their allowed paths
+    allowed = get_abs_path("test_files/dir1")
+    restricted = distributed.restrict_path_options(
+        {"output_root": os.path.join(allowed, "out"), "scratch_dir": "/etc", "encode_cache_dir": allowed + "-evil", "workers": 2},
+        [allowed]
+    )
+    passed_exposure = distributed.main(["coordinator", "--host", "0.0.0.0", "--port", "0"]) == 2 and \
+                      distributed.is_loopback_host("127.0.0.1") and distributed.is_loopback_host("localhost") and \
+                      not distributed.is_loopback_host("0.0.0.0") and \
+                      restricted == {"output_root": os.path.join(allowed, "out"), "scratch_dir": None, "encode_cache_dir": None, "workers": 2}
+    print_test_result(f"{test_name} - Open Bind Needs a Token, Job Paths Restricted on Workers", passed_exposure, f"Options: {restricted}")
+
+    server = distributed.start_coordinator(":memory:", port=0, token="secret", lease_seconds=1.5)
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        try:
+            distributed.CoordinatorClient(url, "wrong").status()
+            rejected = False
+        except urllib.error.HTTPError as e:
+            rejected = e.code == 403
+        print_test_result(f"{test_name} - Wrong Token Rejected", rejected)
+
+        if not shutil.which("ffmpeg"):
+            print("  FFmpeg not found; skipping the multi-worker test.")
+            return
+        paths = []
+        for name, size, seconds in (("long", "320x180", "20"), ("short1", "160x90", "1"), ("short2", "160x90", "1")):
+            path = get_abs_path(f"test_files/dir1/{name}.mp4")
+            subprocess.run(
+                ["ffmpeg", "-v", "error", "-y", "-f", "lavfi", "-i", f"testsrc2=size={size}:rate=25", "-t", seconds,
+                 "-c:v", "libx264", path],
+                check=True
+            )
+            paths.append(path)
+        cli = subprocess.run(
+            [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "convert_cli.py"),
+             get_abs_path("test_files/dir1"), "--submit", url, "--token", "secret", "--formats", "ogg", "--json"],
+            capture_output=True, text=True
+        )
+        submitted = json.loads(cli.stdout)["ids"] if cli.returncode == 0 else []
+        # Dummy test_video1/2 fail pre-flight on the worker; the three clips convert
+        print_test_result(f"{test_name} - CLI --submit Queues the Folder", len(submitted) == 5, f"{cli.stdout}{cli.stderr[-300:]}")
+
+        client = distributed.CoordinatorClient(url, "secret")
+        worker_command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "distributed.py"), "worker", url,
+                          "--token", "secret", "--poll-interval", "0.2"]
+        doomed = subprocess.Popen(worker_command + ["--name", "doomed"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                  start_new_session=True)
+        deadline = time.monotonic() + 30
+        while client.status()["jobs"]["running"] == 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        os.killpg(doomed.pid, signal.SIGKILL) # The whole node dies: worker and its FFmpeg
+        doomed.wait()
+
+        workers = [subprocess.Popen(worker_command + ["--name", f"node{i}"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                   for i in range(2)]
+        deadline = time.monotonic() + 120
+        while client.status()["jobs"]["finished"] < len(submitted) and time.monotonic() < deadline:
+            time.sleep(0.2)
+        for worker in workers:
+            worker.terminate()
+            worker.wait()
+        jobs = {job["path"]: job for job in client.jobs(submitted)}
+        long_job = jobs.get(paths[0], {})
+        passed_workers = all(jobs[path]["result"] and jobs[path]["result"]["status"] == "success" for path in paths) and \
+                         long_job["attempts"] == 2 and long_job["result"]["worker"].startswith("node") and \
+                         jobs[get_abs_path("test_files/dir1/test_video1.mp4")]["result"]["status"] == "error" and \
+                         all(os.path.exists(get_abs_path(f"test_files/dir1/converted/{name}.ogg")) for name in ("long", "short1", "short2")) and \
+                         {job["result"]["worker"].split("/")[0] for job in jobs.values()} <= {"node0", "node1"}
+        print_test_result(f"{test_name} - Dead Worker's Job Requeued, Jobs Finished by Other Workers", passed_workers,
+                          f"Jobs: {[(job['path'], job['attempts'], job['result']) for job in jobs.values()]}")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_case_21_resolution_ladder(app_window):
+    test_name = "Test Case 21: Resolution Ladder From One Decode"
+    print(f"\n--- Running {test_name} ---")
+    cleanup_test_environment()
+    setup_test_environment()
+    import ladder
+    import scheduler
+
+    options = conversion_engine.options_from_settings({"ladder": "1080p, 480p,bogus,720p"})
+    passed_parse = options["ladder"] == [480, 720, 1080] and \
+                   conversion_engine.options_from_settings({"ladder": True})["ladder"] == [480, 720, 1080] and \
+                   conversion_engine.options_from_settings({})["ladder"] == [] and \
+                   ladder.ladder_heights([480, 720, 1080], 720) == [480, 720] and ladder.ladder_heights([480, 720], 360) == [360]
+    single = conversion_engine.options_from_settings({})
+    settings = conversion_engine.ConversionManifest.format_settings(options, "WebM")
+    passed_settings = conversion_engine.ConversionManifest.format_settings(single, "WebM").get("ladder", "absent") == "absent" and \
+                      settings["ladder"] == [480, 720, 1080] and settings["resolution"] is None
+    task = {'path': "a.mp4", 'convert_ogg': False, 'convert_webm': True, 'duration': 10, 'height': 720}
+    ladder_cost = scheduler.estimate_cost(task, "scale=-2:480", [480, 720, 1080])
+    passed_cost = ladder_cost == scheduler.estimate_cost(task, "scale=-2:480") + scheduler.estimate_cost(task, "scale=-2:720")
+    print_test_result(f"{test_name} - Ladder Setting, Manifest Settings and Cost", passed_parse and passed_settings and passed_cost,
+                      f"Options: {options['ladder']}, settings: {settings}, cost: {ladder_cost}")
+
+    renditions = [(480, "OGG", "o480.ogg"), (480, "WebM", "o480.webm"), (720, "OGG", "o720.ogg"), (720, "WebM", "o720.webm")]
+    command = ladder.build_ladder_command("in.mp4", renditions, 720, "64k", 5, 30, 2)
+    graph = command[command.index("-filter_complex") + 1]
+    passed_command = command.count("-i") == 1 and graph.startswith("[0:v:0]split=2[s0][s1];") and \
+                     "[s0]scale=-2:480,split=2[v0_0][v0_1]" in graph and "[s1]null,split=2[v1_0][v1_1]" in graph and \
+                     graph.count("scale=") == 1 and command.count("libvpx-vp9") == 2 and command.count("libtheora") == 2 and \
+                     command[-1] == "o720.webm"
+    print_test_result(f"{test_name} - One Input, One Split, One Scale per Rung", passed_command, f"Command: {command}")
+
+    if not shutil.which("ffmpeg"):
+        print("  FFmpeg not found; skipping the ladder encode test.")
+        return
+    source = get_abs_path("test_files/dir1/ladder.mp4")
+    subprocess.run(
+        ["ffmpeg", "-v", "error", "-y", "-f", "lavfi", "-i", "testsrc2=size=320x180:rate=25", "-f", "lavfi",
+         "-i", "sine=frequency=440", "-t", "1", "-c:v", "libx264", "-c:a", "aac", "-shortest", source],
+        check=True
+    )
+    folder = get_abs_path("test_files/dir1/converted/ladder")
+    # Tiny rungs keep the encode fast; 480 is above the 180-line source and is dropped
+    result = conversion_engine.convert_video(source, True, True, "scale=-2:480", "64k", 5, 40, 1, ladder=[90, 144, 480])
+    try:
+        with open(os.path.join(folder, "manifest.json")) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    entries = {(entry["format"], entry["height"]): entry for entry in manifest.get("renditions", [])}
+    passed_encode = result["status"] == "success" and sorted(entries) == [("OGG", 90), ("OGG", 144), ("WebM", 90), ("WebM", 144)] and \
+                    entries[("WebM", 144)]["width"] == 256 and entries[("WebM", 144)]["file"] == "ladder_144p.webm" and \
+                    all(entry["bytes"] > 0 and entry["bitrate"] for entry in entries.values()) and \
+                    result["outputs"] == {"OGG": os.path.join(folder, "ladder_144p.ogg"), "WebM": os.path.join(folder, "ladder_144p.webm")} and \
+                    len(result["renditions"]) == 4 and not any(name.startswith(".") for name in os.listdir(folder))
+    print_test_result(f"{test_name} - Renditions and Manifest Written, No Upscaled Rung", passed_encode,
+                      f"Result: {result}, manifest: {manifest}")
+
+    result = conversion_engine.convert_video(source, False, True, None, "64k", 5, 40, 1, ladder=[90])
+    with open(os.path.join(folder, "manifest.json")) as f:
+        entries = sorted((entry["format"], entry["height"]) for entry in json.load(f)["renditions"])
+    passed_rerun = result["status"] == "success" and entries == [("OGG", 90), ("OGG", 144), ("WebM", 90)] and \
+                   not os.path.exists(os.path.join(folder, "ladder_144p.webm"))
+    print_test_result(f"{test_name} - Dropped Rung Removed, Other Format Kept", passed_rerun, f"Renditions: {entries}")
+
+    # A hand-edited manifest cannot make a rerun delete files outside the ladder folder
+    victims = [get_abs_path("test_files/dir1/victim.webm"), get_abs_path("test_files/dir1/converted/ladder_360p.webm")]
+    for victim in victims:
+        with open(victim, "w") as f:
+            f.write("not a rendition")
+    with open(os.path.join(folder, "manifest.json")) as f:
+        manifest = json.load(f)
+    manifest["renditions"] += [{"format": "WebM", "height": 360, "file": "../ladder_360p.webm"},
+                               {"format": "WebM", "height": 720, "file": victims[0]}]
+    with open(os.path.join(folder, "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+    result = conversion_engine.convert_video(source, False, True, None, "64k", 5, 40, 1, ladder=[90])
+    passed_outside = result["status"] == "success" and all(os.path.exists(victim) for victim in victims)
+    print_test_result(f"{test_name} - Manifest Entries Outside the Folder Not Deleted", passed_outside, f"Result: {result}")
+
+def test_case_22_stream_copy_and_audio_only(app_window):
+    test_name = "Test Case 22: Stream Copy and Audio-only OGG"
+    print(f"\n--- Running {test_name} ---")
+    cleanup_test_environment()
+    setup_test_environment()
+    import media_probe
+    import scheduler
+
+    vp9_opus = {'path': "a.mp4", 'video_codec': "vp9", 'audio_codec': "opus", 'audio_bitrate': 48000, 'resolution': None}
+    plan = media_probe.plan_stream_copy(vp9_opus, ["OGG", "WebM"], "64k")
+    scaled = media_probe.plan_stream_copy(dict(vp9_opus, resolution="scale=-2:480"), ["WebM"], "32k")
+    unprobed = media_probe.plan_stream_copy({'path': "b.mp4"}, ["OGG", "WebM"], None)
+    h264_aac = media_probe.plan_stream_copy(dict(vp9_opus, video_codec="h264", audio_codec="aac"), ["WebM"], None)
+    passed_plan = plan == {"OGG": {"video": False, "audio": True}, "WebM": {"video": True, "audio": True}} and \
+                  scaled == {"WebM": {"video": False, "audio": False}} and \
+                  not any(any(streams.values()) for streams in list(unprobed.values()) + list(h264_aac.values())) and \
+                  media_probe.bitrate_bps("1.5M") == 1500000 and media_probe.bitrate_bps("Original") is None
+    print_test_result(f"{test_name} - Copy Planned Only for Matching Codecs, No Scaling, Bitrate Within Budget", passed_plan,
+                      f"Plan: {plan}, scaled: {scaled}")
+
+    command = conversion_engine.build_single_decode_command("in.mp4", "o.ogg", "o.webm", None, "64k", 5, 30, 2, copy_streams=plan)
+    webm_part = command[command.index("o.ogg") + 1:]
+    audio_command = conversion_engine.build_audio_only_command("in.mp4", "o.ogg", "64k")
+    options = conversion_engine.options_from_settings({"stream_copy": True, "ogg_audio_only": True})
+    task = {'path': "a.mp4", 'convert_ogg': True, 'convert_webm': True, 'duration': 60, 'height': 720}
+    passed_command = "libtheora" in command and "libvorbis" not in command and "libvpx-vp9" not in command and \
+                     webm_part.count("copy") == 2 and "0:v:0" not in audio_command and "-vn" in audio_command and \
+                     "libvorbis" in audio_command and \
+                     conversion_engine.ConversionManifest.format_settings(options, "OGG")["ogg_audio_only"] is True and \
+                     "stream_copy" not in conversion_engine.ConversionManifest.format_settings(conversion_engine.options_from_settings({}), "WebM") and \
+                     scheduler.estimate_cost(dict(task, copy_streams=plan), ogg_audio_only=True) < scheduler.estimate_cost(task) / 20
+    print_test_result(f"{test_name} - Copied Streams Not Encoded, Audio-only Maps No Video", passed_command,
+                      f"Command: {command}, audio: {audio_command}")
+
+    # A source without video is planned when only its audio is wanted
+    audio_info = {"duration": 30.0, "video": None, "audio": {"codec": "aac", "bit_rate": 128000}}
+    ogg_task = {'path': "talk.mp4", 'convert_ogg': True, 'convert_webm': False}
+    audio_plan = media_probe.plan_task(ogg_task, audio_info, "scale=-2:480", ogg_audio_only=True)
+    passed_audio_plan = audio_plan is not None and audio_plan["has_audio"] and audio_plan["video_codec"] is None and \
+                        media_probe.plan_task(ogg_task, audio_info, "scale=-2:480") is None and \
+                        media_probe.plan_task(dict(ogg_task, convert_webm=True), audio_info, None, ogg_audio_only=True) is not None and \
+                        media_probe.plan_task(ogg_task, {"duration": 30.0, "video": {"codec": "h264", "height": 90}, "audio": None},
+                                              None, ogg_audio_only=True) is None
+    print_test_result(f"{test_name} - Audio-only Source Planned Only for Audio Outputs", passed_audio_plan, f"Plan: {audio_plan}")
+
+    if not shutil.which("ffmpeg"):
+        print("  FFmpeg not found; skipping the stream copy conversion test.")
+        return
+    clips = {}
+    for name, video_codec in (("webm_ready", "libvpx-vp9"), ("podcast", "libx264")):
+        clips[name] = get_abs_path(f"test_files/dir1/{name}.mp4")
+        subprocess.run(
+            ["ffmpeg", "-v", "error", "-y", "-f", "lavfi", "-i", "testsrc2=size=160x90:rate=25", "-f", "lavfi", "-i", "sine",
+             "-t", "1", "-c:v", video_codec, "-c:a", "libopus", "-b:a", "48k", clips[name]],
+            check=True
+        )
+    options = conversion_engine.options_from_settings({"stream_copy": True, "resolution": "Original", "audio_bitrate": "64k",
+                                                       "workers": "1", "threads": "1"})
+    summary = conversion_engine.BatchRunner([{'path': clips["webm_ready"], 'convert_ogg': False, 'convert_webm': True}], options).run()
+    webm_info = media_probe.probe_media(get_abs_path("test_files/dir1/converted/webm_ready.webm")) or {}
+    options = conversion_engine.options_from_settings({"ogg_audio_only": True, "audio_bitrate": "Original", "workers": "1", "threads": "1"})
+    audio_summary = conversion_engine.BatchRunner([{'path': clips["podcast"], 'convert_ogg': True, 'convert_webm': False}], options).run()
+    ogg_info = media_probe.probe_media(get_abs_path("test_files/dir1/converted/podcast.ogg")) or {}
+    clips["talk"] = get_abs_path("test_files/dir1/talk.mp4")
+    subprocess.run(["ffmpeg", "-v", "error", "-y", "-f", "lavfi", "-i", "sine", "-t", "1", "-c:a", "aac", clips["talk"]], check=True)
+    talk_summary = conversion_engine.BatchRunner([{'path': clips["talk"], 'convert_ogg': True, 'convert_webm': False}], options).run()
+    talk_info = media_probe.probe_media(get_abs_path("test_files/dir1/converted/talk.ogg")) or {}
+    print_test_result(f"{test_name} - Audio-only Source Passes Pre-flight to Audio-only OGG",
+                      talk_summary["successful_ogg"] == 1 and (talk_info.get("audio") or {}).get("codec") == "vorbis",
+                      f"Summary errors: {talk_summary.get('error_details')}, OGG: {talk_info}")
+    passed_convert = summary["successful_webm"] == 1 and (webm_info.get("video") or {}).get("codec") == "vp9" and \
+                     (webm_info.get("audio") or {}).get("codec") == "opus" and \
+                     audio_summary["successful_ogg"] == 1 and ogg_info.get("video") is None and \
+                     (ogg_info.get("audio") or {}).get("codec") == "vorbis"
+    print_test_result(f"{test_name} - VP9/Opus Source Copied to WebM, Podcast Extracted Without Video", passed_convert,
+                      f"WebM: {webm_info}, OGG: {ogg_info}")
+
+def test_case_23_source_dedupe(app_window):
+    test_name = "Test Case 23: Content-Hash Deduplication of Sources"
+    print(f"\n--- Running {test_name} ---")
+    cleanup_test_environment()
+    setup_test_environment()
+    import source_dedupe
+
+    content = os.urandom(3 * 1024 * 1024)
+    near_twin = content[:1024 * 1024] + bytes(1024 * 1024) + content[2 * 1024 * 1024:] # Same size, head and tail
+    paths = {name: get_abs_path(f"test_files/{folder}/{name}.mp4")
+             for name, folder in (("original", "dir1"), ("copy", "dir2"), ("near_twin", "dir2"), ("other", "dir1"))}
+    for name, data in (("original", content), ("copy", content), ("near_twin", near_twin), ("other", content[:-1])):
+        with open(paths[name], "wb") as f:
+            f.write(data)
+    groups = source_dedupe.find_duplicates([paths["original"], paths["near_twin"], paths["other"], paths["copy"],
+                                            get_abs_path("test_files/dir1/test_video1.mp4")])
+    passed_find = groups == [[paths["original"], paths["copy"]]] and \
+                  source_dedupe.partial_hash(paths["near_twin"]) == source_dedupe.partial_hash(paths["original"]) and \
+                  source_dedupe.full_hash(paths["copy"]) == source_dedupe.full_hash(paths["original"]) != source_dedupe.full_hash(paths["near_twin"])
+    print_test_result(f"{test_name} - Identical Files Grouped, Partial-Hash Collision Rejected by Full Hash", passed_find, f"Groups: {groups}")
+
+    linked_path = get_abs_path("test_files/dir2/linked.bin")
+    method = source_dedupe.link_output(paths["original"], linked_path)
+    with open(linked_path, "rb") as f:
+        passed_link = method in (source_dedupe.LINK_REFLINK, source_dedupe.LINK_HARDLINK) and f.read() == content and \
+                      not os.path.exists(get_abs_path("test_files/dir2/.linked.bin.link"))
+    print_test_result(f"{test_name} - Output Linked, Not Copied", passed_link, f"Method: {method}")
+
+    encoded = []
+
+    def fake_convert(path, convert_ogg, convert_webm, *args, **kwargs):
+        encoded.append((path, convert_ogg, convert_webm))
+        output_folder = os.path.join(os.path.dirname(path), "converted")
+        os.makedirs(output_folder, exist_ok=True)
+        outputs = {}
+        for format_name, wanted, extension in (("OGG", convert_ogg, ".ogg"), ("WebM", convert_webm, ".webm")):
+            if wanted:
+                outputs[format_name] = os.path.join(output_folder, os.path.splitext(os.path.basename(path))[0] + extension)
+                with open(outputs[format_name], "w") as f:
+                    f.write(f"{format_name} of {os.path.basename(path)}")
+        return {"path": path, "status": "success", "formats": list(outputs), "errors": [], "outputs": outputs}
+
+    tasks = [{'path': paths["original"], 'convert_ogg': True, 'convert_webm': False},
+             {'path': paths["copy"], 'convert_ogg': False, 'convert_webm': True},
+             {'path': paths["near_twin"], 'convert_ogg': True, 'convert_webm': False}]
+    options = conversion_engine.options_from_settings({"dedupe": True, "preflight": False, "workers": "1", "threads": "1"})
+    summary = conversion_engine.BatchRunner(tasks, options, fake_convert).run()
+    results = {result["path"]: result for result in summary["results"]}
+    copy_webm = get_abs_path("test_files/dir2/converted/copy.webm")
+    original_webm = get_abs_path("test_files/dir1/converted/original.webm")
+    with open(copy_webm) as f:
+        linked_content = f.read()
+    passed_batch = sorted(encoded) == sorted([(paths["original"], True, True), (paths["near_twin"], True, False)]) and \
+                   linked_content == "WebM of original.mp4" and not os.path.exists(original_webm) and \
+                   results[paths["original"]]["formats"] == ["OGG"] and results[paths["copy"]]["formats"] == ["WebM"] and \
+                   results[paths["copy"]]["deduplicated_from"] == paths["original"] and \
+                   summary["deduplicated_files"] == 1 and summary["dedupe_saved_bytes"] == len(linked_content) and \
+                   summary["successful_webm"] == 1 and summary["successful_ogg"] == 2 and summary["total"] == 3
+    print_test_result(f"{test_name} - Duplicate Encoded Once, Its Outputs Linked, Savings Reported", passed_batch,
+                      f"Encoded: {encoded}, summary: { {k: v for k, v in summary.items() if k != 'results'} }")
+
+def test_case_24_encode_cache(app_window):
+    test_name = "Test Case 24: Content-Addressed Encode Cache"
+    print(f"\n--- Running {test_name} ---")
+    cleanup_test_environment()
+    setup_test_environment()
+    import encode_cache
+
+    source = get_abs_path("test_files/dir1/test_video1.mp4")
+    command = ["ffmpeg", "-y", "-i", source, "-c:v", "libvpx-vp9", "-crf", "30", "-threads", "2", "/a/.x.partial.webm"]
+    moved = ["ffmpeg", "-y", "-i", "/b/y.mp4", "-c:v", "libvpx-vp9", "-crf", "30", "-threads", "4", "/b/.y.partial.webm"]
+    passed_args = encode_cache.normalized_arguments(command, source, ["/a/.x.partial.webm"]) == \
+                  encode_cache.normalized_arguments(moved, "/b/y.mp4", ["/b/.y.partial.webm"]) == \
+                  ["-y", "-i", "<input>", "-c:v", "libvpx-vp9", "-crf", "30", "<output0>"] and \
+                  encode_cache.parse_size("1.5G") == 3 * 1024 ** 3 // 2 and encode_cache.parse_size("x") is None
+    print_test_result(f"{test_name} - Paths and Thread Count Left Out of the Key", passed_args, "")
+
+    cache = encode_cache.EncodeCache(get_abs_path("test_files/encode_cache"), max_bytes=10)
+    outputs = {}
+    for name in ("first", "second"):
+        outputs[name] = get_abs_path(f"test_files/dir1/{name}.webm")
+        with open(outputs[name], "w") as f:
+            f.write(f"{name:6}") # 6 bytes each: the cache holds one
+    key_first = cache.key(source, command, [outputs["first"]])
+    key_second = cache.key(source, command[:6] + ["40"] + command[7:], [outputs["second"]])
+    cache.store(key_first, [outputs["first"]])
+    time.sleep(0.05)
+    cache.store(key_second, [outputs["second"]])
+    restored = get_abs_path("test_files/dir2/restored.webm")
+    hit = cache.fetch(key_second, [restored])
+    miss = cache.fetch(key_first, [restored])
+    stats = cache.stats()
+    with open(restored) as f:
+        passed_lru = key_first != key_second and hit and not miss and f.read() == "second" and \
+                     stats["files"] == 1 and stats["bytes"] == 6 and stats["evictions"] == 1 and \
+                     stats["hits"] == 1 and stats["misses"] == 1 and stats["stores"] == 2
+    print_test_result(f"{test_name} - Least Recently Used Entry Evicted, Stats Reported", passed_lru, f"Stats: {stats}")
+
+    # Recency comes from the last fetch, and fetching leaves the user's (hard-linked) outputs' mtimes alone
+    cache = encode_cache.EncodeCache(get_abs_path("test_files/encode_cache_lru"), max_bytes=12)
+    keys = {}
+    for name in ("a", "b", "c"):
+        outputs[name] = get_abs_path(f"test_files/dir1/{name}.webm")
+        with open(outputs[name], "w") as f:
+            f.write(f"{name:6}")
+        os.utime(outputs[name], (1000000000, 1000000000))
+        keys[name] = cache.key(source, command[:6] + [name] + command[7:], [outputs[name]])
+    cache.store(keys["a"], [outputs["a"]])
+    time.sleep(0.05)
+    cache.store(keys["b"], [outputs["b"]])
+    time.sleep(0.05)
+    fetched = cache.fetch(keys["a"], [get_abs_path("test_files/dir2/a_again.webm")])
+    time.sleep(0.05)
+    cache.store(keys["c"], [outputs["c"]])
+    kept = [name for name in ("a", "b", "c") if cache.fetch(keys[name], [get_abs_path(f"test_files/dir2/{name}_check.webm")])]
+    mtimes = [os.stat(outputs[name]).st_mtime for name in ("a", "b", "c")]
+    passed_recency = fetched and kept == ["a", "c"] and mtimes == [1000000000] * 3
+    print_test_result(f"{test_name} - Fetch Renews an Entry Without Touching the Outputs", passed_recency, f"Kept: {kept}, mtimes: {mtimes}")
+
+    # New source hashes are saved once, not per hash, and vanished sources leave the index on eviction
+    index_dir = get_abs_path("test_files/encode_cache_index")
+    cache = encode_cache.EncodeCache(index_dir)
+    copies = []
+    for i in range(3):
+        copies.append(get_abs_path(f"test_files/dir2/copy{i}.mp4"))
+        shutil.copyfile(source, copies[i])
+        cache.source_hash(copies[i])
+    index_path = os.path.join(index_dir, encode_cache.SOURCE_INDEX_FILE)
+    saved_early = os.path.exists(index_path)
+    cache.save_index()
+    with open(index_path) as f:
+        saved = json.load(f)
+    os.remove(copies[0])
+    cache = encode_cache.EncodeCache(index_dir)
+    cache.evict()
+    cache.save_index()
+    with open(index_path) as f:
+        pruned = json.load(f)
+    leftovers = [name for name in os.listdir(index_dir) if ".tmp-" in name]
+    passed_index = not saved_early and sorted(saved) == sorted(os.path.realpath(p) for p in copies) and \
+                   sorted(pruned) == sorted(os.path.realpath(p) for p in copies[1:]) and not leftovers
+    print_test_result(f"{test_name} - Source Index Saved Once per Batch, Missing Sources Pruned", passed_index,
+                      f"Saved before save_index: {saved_early}, saved: {sorted(saved)}, after pruning: {sorted(pruned)}")
+
+    if shutil.which("ffmpeg") is None:
+        print("  FFmpeg not found; skipping the encode cache conversion test.")
+        return
+    clip = get_abs_path("test_files/dir1/lecture.mp4")
+    subprocess.run(
+        ["ffmpeg", "-v", "error", "-y", "-f", "lavfi", "-i", "testsrc2=size=160x90:rate=25", "-f", "lavfi", "-i", "sine",
+         "-t", "1", "-c:v", "libx264", "-c:a", "aac", clip],
+        check=True
+    )
+    moved_clip = get_abs_path("test_files/dir2/lecture_copy.mp4")
+    shutil.copyfile(clip, moved_clip)
+    options = conversion_engine.options_from_settings({
+        "encode_cache": True, "encode_cache_dir": get_abs_path("test_files/encode_cache_real"), "webm_two_pass": True,
+        "resolution": "Original", "workers": "1", "threads": "1"
+    })
+    summary = conversion_engine.BatchRunner([{'path': clip, 'convert_ogg': True, 'convert_webm': True}], options).run()
+    started = []
+    run_ffmpeg = conversion_engine.run_ffmpeg
+    conversion_engine.run_ffmpeg = lambda command, *args, **kwargs: started.append(command) or run_ffmpeg(command, *args, **kwargs)
+    try:
+        cached_summary = conversion_engine.BatchRunner([{'path': moved_clip, 'convert_ogg': True, 'convert_webm': True}], options).run()
+    finally:
+        conversion_engine.run_ffmpeg = run_ffmpeg
+    same_outputs = True
+    for extension in (".ogg", ".webm"):
+        with open(get_abs_path(f"test_files/dir1/converted/lecture{extension}"), "rb") as f, \
+             open(get_abs_path(f"test_files/dir2/converted/lecture_copy{extension}"), "rb") as g:
+            same_outputs = same_outputs and f.read() == g.read()
+    passed_convert = summary["successful_ogg"] == summary["successful_webm"] == 1 and summary["encode_cache"]["stores"] == 1 and \
+                     cached_summary["successful_ogg"] == cached_summary["successful_webm"] == 1 and not started and \
+                     cached_summary["encode_cache"]["hits"] == 1 and same_outputs
+    print_test_result(f"{test_name} - Moved Source Served From the Cache Without Running FFmpeg (Pass 1 Included)", passed_convert,
+                      f"FFmpeg runs: {started}, stats: {summary['encode_cache']} then {cached_summary['encode_cache']}")
+
+def test_case_25_output_root_and_scratch(app_window):
+    test_name = "Test Case 25: Output Root and Scratch Staging"
+    print(f"\n--- Running {test_name} ---")
+    cleanup_test_environment()
+    setup_test_environment()
+    import tempfile
+    import output_placement
+
+    source = get_abs_path("test_files/dir1/sub/clip.mp4")
+    root = get_abs_path("test_files/out")
+    passed_folder = output_placement.output_folder(source) == get_abs_path("test_files/dir1/sub/converted") and \
+                    output_placement.output_folder(source, root, get_abs_path("test_files")) == os.path.join(root, "dir1", "sub") and \
+                    output_placement.output_folder(source, root, get_abs_path("test_files/dir2")) == \
+                    os.path.join(root, get_abs_path("test_files/dir1/sub").lstrip(os.sep))
+    print_test_result(f"{test_name} - Source Folders Mirrored Under the Output Root", passed_folder, "")
+
+    if shutil.which("ffmpeg") is None:
+        print("  FFmpeg not found; skipping the scratch staging conversion test.")
+        return
+    os.makedirs(os.path.dirname(source), exist_ok=True)
+    subprocess.run(
+        ["ffmpeg", "-v", "error", "-y", "-f", "lavfi", "-i", "testsrc2=size=160x90:rate=25", "-t", "1", "-c:v", "libx264", source],
+        check=True
+    )
+    # tmpfs, when there is one, so the outputs are copied across filesystems like on a real scratch disk
+    scratch = tempfile.mkdtemp(dir="/dev/shm" if os.access("/dev/shm", os.W_OK) else get_abs_path("test_files"))
+    finished = []
+    try:
+        options = conversion_engine.options_from_settings({
+            "output_root": root, "source_root": get_abs_path("test_files"), "scratch_dir": scratch,
+            "resolution": "Original", "workers": "1", "threads": "1"
+        })
+        runner = conversion_engine.BatchRunner(
+            [{'path': source, 'convert_ogg': True, 'convert_webm': True}], options,
+            on_file_finished=lambda result: finished.append({f: os.path.exists(p) for f, p in result.get('outputs', {}).items()})
+        )
+        summary = runner.run()
+        scratch_left = os.listdir(scratch)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    passed_convert = summary["successful_ogg"] == summary["successful_webm"] == 1 and \
+                     finished == [{"OGG": True, "WebM": True}] and scratch_left == [] and \
+                     os.path.getsize(os.path.join(root, "dir1", "sub", "clip.webm")) > 0 and \
+                     not os.path.exists(get_abs_path("test_files/dir1/sub/converted"))
+    print_test_result(f"{test_name} - Encoded in Scratch, Shipped to the Mirrored Folder Before the File Finishes", passed_convert,
+                      f"Finished: {finished}, left in scratch: {scratch_left}, errors: {summary['error_details']}")
+
+def test_case_26_device_io_limits(app_window):
+    test_name = "Test Case 26: Per-Device I/O Limits"
+    print(f"\n--- Running {test_name} ---")
+    cleanup_test_environment()
+    setup_test_environment()
+    import device_io
+    import scheduler
+
+    queue = scheduler.JobScheduler()
+    for name, cost in (("usb_long", 3.0), ("ssd", 2.0), ("usb_short", 1.0)):
+        queue.push({'path': name}, cost, group=name.split("_")[0])
+    usb_busy = lambda device: device != "usb"
+    order = [queue.pop(usb_busy)['path'], queue.pop(usb_busy), queue.pop()['path'], queue.pop()['path']]
+    passed_pop = order == ["ssd", None, "usb_long", "usb_short"] and len(queue) == 0
+    print_test_result(f"{test_name} - Tasks on a Busy Device Passed Over, Not Reordered", passed_pop, f"Order: {order}")
+
+    # A long queue on a device at its cap is skipped as a whole, not task by task
+    queue = scheduler.JobScheduler()
+    for i in range(20000):
+        queue.push({'path': f"usb{i}"}, float(i), group="usb")
+    queue.push({'path': "ssd"}, 0.0, group="ssd")
+    checked = []
+    def usb_at_cap(device):
+        checked.append(device)
+        return device != "usb"
+    started = time.monotonic()
+    dispatched = [queue.pop(usb_at_cap) for _ in range(2000)]
+    elapsed = time.monotonic() - started
+    passed_scale = dispatched[0]['path'] == "ssd" and dispatched[1:] == [None] * 1999 and len(queue) == 20000 and \
+                   len(checked) <= 2 * 2000 and elapsed < 1.0 and queue.pop()['path'] == "usb19999"
+    print_test_result(f"{test_name} - 20k Tasks on a Capped Device Do Not Slow Dispatch", passed_scale,
+                      f"{len(checked)} availability checks, {elapsed:.3f}s for 2000 dispatch attempts")
+
+    limiter = device_io.DeviceLimiter("auto", {get_abs_path("test_files"): 1, "/no/such/volume": 4})
+    test_device = device_io.device_of(get_abs_path("test_files/dir1/test_video1.mp4"))
+    limiter.acquire(test_device)
+    blocked = not limiter.available(test_device)
+    limiter.release(test_device)
+    device_io.prefetch(get_abs_path("test_files/dir1/test_video1.mp4")) # Must not raise, with or without posix_fadvise
+    passed_limits = blocked and limiter.available(test_device) and limiter.cap(None) is None and \
+                    device_io.DeviceLimiter(2).cap(test_device) == 2 and device_io.DeviceLimiter().cap(test_device) is None and \
+                    device_io.DeviceLimiter(2, {get_abs_path("test_files"): None}).cap(test_device) is None and \
+                    device_io.DeviceLimiter(1).max_running([test_device, test_device, None]) == 2 and \
+                    device_io.parse_device_limits(["/media/usb=1", "no-cap", "/x=y", "/nvme=off", "/ssd=0"]) == \
+                    {"/media/usb": 1, "/nvme": None, "/ssd": None}
+    print_test_result(f"{test_name} - Caps Resolved per Device, Malformed Limits Dropped", passed_limits, "")
+
+    parsed = [conversion_engine.options_from_settings(dict(settings))["device_concurrency"]
+              for settings in ({}, {"device_concurrency": "off"}, {"device_concurrency": "0"},
+                               {"device_concurrency": "Auto"}, {"device_concurrency": "2"})]
+    passed_default = parsed == [None, None, None, "auto", 2]
+    print_test_result(f"{test_name} - Device Caps Off by Default, Opt-in with auto or N", passed_default, f"Parsed: {parsed}")
+
+    running = [0]
+    peaks = []
+    lock = threading.Lock()
+
+    def fake_convert(path, convert_ogg, convert_webm, *args, **kwargs):
+        with lock:
+            running[0] += 1
+            peaks[-1] = max(peaks[-1], running[0])
+        time.sleep(0.2)
+        with lock:
+            running[0] -= 1
+        return {"path": path, "status": "success", "formats": ["OGG"], "errors": [], "outputs": {}}
+
+    tasks = [{'path': get_abs_path(f"test_files/dir1/test_video{i}.mp4"), 'convert_ogg': True, 'convert_webm': False} for i in (1, 2)] + \
+            [{'path': get_abs_path("test_files/dir2/test_video3.mp4"), 'convert_ogg': True, 'convert_webm': False}]
+    summaries = []
+    for device_settings in ({"device_limits": [get_abs_path("test_files") + "=1"], "prefetch": True}, {}):
+        peaks.append(0)
+        options = conversion_engine.options_from_settings(dict(device_settings, preflight=False, workers="3", threads="1"))
+        summaries.append(conversion_engine.BatchRunner(tasks, options, fake_convert).run())
+    passed_batch = peaks == [1, 3] and all(summary["successful_ogg"] == 3 for summary in summaries)
+    print_test_result(f"{test_name} - Capped Disk Read One File at a Time, Uncapped in Parallel", passed_batch, f"Peak concurrency: {peaks}")
+
 def main():
     print("Initializing QApplication and VideoConverterApp...")
     # QApplication.instance() might return None if no app was ever created.
@@ -320,6 +1965,29 @@ def main():
         test_case_1_ui_interaction_file_addition(window)
         test_case_2_format_selection_conversion(window)
         test_case_3_output_reporting(window)
+        test_case_4_single_decode_command(window)
+        test_case_5_background_conversion(window)
+        test_case_6_concurrency_planning(window)
+        test_case_7_incremental_manifest(window)
+        test_case_8_headless_cli(window)
+        test_case_9_recursive_scanner(window)
+        test_case_10_job_store(window)
+        test_case_11_segmented_encoding(window)
+        test_case_12_speed_profiles(window)
+        test_case_13_two_pass_webm(window)
+        test_case_14_preflight_planner(window)
+        test_case_15_lpt_scheduling(window)
+        test_case_16_cancel_pause_resume(window)
+        test_case_17_benchmark_suite(window)
+        test_case_18_job_metrics(window)
+        test_case_19_watch_folder(window)
+        test_case_20_distributed_workers(window)
+        test_case_21_resolution_ladder(window)
+        test_case_22_stream_copy_and_audio_only(window)
+        test_case_23_source_dedupe(window)
+        test_case_24_encode_cache(window)
+        test_case_25_output_root_and_scratch(window)
+        test_case_26_device_io_limits(window)
 
     except Exception as e:
         print(f"An error occurred during testing: {e}")